@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class DborradorConfig(AppConfig):
     name = 'dborrador'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,145 @@
+'''Asignación de mínimo peso sobre una matriz densa (método húngaro).
+
+Necesita numpy. Quien lo use tiene que importarlo adentro de una función y tener
+un camino alternativo si numpy no está instalado.
+'''
+from collections import namedtuple, defaultdict
+
+import numpy as np
+
+
+class MatrizDePesos(namedtuple('MatrizDePesos', ['pesos', 'permitido', 'filas', 'columnas'])):
+    '''pesos y permitido son matrices (len(filas) x len(columnas)).
+
+    filas: ids de las cargas, una fila por carga.
+    columnas: ids de los turnos, repetidos tantas veces como lugares necesita el turno.
+    Sólo se pueden asignar los pares (fila, columna) con permitido[fila, columna].
+    '''
+
+    @classmethod
+    def de_aristas(cls, sources, targets, aristas):
+        '''{str: int} -> {str: int} -> [{'from', 'to', 'weight'}] -> MatrizDePesos
+
+        Arma la matriz a partir de la entrada de allocating: cada source y cada target
+        aparecen tantas veces como su capacidad. Los ids quedan como str.
+        '''
+        filas = [source for source, cantidad in sources.items() for _ in range(cantidad)]
+        columnas = [target for target, cantidad in targets.items() for _ in range(cantidad)]
+        filas_de = defaultdict(list)
+        for fila, source in enumerate(filas):
+            filas_de[source].append(fila)
+        columnas_de = defaultdict(list)
+        for columna, target in enumerate(columnas):
+            columnas_de[target].append(columna)
+
+        pesos = np.zeros((len(filas), len(columnas)))
+        permitido = np.zeros((len(filas), len(columnas)), dtype=bool)
+        for arista in aristas:
+            indices = np.ix_(filas_de[arista['from']], columnas_de[arista['to']])
+            pesos[indices] = arista['weight']
+            permitido[indices] = True
+        return cls(pesos, permitido, filas, columnas)
+
+    @classmethod
+    def combinar(cls, bloques):
+        '''[(str, MatrizDePesos)] -> MatrizDePesos
+
+        Junta matrices de varios problemas. Las filas con el mismo id son la misma fila.
+        Las columnas de cada bloque pasan a llamarse str(prefijo) + str(columna); los bloques
+        con el mismo prefijo comparten columnas (y tienen que tener las mismas).
+        '''
+        filas = list(dict.fromkeys(fila for _, matriz in bloques for fila in matriz.filas))
+        posicion = {fila: indice for indice, fila in enumerate(filas)}
+        columnas = []
+        primera_columna = {}
+        for prefijo, matriz in bloques:
+            if prefijo not in primera_columna:
+                primera_columna[prefijo] = len(columnas)
+                columnas.extend(f'{prefijo}{columna}' for columna in matriz.columnas)
+
+        pesos = np.zeros((len(filas), len(columnas)))
+        permitido = np.zeros((len(filas), len(columnas)), dtype=bool)
+        for prefijo, matriz in bloques:
+            indices = np.ix_([posicion[fila] for fila in matriz.filas],
+                             primera_columna[prefijo] + np.arange(len(matriz.columnas)))
+            pesos[indices] = np.where(matriz.permitido, matriz.pesos, pesos[indices])
+            permitido[indices] |= matriz.permitido
+        return cls(pesos, permitido, filas, columnas)
+
+    def peso_total(self, pares):
+        '''[(int, int)] -> float, para pares (fila, columna)'''
+        return float(sum(self.pesos[fila, columna] for fila, columna in pares))
+
+
+def _hungaro(costos):
+    '''np.ndarray (n x m, n <= m) -> [int] con la columna de cada fila, minimizando el costo total.
+
+    Es la versión O(n^2 m) con potenciales; el ciclo de adentro está vectorizado sobre las columnas.
+    '''
+    n, m = costos.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    # fila_de[j] es la fila (contando desde 1) que ocupa la columna j; la columna 0 es ficticia
+    fila_de = np.zeros(m + 1, dtype=np.int64)
+    camino = np.zeros(m + 1, dtype=np.int64)
+
+    for i in range(1, n + 1):
+        fila_de[0] = i
+        j0 = 0
+        minimos = np.full(m + 1, np.inf)
+        usadas = np.zeros(m + 1, dtype=bool)
+        while True:
+            usadas[j0] = True
+            i0 = fila_de[j0]
+            libres = ~usadas[1:]
+            reducidos = costos[i0 - 1] - u[i0] - v[1:]
+            mejoran = libres & (reducidos < minimos[1:])
+            minimos[1:][mejoran] = reducidos[mejoran]
+            camino[1:][mejoran] = j0
+
+            candidatos = np.where(libres, minimos[1:], np.inf)
+            j1 = int(np.argmin(candidatos)) + 1
+            delta = candidatos[j1 - 1]
+
+            indices_usadas = np.nonzero(usadas)[0]
+            u[fila_de[indices_usadas]] += delta
+            v[indices_usadas] -= delta
+            minimos[1:][libres] -= delta
+            j0 = j1
+            if fila_de[j0] == 0:
+                break
+
+        while j0:
+            j1 = camino[j0]
+            fila_de[j0] = fila_de[j1]
+            j0 = j1
+
+    columna_de = [-1] * n
+    for j in range(1, m + 1):
+        if fila_de[j]:
+            columna_de[fila_de[j] - 1] = j - 1
+    return columna_de
+
+
+def asignacion_de_minimo_peso(matriz):
+    '''MatrizDePesos -> [(int, int)] con los pares (fila, columna) asignados.
+
+    Maximiza primero la cantidad de pares permitidos y, entre esas asignaciones, minimiza el peso total:
+    como en la encuesta, un peso más bajo es una preferencia más fuerte. Trabaja directamente con pesos float.
+    '''
+    n, m = matriz.pesos.shape
+    if n == 0 or m == 0 or not matriz.permitido.any():
+        return []
+
+    # un par permitido vale más que cualquier diferencia de pesos entre dos asignaciones
+    pesos = np.where(matriz.permitido, matriz.pesos, 0.0)
+    bonificacion = min(n, m) * (np.abs(pesos).max() + 1) + 1
+    valores = np.where(matriz.permitido, bonificacion - pesos, 0.0)
+
+    traspuesta = n > m
+    costos = -(valores.T if traspuesta else valores)
+    columna_de = _hungaro(costos)
+
+    pares = [(columna, fila) if traspuesta else (fila, columna)
+             for fila, columna in enumerate(columna_de) if columna >= 0]
+    return [(fila, columna) for fila, columna in pares if matriz.permitido[fila, columna]]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:10
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dborrador', '0007_auto_20191123_1508'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asignacion',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['intentos'], name='asignacion_intentos_gist'),
+        ),
+    ]
@@ -1,8 +1,18 @@
 from collections import Counter, namedtuple, defaultdict
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.db import transaction
 
 from .models import Asignacion, Preferencia
 from materias.misc import Mapeos
-from materias.models import TipoDocentes, Turno, Cargos, Carga
+from materias.models import TipoDocentes, Turno, Cargos, Carga, Materia
+from encuestas.models import OtrosDatos
+
+
+logger = logging.getLogger(__name__)
 
 
 Problemas = namedtuple('Problemas', ['cargas_no_distribuidas', 'necesidades_no_cubiertas', 'recargas'])
@@ -43,3 +53,318 @@ class Distribucion:
             tipo = Mapeos.tipo_de_carga(carga)
             ret[tipo].append(carga)
         return ret
+
+    @classmethod
+    def preferencias_por_docente(cls, ac, tipo):
+        '''AnnoCuatrimestre -> TipoDocentes -> {docente_id -> [(turno_id, peso_normalizado)]}
+
+        Trae todas las preferencias del período y tipo en una sola consulta.
+        '''
+        ret = defaultdict(list)
+        preferencias = Preferencia.objects.filter(preferencia__turno__anno=ac.anno,
+                                                  preferencia__turno__cuatrimestre=ac.cuatrimestre,
+                                                  preferencia__tipo_docente=tipo.name) \
+                                          .values_list('preferencia__docente_id',
+                                                       'preferencia__turno_id',
+                                                       'peso_normalizado')
+        for docente_id, turno_id, peso in preferencias:
+            ret[docente_id].append((turno_id, peso))
+        return ret
+
+    @classmethod
+    def pesos_para_distribuir(cls, ac, tipo, cargas, targets, tipo_preferencias=None, factor=1):
+        '''AnnoCuatrimestre -> TipoDocentes -> [Carga] -> {str(turno_id): int} -> [{'from', 'to', 'weight'}]
+
+        Arma las aristas para allocating.ListWeightedMap sin hacer consultas por carga.
+        Las preferencias son las que los docentes dieron como tipo_preferencias (por omisión, tipo)
+        y los pesos se multiplican por factor.
+        '''
+        preferencias = cls.preferencias_por_docente(ac, tipo_preferencias or tipo)
+        pesos = []
+        for carga in cargas:
+            carga_id = str(carga.id)
+            for turno_id, peso in preferencias.get(carga.docente_id, []):
+                turno_id = str(turno_id)
+                if turno_id in targets:
+                    pesos.append({'from': carga_id,
+                                  'to': turno_id,
+                                  'weight': peso * factor
+                                  })
+                else:
+                    logger.debug('Tengo una preferencia de la carga %s para el turno %s pero ese turno no necesita docentes de tipo %s',
+                                 carga_id, turno_id, tipo.value)
+        return pesos
+
+    @classmethod
+    def matriz_de_pesos(cls, ac, tipo, cargas, targets, tipo_preferencias=None, factor=1):
+        '''AnnoCuatrimestre -> TipoDocentes -> [Carga] -> {str(turno_id): int} -> hungaro.MatrizDePesos
+
+        Lo mismo que pesos_para_distribuir, pero como matriz (cargas x lugares en turnos):
+        cada turno tiene tantas columnas como lugares en targets. Se arma con operaciones de numpy
+        sobre arreglos de ids, sin un diccionario por arista.
+        '''
+        import numpy as np
+        from .hungaro import MatrizDePesos
+
+        filas = np.array([carga.id for carga in cargas], dtype=np.int64)
+        docente_de_fila = np.array([carga.docente_id for carga in cargas], dtype=np.int64)
+        turnos = np.array([int(turno_id) for turno_id in targets], dtype=np.int64)
+        lugares = np.array(list(targets.values()), dtype=np.int64)
+        columnas = np.repeat(turnos, lugares)
+        primera_columna = np.cumsum(lugares) - lugares
+
+        preferencias = Preferencia.objects.filter(preferencia__turno__anno=ac.anno,
+                                                  preferencia__turno__cuatrimestre=ac.cuatrimestre,
+                                                  preferencia__tipo_docente=(tipo_preferencias or tipo).name,
+                                                  preferencia__turno_id__in=turnos.tolist(),
+                                                  preferencia__docente_id__in=set(docente_de_fila.tolist())) \
+                                          .values_list('preferencia__docente_id',
+                                                       'preferencia__turno_id',
+                                                       'peso_normalizado')
+        preferencias = np.array(list(preferencias), dtype=float).reshape(-1, 3)
+        preferencias = preferencias[np.argsort(preferencias[:, 0], kind='stable')]
+        pref_docente = preferencias[:, 0].astype(np.int64)
+        pref_turno = preferencias[:, 1].astype(np.int64)
+        pref_peso = preferencias[:, 2]
+
+        def _expandir(inicios, cantidades):
+            # concatena los rangos [inicio, inicio + cantidad) sin iterar en python
+            desplazamientos = np.arange(cantidades.sum()) - np.repeat(np.cumsum(cantidades) - cantidades, cantidades)
+            return np.repeat(inicios, cantidades) + desplazamientos
+
+        # filas x preferencias de su docente (pref_docente está ordenado)
+        desde = np.searchsorted(pref_docente, docente_de_fila, side='left')
+        hasta = np.searchsorted(pref_docente, docente_de_fila, side='right')
+        aristas_fila = np.repeat(np.arange(len(filas)), hasta - desde)
+        aristas_pref = _expandir(desde, hasta - desde)
+
+        # cada preferencia por un turno va a todas las columnas del turno
+        orden_turnos = np.argsort(turnos)
+        posicion_turno = orden_turnos[np.searchsorted(turnos, pref_turno[aristas_pref], sorter=orden_turnos)]
+        lugares_arista = lugares[posicion_turno]
+        celdas_fila = np.repeat(aristas_fila, lugares_arista)
+        celdas_columna = _expandir(primera_columna[posicion_turno], lugares_arista)
+
+        pesos = np.zeros((len(filas), len(columnas)))
+        permitido = np.zeros((len(filas), len(columnas)), dtype=bool)
+        pesos[celdas_fila, celdas_columna] = np.repeat(pref_peso[aristas_pref], lugares_arista) * factor
+        permitido[celdas_fila, celdas_columna] = True
+        return MatrizDePesos(pesos, permitido, filas.tolist(), columnas.tolist())
+
+    @classmethod
+    def guardar_asignaciones(cls, pares, intentos, tipo):
+        '''[(Carga, Turno)] -> (int, int) -> TipoDocentes -> [Asignacion]
+
+        Guarda con un solo bulk_create las asignaciones que todavía no existen
+        (igual que get_or_create, pero sin consultas por asignación).
+        '''
+        existentes = set(Asignacion.objects.filter(intentos=intentos, cargo_que_ocupa=tipo.name,
+                                                   carga__in=[carga.id for carga, _ in pares])
+                                           .values_list('carga_id', 'turno_id'))
+        nuevas = []
+        for carga, turno in pares:
+            if (carga.id, turno.id) in existentes:
+                continue
+            existentes.add((carga.id, turno.id))
+            nuevas.append(Asignacion(intentos=intentos, carga=carga, turno=turno, cargo_que_ocupa=tipo.name))
+        return Asignacion.objects.bulk_create(nuevas)
+
+
+class DistribucionSnapshot:
+    '''Foto de la distribución de (anno, cuatrimestre, intento).
+
+    Carga turnos (con el resumen de sus horarios), cargas, asignaciones, preferencias y OtrosDatos del período
+    con una cantidad fija de consultas y los indexa en diccionarios.
+    La página de distribución y su template leen sólo de acá.
+    '''
+
+    def __init__(self, ac, intento):
+        self.ac = ac
+        self.intento = intento
+
+        self.materias = list(Materia.objects.filter(turno__anno=ac.anno, turno__cuatrimestre=ac.cuatrimestre)
+                                            .distinct())
+        self.turnos = list(Turno.objects.filter(anno=ac.anno, cuatrimestre=ac.cuatrimestre)
+                                        .select_related('materia'))
+        turnos_por_id = {turno.id: turno for turno in self.turnos}
+
+        # cargas publicadas (con turno) y sin distribuir
+        self.cargas_fijas = {turno.id: defaultdict(list) for turno in self.turnos}
+        self.no_distribuidas = defaultdict(list)
+        for carga in Carga.para_ac(ac).select_related('docente'):
+            tipo = Mapeos.tipo_de_carga(carga)
+            if carga.turno_id is None:
+                self.no_distribuidas[tipo].append(carga)
+            elif carga.turno_id in self.cargas_fijas:
+                self.cargas_fijas[carga.turno_id][tipo].append(carga)
+
+        # asignaciones del intento
+        self.asignaciones = {turno.id: defaultdict(list) for turno in self.turnos}
+        self.cargas_asignadas = set()
+        for asignacion in Asignacion.objects.validas_en(ac.anno, ac.cuatrimestre, intento) \
+                                            .select_related('carga__docente'):
+            self.cargas_asignadas.add(asignacion.carga_id)
+            if asignacion.turno_id in turnos_por_id:
+                asignacion.turno = turnos_por_id[asignacion.turno_id]
+                self.asignaciones[asignacion.turno_id][TipoDocentes[asignacion.cargo_que_ocupa]].append(asignacion)
+
+        # preferencias, por turno y por (docente, tipo)
+        self.preferencias_por_turno = defaultdict(list)
+        self.preferencias_por_docente = defaultdict(list)
+        preferencias = Preferencia.objects.filter(preferencia__turno__anno=ac.anno,
+                                                  preferencia__turno__cuatrimestre=ac.cuatrimestre) \
+                                          .select_related('preferencia__docente') \
+                                          .order_by('preferencia__tipo_docente',
+                                                    'peso_normalizado',
+                                                    'preferencia__docente__na_apellido')
+        for preferencia in preferencias:
+            pref_docente = preferencia.preferencia
+            pref_docente.turno = turnos_por_id[pref_docente.turno_id]
+            self.preferencias_por_turno[pref_docente.turno_id].append(preferencia)
+            self.preferencias_por_docente[(pref_docente.docente_id, pref_docente.tipo_docente)].append(preferencia)
+
+        # comentarios de las encuestas, por (docente, tipo)
+        self.comentarios = defaultdict(list)
+        for docente_id, tipo_docente, comentario in OtrosDatos.objects \
+                .filter(anno=ac.anno, cuatrimestre__contains=ac.cuatrimestre) \
+                .order_by('fecha_encuesta') \
+                .values_list('docente_id', 'tipo_docente', 'comentario'):
+            self.comentarios[(docente_id, tipo_docente)].append(comentario)
+
+    def necesidades_insatisfechas(self, turno):
+        '''Turno -> {TipoDocentes -> int}'''
+        return {tipo: Mapeos.necesidades(turno, tipo)
+                      - len(self.asignaciones[turno.id][tipo])
+                      - len(self.cargas_fijas[turno.id][tipo])
+                for tipo in TipoDocentes}
+
+    def preferencias_de_carga(self, carga):
+        '''Carga -> [Preferencia] para el tipo de la carga'''
+        return self.preferencias_por_docente[(carga.docente_id, Mapeos.tipo_de_carga(carga).name)]
+
+    def materias_por_obligatoriedad(self, obligatoriedades):
+        '''{TipoMateria.name -> str} -> [(str, [(Materia, [Turno])])]
+
+        A cada turno le agrega asignaciones, cargas, necesidades_insatisfechas y preferencias.
+        A cada asignación le agrega las preferencias y los comentarios de su docente.
+        '''
+        turnos_por_materia = defaultdict(list)
+        for turno in sorted(self.turnos):
+            turno.asignaciones = [(tipo, self.asignaciones[turno.id][tipo]) for tipo in TipoDocentes]
+            turno.cargas = [(tipo, self.cargas_fijas[turno.id][tipo]) for tipo in TipoDocentes]
+            turno.necesidades_insatisfechas = self.necesidades_insatisfechas(turno)
+            turno.preferencias = self.preferencias_por_turno[turno.id]
+            for tipo, asignaciones in turno.asignaciones:
+                for asignacion in asignaciones:
+                    asignacion.preferencias = self.preferencias_de_carga(asignacion.carga)
+                    asignacion.comentarios = self.comentarios[(asignacion.carga.docente_id, tipo.name)]
+            turnos_por_materia[turno.materia_id].append(turno)
+
+        return [(obligatoriedad_largo, [[materia, turnos_por_materia[materia.id]]
+                                        for materia in self.materias
+                                        if materia.obligatoriedad == obligatoriedad])
+                for obligatoriedad, obligatoriedad_largo in obligatoriedades.items()]
+
+    def sin_asignar(self):
+        '''{TipoDocentes -> [(Carga, [Preferencia], [comentario])]}
+
+        Cargas sin publicar que no tienen asignación en el intento, con su encuesta.
+        '''
+        ret = {}
+        for tipo in TipoDocentes:
+            cargas = sorted((carga for carga in self.no_distribuidas[tipo] if carga.id not in self.cargas_asignadas),
+                            key=lambda c: c.docente.apellido_nombre)
+            ret[tipo] = [(carga,
+                          self.preferencias_por_docente[(carga.docente_id, tipo.name)],
+                          self.comentarios[(carga.docente_id, tipo.name)])
+                         for carga in cargas]
+        return ret
+
+    def necesidades_por_tipo(self):
+        '''{TipoDocentes -> int}'''
+        return {tipo: sum(Mapeos.necesidades(turno, tipo) for turno in self.turnos)
+                for tipo in TipoDocentes}
+
+    def cargas_por_tipo(self, sin_asignar):
+        '''{TipoDocentes -> [...]} -> {TipoDocentes -> int}'''
+        return {tipo: sum(len(self.asignaciones[turno.id][tipo]) + len(self.cargas_fijas[turno.id][tipo])
+                          for turno in self.turnos)
+                      + len(sin_asignar[tipo])
+                for tipo in TipoDocentes}
+
+
+class CacheDistribucion:
+    '''Cache del cuerpo ya renderizado de las páginas de distribución.
+
+    Las claves son (página, anno, cuatrimestre, versión, intento). Cada período tiene una versión
+    que cambia con cualquier acción que modifique sus intentos; las entradas de versiones viejas
+    quedan inalcanzables y el backend las descarta cuando vence su TIMEOUT.
+    El backend es el alias settings.DBORRADOR_CACHE de CACHES (por omisión, 'default').
+    '''
+
+    ACIERTOS = 'dborrador:aciertos'
+    FALLOS = 'dborrador:fallos'
+
+    @classmethod
+    def backend(cls):
+        return caches[getattr(settings, 'DBORRADOR_CACHE', DEFAULT_CACHE_ALIAS)]
+
+    @classmethod
+    def _clave_version(cls, anno, cuatrimestre):
+        return f'dborrador:version:{anno}:{cuatrimestre}'
+
+    @classmethod
+    def clave(cls, pagina, anno, cuatrimestre, intento):
+        '''str -> int -> str -> Intento -> str'''
+        # si el backend pierde la versión se genera otra nueva, nunca se reusa una vieja
+        version = cls.backend().get_or_set(cls._clave_version(anno, cuatrimestre),
+                                           lambda: uuid.uuid4().hex, timeout=None)
+        return f'dborrador:{pagina}:{anno}:{cuatrimestre}:{version}:{intento.valor}'
+
+    @classmethod
+    def obtener(cls, pagina, anno, cuatrimestre, intento, generar):
+        '''str -> int -> str -> Intento -> (() -> str) -> str
+
+        Devuelve el html guardado para (pagina, anno, cuatrimestre, intento) o lo genera con generar().
+        '''
+        cache = cls.backend()
+        clave = cls.clave(pagina, anno, cuatrimestre, intento)
+        html = cache.get(clave)
+        if html is None:
+            cls._contar(cls.FALLOS)
+            html = generar()
+            cache.set(clave, html)
+        else:
+            cls._contar(cls.ACIERTOS)
+        return html
+
+    @classmethod
+    def invalidar(cls, anno, cuatrimestre):
+        '''int -> str -> None'''
+        logger.debug('invalido el cache de distribución de %s, %s', anno, cuatrimestre)
+        cls.backend().set(cls._clave_version(anno, cuatrimestre), uuid.uuid4().hex, timeout=None)
+
+    @classmethod
+    def invalidar_al_confirmar(cls, anno, cuatrimestre):
+        '''int -> str -> None
+
+        Invalida cuando se confirma la transacción en curso (o enseguida, si no hay ninguna). Invalidando
+        antes, otro request podría regenerar la página con los datos viejos y guardarla con la versión nueva.
+        '''
+        transaction.on_commit(lambda: cls.invalidar(anno, cuatrimestre))
+
+    @classmethod
+    def _contar(cls, clave):
+        cache = cls.backend()
+        cache.add(clave, 0, timeout=None)
+        try:
+            cache.incr(clave)
+        except ValueError:
+            # el backend la descartó entre add e incr
+            cache.set(clave, 1, timeout=None)
+
+    @classmethod
+    def estadisticas(cls):
+        '''() -> {str -> int}'''
+        cache = cls.backend()
+        return {'aciertos': cache.get(cls.ACIERTOS, 0), 'fallos': cache.get(cls.FALLOS, 0)}
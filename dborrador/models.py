@@ -1,5 +1,9 @@
 from django.db import models
+from django.db.models import F, Func, Value
+from django.db.models.functions import Mod
 from django.contrib.postgres.fields import IntegerRangeField
+from django.contrib.postgres.indexes import GistIndex
+from psycopg2.extras import NumericRange
 
 from collections import namedtuple
 
@@ -39,18 +43,62 @@ class Preferencia(models.Model):
         return f'{self.preferencia.docente} -- {self.peso_normalizado:.4f} -> {self.preferencia.turno}'
 
 
+class AsignacionQuerySet(models.QuerySet):
+    '''Consultas por período e intento.
+
+    Todas filtran el período por carga__anno/carga__cuatrimestre (índice carga_periodo_idx)
+    y el intento con operadores de rango (@> y >>) que puede resolver el índice GiST de intentos.
+    '''
+
+    def del_periodo(self, anno, cuatrimestre):
+        return self.filter(carga__anno=anno, carga__cuatrimestre=cuatrimestre)
+
+    def validas_en(self, anno, cuatrimestre, intento):
+        '''asignaciones cuyo rango de intentos contiene a intento'''
+        return self.del_periodo(anno, cuatrimestre).filter(intentos__contains=intento.valor)
+
+    def posteriores_a(self, anno, cuatrimestre, intento):
+        '''asignaciones que empiezan después de intento (lower(intentos) > intento.valor)'''
+        return self.del_periodo(anno, cuatrimestre).filter(intentos__fully_gt=NumericRange(None, intento.valor, '[]'))
+
+    def activas_por_tipo(self, anno, cuatrimestre, intento, tipo):
+        '''asignaciones válidas en intento que ocupan un cargo de tipo TipoDocentes'''
+        return self.validas_en(anno, cuatrimestre, intento).filter(cargo_que_ocupa=tipo.name)
+
+
 class Asignacion(models.Model):
     intentos = IntegerRangeField()
     carga = models.ForeignKey(Carga, on_delete=models.CASCADE)
     turno = models.ForeignKey(Turno, on_delete=models.CASCADE)
     cargo_que_ocupa = models.CharField(max_length=2, choices=choice_enum(TipoDocentes))
 
+    objects = AsignacionQuerySet.as_manager()
+
     def __str__(self):
         return f'{self.carga.docente} -> {self.turno}'
 
     @classmethod
     def validas_en(cls, anno, cuatrimestre, intento):
-        return cls.objects.filter(carga__anno=anno, carga__cuatrimestre=cuatrimestre, intentos__contains=intento.valor)
+        return cls.objects.validas_en(anno, cuatrimestre, intento)
+
+    @staticmethod
+    def extender_intentos(asignaciones, hasta, de_algoritmo):
+        '''QuerySet[Asignacion] -> int | None -> bool -> int
+
+        Pone `hasta` como final del rango `intentos` de las asignaciones automáticas
+        (de_algoritmo=True) o manuales (de_algoritmo=False) con un solo UPDATE:
+            intentos = int4range(lower(intentos), hasta)
+        Devuelve la cantidad de asignaciones cambiadas.
+        '''
+        comienzo = Func(F('intentos'), function='lower', output_field=models.IntegerField())
+        comienzo_manual = Mod(comienzo, Value(2 ** 16, output_field=models.IntegerField()))
+        nuevos_intentos = Func(comienzo, Value(hasta), function='int4range', output_field=IntegerRangeField())
+        asignaciones = asignaciones.annotate(comienzo_manual=comienzo_manual)
+        if de_algoritmo:
+            asignaciones = asignaciones.filter(comienzo_manual=0)
+        else:
+            asignaciones = asignaciones.exclude(comienzo_manual=0)
+        return asignaciones.update(intentos=nuevos_intentos)
 
     @property
     def es_manual(self):
@@ -59,6 +107,7 @@ class Asignacion(models.Model):
     class Meta:
         verbose_name = 'asignación'
         verbose_name_plural = 'asignaciones'
+        indexes = [GistIndex(fields=['intentos'], name='asignacion_intentos_gist')]
 
 
 class IntentoRegistrado(models.Model):
@@ -0,0 +1,126 @@
+'''Resolvedores de la distribución automática.
+
+Todos reciben lo mismo que allocating: sources {str(carga_id): cantidad}, targets {str(turno_id): cantidad}
+y los pesos de cada par. Devuelven [(str(carga_id), str(turno_id))].
+'''
+import logging
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class Resolvedor(ABC):
+
+    nombre = None
+    descripcion = None
+
+    @classmethod
+    @abstractmethod
+    def disponible(cls):
+        '''() -> bool: están instaladas las dependencias'''
+
+    def pesos(self, ac, tipo, cargas, targets, tipo_preferencias=None, factor=1):
+        '''los pesos en el formato que prefiere resolver()'''
+        from .misc import Distribucion
+        return Distribucion.pesos_para_distribuir(ac, tipo, cargas, targets, tipo_preferencias, factor)
+
+    def combinar(self, bloques):
+        '''[(str, pesos)] -> pesos
+
+        Junta los pesos de varios problemas en uno. Cada bloque es (prefijo, pesos) y sus targets
+        pasan a llamarse prefijo + target; las cargas se identifican igual en todos los bloques.
+        '''
+        return [dict(arista, to=prefijo + arista['to']) for prefijo, pesos in bloques for arista in pesos]
+
+    @abstractmethod
+    def resolver(self, sources, targets, pesos):
+        '''sources -> targets -> pesos -> [(str(carga_id), str(turno_id))]'''
+
+
+class ResolvedorAllocation(Resolvedor):
+    '''allocating.Allocator: racionaliza los pesos (limit_denominator=100) antes de resolver'''
+
+    nombre = 'allocation'
+    descripcion = 'allocation (pesos racionales)'
+
+    @classmethod
+    def disponible(cls):
+        try:
+            from allocation import allocating
+        except ImportError:
+            return False
+        return True
+
+    def resolver(self, sources, targets, pesos):
+        from allocation import allocating
+        wmap = allocating.ListWeightedMap(pesos)
+        allocator = allocating.Allocator(sources, wmap, targets, limit_denominator=100)
+        return [(source, target) for source, target in allocator.get_best()
+                if source is not None and target is not None]
+
+
+class ResolvedorHungaro(Resolvedor):
+    '''método húngaro sobre la matriz de pesos, con pesos float'''
+
+    nombre = 'hungaro'
+    descripcion = 'método húngaro (pesos float)'
+
+    @classmethod
+    def disponible(cls):
+        try:
+            import numpy
+        except ImportError:
+            return False
+        return True
+
+    def pesos(self, ac, tipo, cargas, targets, tipo_preferencias=None, factor=1):
+        from .misc import Distribucion
+        return Distribucion.matriz_de_pesos(ac, tipo, cargas, targets, tipo_preferencias, factor)
+
+    def combinar(self, bloques):
+        from .hungaro import MatrizDePesos
+        return MatrizDePesos.combinar(bloques)
+
+    def resolver(self, sources, targets, pesos):
+        from .hungaro import MatrizDePesos, asignacion_de_minimo_peso
+        if not isinstance(pesos, MatrizDePesos):
+            pesos = MatrizDePesos.de_aristas(sources, targets, pesos)
+        pares = asignacion_de_minimo_peso(pesos)
+        logger.info('Método húngaro sobre una matriz de %d x %d. Peso total: %f',
+                    len(pesos.filas), len(pesos.columnas), pesos.peso_total(pares))
+        return [(str(pesos.filas[fila]), str(pesos.columnas[columna])) for fila, columna in pares]
+
+
+RESOLVEDORES = {resolvedor.nombre: resolvedor for resolvedor in (ResolvedorAllocation, ResolvedorHungaro)}
+
+
+def _por_omision():
+    return getattr(settings, 'DBORRADOR_RESOLVEDOR', ResolvedorAllocation.nombre)
+
+
+def resolvedores_disponibles():
+    '''() -> [Resolvedor] con dependencias instaladas, el de settings.DBORRADOR_RESOLVEDOR primero'''
+    disponibles = [resolvedor() for resolvedor in RESOLVEDORES.values() if resolvedor.disponible()]
+    return sorted(disponibles, key=lambda resolvedor: resolvedor.nombre != _por_omision())
+
+
+def elegir_resolvedor(nombre=None):
+    '''str | None -> Resolvedor
+
+    Sin nombre usa settings.DBORRADOR_RESOLVEDOR. Si el elegido no está disponible
+    usa el primero que sí lo esté.
+    '''
+    nombre = nombre or _por_omision()
+    if nombre not in RESOLVEDORES:
+        raise ValueError(f'No conozco el resolvedor {nombre}. Opciones: {", ".join(RESOLVEDORES)}')
+    if RESOLVEDORES[nombre].disponible():
+        return RESOLVEDORES[nombre]()
+
+    for otro in RESOLVEDORES.values():
+        if otro.disponible():
+            logger.warning('El resolvedor %s no está disponible. Uso %s', nombre, otro.nombre)
+            return otro()
+    raise RuntimeError('No hay ningún resolvedor disponible')
@@ -0,0 +1,45 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from materias.models import Turno, Horario, Carga, Docente
+from encuestas.models import OtrosDatos
+from .misc import CacheDistribucion
+
+
+@receiver(post_save, sender=Turno)
+@receiver(post_delete, sender=Turno)
+def invalidar_cache_de_turno(sender, instance, **kwargs):
+    '''cambiar un turno (por ejemplo, sus necesidades) cambia las páginas de distribución de su período'''
+    CacheDistribucion.invalidar_al_confirmar(instance.anno, instance.cuatrimestre)
+
+
+@receiver(post_save, sender=Horario)
+@receiver(post_delete, sender=Horario)
+def invalidar_cache_de_horario(sender, instance, **kwargs):
+    '''las páginas de distribución muestran los horarios de cada turno'''
+    turno = instance.turno
+    CacheDistribucion.invalidar_al_confirmar(turno.anno, turno.cuatrimestre)
+
+
+@receiver(post_save, sender=Carga)
+@receiver(post_delete, sender=Carga)
+def invalidar_cache_de_carga(sender, instance, **kwargs):
+    '''las páginas de distribución muestran las cargas del período y sus docentes'''
+    CacheDistribucion.invalidar_al_confirmar(instance.anno, instance.cuatrimestre)
+
+
+@receiver(post_save, sender=OtrosDatos)
+@receiver(post_delete, sender=OtrosDatos)
+def invalidar_cache_de_otros_datos(sender, instance, **kwargs):
+    '''los comentarios de la encuesta aparecen en la distribución de cada cuatrimestre que abarca'''
+    for cuatrimestre in instance.cuatrimestre:
+        CacheDistribucion.invalidar_al_confirmar(instance.anno, cuatrimestre)
+
+
+@receiver(post_save, sender=Docente)
+def invalidar_cache_de_docente(sender, instance, created, **kwargs):
+    '''el nombre del docente aparece en la distribución de los períodos en que tiene cargas'''
+    if created:
+        return
+    for anno, cuatrimestre in set(Carga.objects.filter(docente=instance).values_list('anno', 'cuatrimestre')):
+        CacheDistribucion.invalidar_al_confirmar(anno, cuatrimestre)
@@ -1,14 +1,25 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
+from django.utils import timezone
 
 from collections import Counter
+import datetime
+import itertools
+import random
+import tempfile
 
-from materias.models import (Materia, Turno, TipoTurno, Cargos, Carga, CargoDedicacion,
+from materias.models import (Materia, Turno, Horario, TipoTurno, Cargos, Carga, CargoDedicacion,
                              Docente, TipoDocentes, TipoMateria, Cuatrimestres)
 from materias.misc import Mapeos, AnnoCuatrimestre
-from dborrador.models import Asignacion, Intento
-from dborrador.misc import Distribucion
+from dborrador.models import Asignacion, Intento, Preferencia
+from dborrador.misc import Distribucion, DistribucionSnapshot, CacheDistribucion
+from dborrador.hungaro import MatrizDePesos, asignacion_de_minimo_peso
+from dborrador.resolvedores import Resolvedor, ResolvedorHungaro, elegir_resolvedor, resolvedores_disponibles
+from encuestas.models import PreferenciasDocente, OtrosDatos
 
-class TestDistribucion(TestCase):
+class DatosDeDistribucion:
+    '''dos turnos de una materia con cargas de nemo y mario, algunas publicadas y algunas asignadas'''
 
     def setUp(self):
         anno = 2100
@@ -68,6 +79,345 @@ class TestDistribucion(TestCase):
         # T1 nec: (2300) pub: (1100) otro: (1000) fijo: (0100) int1: (0100)
         # T2 nec: (0234) pub: (0111) otro: (0110) fijo: (0001) int1: (0001)
 
+
+class TestDistribucion(DatosDeDistribucion, TestCase):
+
     def test_asignaciones_por_cargo_ocupado(self):
         asignaciones = Distribucion.asignaciones_por_cargo_ocupado(self.ac, Intento.de_algoritmo(1))
         self.assertEqual(set(asignaciones[self.turno1][TipoDocentes.P]), {self.asignacion_1_1})
+
+    def _agrega_preferencias(self, docente, turno_peso, tipo):
+        now = timezone.now()
+        for turno, peso in turno_peso:
+            pd = PreferenciasDocente.objects.create(docente=docente, turno=turno, peso=peso,
+                                                    tipo_docente=tipo.name, fecha_encuesta=now)
+            Preferencia.objects.create(preferencia=pd, peso_normalizado=peso)
+
+    def test_pesos_para_distribuir(self):
+        self._agrega_preferencias(self.n, [(self.turno1, 0.25), (self.turno2, 0.75)], TipoDocentes.J)
+        self._agrega_preferencias(self.m, [(self.turno1, 1)], TipoDocentes.J)
+        self._agrega_preferencias(self.n, [(self.turno1, 1)], TipoDocentes.A1)
+        cargas = [self.cargas_turno_1[TipoDocentes.J][2], self.cargas_turno_2[TipoDocentes.J][1]]
+        targets = {str(self.turno1.id): 1, str(self.turno2.id): 1}
+
+        pesos = Distribucion.pesos_para_distribuir(self.ac, TipoDocentes.J, cargas, targets)
+        self.assertCountEqual(pesos, [
+            {'from': str(cargas[0].id), 'to': str(self.turno1.id), 'weight': 1},
+            {'from': str(cargas[1].id), 'to': str(self.turno1.id), 'weight': 0.25},
+            {'from': str(cargas[1].id), 'to': str(self.turno2.id), 'weight': 0.75},
+        ])
+
+        # los turnos que no necesitan docentes no aparecen
+        pesos = Distribucion.pesos_para_distribuir(self.ac, TipoDocentes.J, cargas, {str(self.turno2.id): 1})
+        self.assertEqual(pesos, [{'from': str(cargas[1].id), 'to': str(self.turno2.id), 'weight': 0.75}])
+
+    def test_matriz_de_pesos(self):
+        self._agrega_preferencias(self.n, [(self.turno1, 0.25), (self.turno2, 0.75)], TipoDocentes.J)
+        self._agrega_preferencias(self.m, [(self.turno1, 1)], TipoDocentes.J)
+        self._agrega_preferencias(self.n, [(self.turno1, 1)], TipoDocentes.A1)
+        cargas = [self.cargas_turno_1[TipoDocentes.J][2], self.cargas_turno_2[TipoDocentes.J][1],
+                  self.cargas_turno_2[TipoDocentes.J][0]]
+        targets = {str(self.turno1.id): 1, str(self.turno2.id): 2}
+
+        with self.assertNumQueries(1):
+            matriz = Distribucion.matriz_de_pesos(self.ac, TipoDocentes.J, cargas, targets)
+        self.assertEqual(matriz.filas, [carga.id for carga in cargas])
+        self.assertEqual(matriz.columnas, [self.turno1.id, self.turno2.id, self.turno2.id])
+
+        # cada arista de pesos_para_distribuir aparece en todas las columnas de su turno
+        aristas = Distribucion.pesos_para_distribuir(self.ac, TipoDocentes.J, cargas, targets)
+        celdas = {(fila, columna): matriz.pesos[fila, columna]
+                  for fila, columna in zip(*matriz.permitido.nonzero())}
+        esperadas = {(matriz.filas.index(int(arista['from'])), columna): arista['weight']
+                     for arista in aristas
+                     for columna, turno_id in enumerate(matriz.columnas) if turno_id == int(arista['to'])}
+        self.assertEqual(celdas, esperadas)
+        self.assertEqual(len(esperadas), 1 + 3 + 3)
+
+    def test_matriz_de_pesos_vacia(self):
+        matriz = Distribucion.matriz_de_pesos(self.ac, TipoDocentes.J, [], {})
+        self.assertEqual(matriz.pesos.shape, (0, 0))
+        self.assertEqual(asignacion_de_minimo_peso(matriz), [])
+
+    def test_pesos_para_distribuir_no_depende_de_cantidad_de_cargas(self):
+        self._agrega_preferencias(self.n, [(self.turno1, 0.5), (self.turno2, 0.5)], TipoDocentes.A2)
+        targets = {str(self.turno1.id): 3, str(self.turno2.id): 4}
+        pocas = Carga.objects.filter(docente=self.n, cargo=Cargos.Ay2.name + 'Exc')[:1]
+        for _ in range(20):
+            Carga.objects.create(docente=self.n, cargo=CargoDedicacion.Ay2Par.name,
+                                 anno=self.ac.anno, cuatrimestre=self.ac.cuatrimestre)
+        muchas = Carga.objects.filter(docente=self.n, cargo__startswith=Cargos.Ay2.name)
+
+        for cargas in (list(pocas), list(muchas)):
+            with self.assertNumQueries(1):
+                pesos = Distribucion.pesos_para_distribuir(self.ac, TipoDocentes.A2, cargas, targets)
+            self.assertEqual(len(pesos), 2 * len(cargas))
+
+    def test_guardar_asignaciones(self):
+        intentos = (Intento.de_algoritmo(5).valor, Intento.de_algoritmo(6).valor)
+        cargas = self.cargas_turno_2[TipoDocentes.A2]
+        pares = [(cargas[2], self.turno2), (cargas[3], self.turno1), (cargas[3], self.turno1)]
+
+        with self.assertNumQueries(2):
+            nuevas = Distribucion.guardar_asignaciones(pares, intentos, TipoDocentes.A2)
+        self.assertEqual(len(nuevas), 2)
+        validas = Asignacion.validas_en(self.ac.anno, self.ac.cuatrimestre, Intento.de_algoritmo(5))
+        self.assertEqual({(a.carga, a.turno) for a in validas.filter(intentos__startswith=intentos[0])},
+                         {(cargas[2], self.turno2), (cargas[3], self.turno1)})
+
+        # guardar de nuevo no duplica
+        nuevas = Distribucion.guardar_asignaciones(pares, intentos, TipoDocentes.A2)
+        self.assertEqual(nuevas, [])
+        self.assertEqual(Asignacion.objects.filter(intentos=intentos).count(), 2)
+
+
+class TestDistribucionSnapshot(DatosDeDistribucion, TestCase):
+
+    obligatoriedades = {TipoMateria.B.name: 'Obligatorias', TipoMateria.N.name: 'Optativas no regulares'}
+
+    def _usar_como_el_template(self, snapshot):
+        materias = snapshot.materias_por_obligatoriedad(self.obligatoriedades)
+        for _, lista in materias:
+            for materia, turnos in lista:
+                for turno in turnos:
+                    turno.horarios_info()
+                    for preferencia in turno.preferencias:
+                        str(preferencia.preferencia.docente)
+                    for _, asignaciones in turno.asignaciones:
+                        for asignacion in asignaciones:
+                            str(asignacion.carga.docente)
+                            [p.preferencia.turno.str_corto() for p in asignacion.preferencias]
+                    for _, cargas in turno.cargas:
+                        [carga.docente.nombre for carga in cargas]
+        sin_asignar = snapshot.sin_asignar()
+        for tipo, cargas in sin_asignar.items():
+            for carga, preferencias, comentarios in cargas:
+                str(carga.docente)
+                [p.preferencia.turno.str_corto() for p in preferencias]
+        snapshot.necesidades_por_tipo()
+        snapshot.cargas_por_tipo(sin_asignar)
+        return materias, sin_asignar
+
+    def test_snapshot(self):
+        now = timezone.now()
+        pd = PreferenciasDocente.objects.create(docente=self.n, turno=self.turno1, peso=2,
+                                                tipo_docente=TipoDocentes.A2.name, fecha_encuesta=now)
+        Preferencia.objects.create(preferencia=pd, peso_normalizado=1)
+        OtrosDatos.objects.create(docente=self.n, fecha_encuesta=now, comentario='hola', email='', telefono='',
+                                  anno=self.ac.anno, cuatrimestre='PS', tipo_docente=TipoDocentes.A2.name)
+
+        snapshot = DistribucionSnapshot(self.ac, Intento.de_algoritmo(1))
+        materias, sin_asignar = self._usar_como_el_template(snapshot)
+
+        self.assertEqual(materias[0][0], 'Obligatorias')
+        [[materia, turnos]] = materias[0][1]
+        self.assertEqual(materia, self.materia)
+        self.assertEqual(materias[1][1], [])
+        turno1, turno2 = sorted(turnos, key=lambda t: t.numero)
+        # coincide con lo que se calculaba turno por turno
+        moviles = Distribucion.asignaciones_por_cargo_ocupado(self.ac, Intento.de_algoritmo(1))
+        fijas = Distribucion.ya_distribuidas_por_cargo(self.ac)
+        necesidades = Mapeos.necesidades_por_turno_y_tipo(self.ac)
+        for turno in (turno1, turno2):
+            for tipo in TipoDocentes:
+                self.assertCountEqual(dict(turno.asignaciones)[tipo], moviles[turno][tipo])
+                self.assertCountEqual(dict(turno.cargas)[tipo], fijas[turno][tipo])
+                self.assertEqual(turno.necesidades_insatisfechas[tipo],
+                                 necesidades[turno][tipo] - len(moviles[turno][tipo]) - len(fijas[turno][tipo]))
+        self.assertEqual([p.preferencia for p in turno1.preferencias], [pd])
+
+        # las cargas de A2 sin publicar y sin asignación en el intento 1
+        cargas_a2 = [carga for carga, _, _ in sin_asignar[TipoDocentes.A2]]
+        self.assertEqual(set(cargas_a2), {self.cargas_turno_2[TipoDocentes.A2][3]})
+        _, preferencias, comentarios = sin_asignar[TipoDocentes.A2][0]
+        self.assertEqual([p.preferencia for p in preferencias], [pd])
+        self.assertEqual(comentarios, ['hola'])
+
+    def test_snapshot_con_cantidad_fija_de_consultas(self):
+        def consultas():
+            with CaptureQueriesContext(connection) as capturadas:
+                self._usar_como_el_template(DistribucionSnapshot(self.ac, Intento.de_algoritmo(1)))
+            return len(capturadas)
+
+        antes = consultas()
+        now = timezone.now()
+        for k in range(10):
+            docente = Docente.objects.create(na_nombre=f'd{k}', cargos=[CargoDedicacion.Ay2Par.name])
+            turno = Turno.objects.create(materia=self.materia, anno=self.ac.anno, cuatrimestre=self.ac.cuatrimestre,
+                                         numero=10 + k, tipo=TipoTurno.P.name,
+                                         necesidad_prof=0, necesidad_jtp=0, necesidad_ay1=0, necesidad_ay2=1)
+            Horario.objects.create(turno=turno, dia='Lu', comienzo=datetime.time(9), final=datetime.time(11))
+            carga = Carga.objects.create(docente=docente, cargo=CargoDedicacion.Ay2Par.name,
+                                         anno=self.ac.anno, cuatrimestre=self.ac.cuatrimestre)
+            cargas = [Carga.objects.create(docente=docente, cargo=CargoDedicacion.Ay2Par.name,
+                                           anno=self.ac.anno, cuatrimestre=self.ac.cuatrimestre)
+                      for _ in range(2)]
+            Asignacion.objects.create(intentos=(Intento.de_algoritmo(1).valor, None), carga=cargas[0], turno=turno,
+                                      cargo_que_ocupa=TipoDocentes.A2.name)
+            pd = PreferenciasDocente.objects.create(docente=docente, turno=turno, peso=1,
+                                                    tipo_docente=TipoDocentes.A2.name, fecha_encuesta=now)
+            Preferencia.objects.create(preferencia=pd, peso_normalizado=1)
+            OtrosDatos.objects.create(docente=docente, fecha_encuesta=now, comentario='', email='', telefono='',
+                                      anno=self.ac.anno, cuatrimestre=self.ac.cuatrimestre,
+                                      tipo_docente=TipoDocentes.A2.name)
+        self.assertEqual(consultas(), antes)
+        self.assertEqual(antes, 6)
+
+
+@override_settings(CACHES={'dborrador': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                         'LOCATION': 'test_dborrador'},
+                           'encuestas': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+                   DBORRADOR_CACHE='dborrador')
+class TestCacheDistribucion(TransactionTestCase):
+    '''las señales invalidan al confirmar la transacción, y TestCase nunca la confirma'''
+
+    def setUp(self):
+        CacheDistribucion.backend().clear()
+        self.generadas = []
+
+    def _generar(self, html):
+        def generar():
+            self.generadas.append(html)
+            return html
+        return generar
+
+    def test_guarda_por_intento(self):
+        intento = Intento(1, 0)
+        self.assertEqual(CacheDistribucion.obtener('distribucion', 2100, 'P', intento, self._generar('a')), 'a')
+        self.assertEqual(CacheDistribucion.obtener('distribucion', 2100, 'P', intento, self._generar('b')), 'a')
+        self.assertEqual(CacheDistribucion.obtener('distribucion', 2100, 'P', Intento(1, 1), self._generar('c')), 'c')
+        self.assertEqual(CacheDistribucion.obtener('espiar', 2100, 'P', intento, self._generar('d')), 'd')
+        self.assertEqual(self.generadas, ['a', 'c', 'd'])
+        self.assertEqual(CacheDistribucion.estadisticas(), {'aciertos': 1, 'fallos': 3})
+
+    def test_invalidar_solo_afecta_al_periodo(self):
+        intento = Intento(1, 0)
+        CacheDistribucion.obtener('distribucion', 2100, 'P', intento, self._generar('a'))
+        CacheDistribucion.obtener('distribucion', 2100, 'S', intento, self._generar('b'))
+        CacheDistribucion.invalidar(2100, 'P')
+        self.assertEqual(CacheDistribucion.obtener('distribucion', 2100, 'P', intento, self._generar('c')), 'c')
+        self.assertEqual(CacheDistribucion.obtener('distribucion', 2100, 'S', intento, self._generar('d')), 'b')
+
+    def test_cambiar_un_turno_invalida(self):
+        materia = Materia.objects.create(nombre='navegacion', obligatoriedad=TipoMateria.B.name)
+        turno = Turno.objects.create(materia=materia, anno=2100, cuatrimestre='P', numero=1, tipo=TipoTurno.A.name,
+                                     necesidad_prof=1, necesidad_jtp=0, necesidad_ay1=0, necesidad_ay2=0)
+        CacheDistribucion.obtener('distribucion', 2100, 'P', Intento(1, 0), self._generar('a'))
+        turno.necesidad_jtp = 2
+        turno.save()
+        self.assertEqual(CacheDistribucion.obtener('distribucion', 2100, 'P', Intento(1, 0), self._generar('b')), 'b')
+
+    def test_invalida_al_confirmar_la_transaccion(self):
+        materia = Materia.objects.create(nombre='navegacion', obligatoriedad=TipoMateria.B.name)
+        turno = Turno.objects.create(materia=materia, anno=2100, cuatrimestre='P', numero=1, tipo=TipoTurno.A.name,
+                                     necesidad_prof=1, necesidad_jtp=0, necesidad_ay1=0, necesidad_ay2=0)
+        CacheDistribucion.obtener('distribucion', 2100, 'P', Intento(1, 0), self._generar('a'))
+        with transaction.atomic():
+            turno.necesidad_jtp = 2
+            turno.save()
+            # hasta el commit sigue la versión vieja, así nadie guarda datos viejos con la nueva
+            self.assertEqual(CacheDistribucion.obtener('distribucion', 2100, 'P', Intento(1, 0), self._generar('b')), 'a')
+        self.assertEqual(CacheDistribucion.obtener('distribucion', 2100, 'P', Intento(1, 0), self._generar('c')), 'c')
+
+    def test_cambiar_cargas_comentarios_o_docentes_invalida(self):
+        intento = Intento(1, 0)
+        docente = Docente.objects.create(na_nombre='nemo', cargos=[CargoDedicacion.TitExc.name])
+        carga = Carga.objects.create(docente=docente, cargo=CargoDedicacion.TitExc.name, anno=2100, cuatrimestre='P')
+
+        def cambia(accion):
+            CacheDistribucion.obtener('distribucion', 2100, 'P', intento, self._generar('viejo'))
+            accion()
+            return CacheDistribucion.obtener('distribucion', 2100, 'P', intento, self._generar('nuevo'))
+
+        docente.na_nombre = 'capitan nemo'
+        self.assertEqual(cambia(docente.save), 'nuevo')
+        self.assertEqual(cambia(lambda: OtrosDatos.objects.create(docente=docente, anno=2100, cuatrimestre='PS',
+                                                                  tipo_docente=TipoDocentes.P.name,
+                                                                  fecha_encuesta=timezone.now())),
+                         'nuevo')
+        self.assertEqual(cambia(carga.delete), 'nuevo')
+
+    def test_backend_en_archivos(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            cache_en_archivos = {'dborrador': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                               'LOCATION': directorio}}
+            with self.settings(CACHES=cache_en_archivos):
+                intento = Intento(1, 0)
+                CacheDistribucion.obtener('distribucion', 2100, 'P', intento, self._generar('a'))
+                self.assertEqual(CacheDistribucion.obtener('distribucion', 2100, 'P', intento, self._generar('b')), 'a')
+                CacheDistribucion.invalidar(2100, 'P')
+                self.assertEqual(CacheDistribucion.obtener('distribucion', 2100, 'P', intento, self._generar('c')), 'c')
+                self.assertEqual(CacheDistribucion.estadisticas(), {'aciertos': 1, 'fallos': 2})
+
+
+class TestHungaro(TestCase):
+
+    def _por_fuerza_bruta(self, matriz):
+        '''(cantidad de pares, peso total) óptimos probando todas las asignaciones'''
+        n, m = matriz.pesos.shape
+        mejor = (0, 0.0)
+        for columnas in itertools.permutations(list(range(m)) + [None] * n, n):
+            pares = [(fila, columna) for fila, columna in enumerate(columnas)
+                     if columna is not None and matriz.permitido[fila, columna]]
+            mejor = max(mejor, (len(pares), -matriz.peso_total(pares)))
+        return mejor[0], -mejor[1]
+
+    def test_coincide_con_fuerza_bruta(self):
+        import numpy as np
+        azar = random.Random(0)
+        for _ in range(40):
+            n, m = azar.randint(1, 4), azar.randint(1, 4)
+            pesos = np.array([[azar.random() for _ in range(m)] for _ in range(n)])
+            permitido = np.array([[azar.random() < 0.6 for _ in range(m)] for _ in range(n)])
+            matriz = MatrizDePesos(pesos, permitido, list(range(n)), list(range(m)))
+
+            pares = asignacion_de_minimo_peso(matriz)
+            self.assertEqual(len({fila for fila, _ in pares}), len(pares))
+            self.assertEqual(len({columna for _, columna in pares}), len(pares))
+            self.assertTrue(all(permitido[fila, columna] for fila, columna in pares))
+            cantidad, peso = self._por_fuerza_bruta(matriz)
+            self.assertEqual(len(pares), cantidad)
+            self.assertAlmostEqual(matriz.peso_total(pares), peso)
+
+    def test_matriz_de_aristas(self):
+        import numpy as np
+        sources = {'c1': 1, 'c2': 2}
+        targets = {'t1': 2, 't2': 1}
+        aristas = [{'from': 'c1', 'to': 't1', 'weight': 0.5}, {'from': 'c2', 'to': 't2', 'weight': 0.25}]
+        matriz = MatrizDePesos.de_aristas(sources, targets, aristas)
+        self.assertEqual(matriz.filas, ['c1', 'c2', 'c2'])
+        self.assertEqual(matriz.columnas, ['t1', 't1', 't2'])
+        np.testing.assert_array_equal(matriz.permitido, [[True, True, False], [False, False, True], [False, False, True]])
+        pares = asignacion_de_minimo_peso(matriz)
+        self.assertEqual(len(pares), 2)
+        self.assertAlmostEqual(matriz.peso_total(pares), 0.75)
+
+    def test_elegir_resolvedor(self):
+        self.assertIsInstance(elegir_resolvedor(ResolvedorHungaro.nombre), ResolvedorHungaro)
+        with self.assertRaises(ValueError):
+            elegir_resolvedor('no_existe')
+        with self.settings(DBORRADOR_RESOLVEDOR=ResolvedorHungaro.nombre):
+            self.assertIsInstance(elegir_resolvedor(), ResolvedorHungaro)
+            self.assertEqual(resolvedores_disponibles()[0].nombre, ResolvedorHungaro.nombre)
+
+    def test_resolvedor_incompleto_no_se_instancia(self):
+        class SinResolver(Resolvedor):
+            nombre = 'sin_resolver'
+
+            @classmethod
+            def disponible(cls):
+                return True
+
+        with self.assertRaises(TypeError):
+            SinResolver()
+
+    def test_combinar_matrices(self):
+        import numpy as np
+        p = MatrizDePesos(np.array([[0.5, 0.25]]), np.array([[True, True]]), [1], [10, 11])
+        j = MatrizDePesos(np.array([[1.0], [0.75]]), np.array([[True], [False]]), [2, 3], [10])
+        matriz = MatrizDePesos.combinar([('P:', p), ('J:', j)])
+        self.assertEqual(matriz.filas, [1, 2, 3])
+        self.assertEqual(matriz.columnas, ['P:10', 'P:11', 'J:10'])
+        np.testing.assert_array_equal(matriz.permitido, [[True, True, False], [False, False, True], [False, False, False]])
+        self.assertEqual(matriz.pesos[1, 2], 1.0)
+        self.assertEqual(sorted(asignacion_de_minimo_peso(matriz)), [(0, 1), (1, 2)])
@@ -1,14 +1,20 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.urls import reverse
+from django.db import connection
 from django.contrib.auth.models import Permission
 from psycopg2.extras import NumericRange
 
 import re
 import datetime
+from unittest import skipUnless
 
 from dborrador.models import Preferencia, Asignacion, Intento, IntentoRegistrado
-from dborrador.views import distribuir, hacer_distribucion, _cambiar_docente, NoTurno
+from dborrador.views import (distribuir, hacer_distribucion, hacer_distribucion_de_todos, _cambiar_docente,
+                             NoTurno, TODOS, copiar_anno_y_cuatrimestre)
+from dborrador.misc import CacheDistribucion
+from dborrador.resolvedores import ResolvedorAllocation, ResolvedorHungaro
 from materias.models import (Docente, Materia, Turno, Cuatrimestres, Cargos, Carga, CargoDedicacion,
                              TipoTurno, TipoMateria, AnnoCuatrimestre)
 from materias.misc import TipoDocentes, Mapeos
@@ -128,6 +134,93 @@ class TestPreparar(TestCase):
         self.assertEqual(copiadas.count(), 1)
         self.assertEqual(copiadas.first().preferencia.turno, turno3)
 
+    def test_preparar_avisa_turnos_repetidos(self):
+        self._agrega_preferencias()
+        PreferenciasDocente.objects.create(docente=self.docente, turno=self.turno1, peso=2,
+                                           tipo_docente=TipoDocentes.P.name,
+                                           fecha_encuesta=self.pref1.fecha_encuesta)
+        Carga.objects.create(docente=self.docente, cargo=CargoDedicacion.TitExc.name,
+                             anno=self.anno, cuatrimestre=Cuatrimestres.P.name)
+
+        response = self.client.get(f'/dborrador/preparar/{self.anno}/P', follow=True)
+        self.assertContains(response, f'{self.docente} tiene turnos repetidos')
+        self.assertFalse(Preferencia.objects.exists())
+
+    def test_copiar_usa_la_ultima_encuesta_con_preferencias(self):
+        # una encuesta más nueva sin preferencias en el período no deja afuera al docente
+        self._agrega_preferencias()
+        Carga.objects.create(docente=self.docente, cargo=CargoDedicacion.TitExc.name,
+                             anno=self.anno, cuatrimestre=Cuatrimestres.P.name)
+        OtrosDatos.objects.create(docente=self.docente, fecha_encuesta=timezone.now() + datetime.timedelta(minutes=1),
+                                  comentario='', email='', telefono='', anno=self.anno,
+                                  cuatrimestre=Cuatrimestres.P.name, tipo_docente=TipoDocentes.P.name)
+        copiadas, _, _, tocados = copiar_anno_y_cuatrimestre(self.anno, Cuatrimestres.P.name)
+        self.assertEqual((copiadas, tocados), (2, {self.docente.id}))
+        self.assertCountEqual([p.preferencia for p in Preferencia.objects.all()], [self.pref1, self.pref2])
+
+    def test_copiar_con_cantidad_fija_de_consultas(self):
+        self._agrega_preferencias()
+        Carga.objects.create(docente=self.docente, cargo=CargoDedicacion.TitExc.name,
+                             anno=self.anno, cuatrimestre=Cuatrimestres.P.name)
+        for numero in range(3, 8):
+            otro = Docente.objects.create(na_nombre=f'otro {numero}', cargos=[CargoDedicacion.TitPar.name])
+            turno = Turno.objects.create(materia=self.materia, anno=self.anno, cuatrimestre=Cuatrimestres.P.name,
+                                         numero=numero, tipo=TipoTurno.A.name,
+                                         necesidad_prof=1, necesidad_jtp=0, necesidad_ay1=0, necesidad_ay2=0)
+            PreferenciasDocente.objects.create(docente=otro, turno=turno, peso=1, tipo_docente=TipoDocentes.P.name,
+                                               fecha_encuesta=self.pref1.fecha_encuesta)
+            OtrosDatos.objects.create(docente=otro, fecha_encuesta=self.pref1.fecha_encuesta,
+                                      comentario='', email='', telefono='', anno=self.anno,
+                                      cuatrimestre=Cuatrimestres.P.name,
+                                      tipo_docente=TipoDocentes.P.name)
+            Carga.objects.create(docente=otro, cargo=CargoDedicacion.TitExc.name,
+                                 anno=self.anno, cuatrimestre=Cuatrimestres.P.name)
+
+        # ya copiadas, últimas fechas con preferencias, preferencias, savepoint, borrar, insertar, release
+        with self.assertNumQueries(7):
+            copiadas, borradas, con_repetidos, tocados = copiar_anno_y_cuatrimestre(self.anno, Cuatrimestres.P.name)
+        self.assertEqual((copiadas, borradas, con_repetidos, len(tocados)), (7, 0, [], 6))
+        self.assertEqual(sorted(Preferencia.objects.filter(preferencia__docente=self.docente)
+                                                   .values_list('peso_normalizado', flat=True)), [0.25, 0.75])
+
+    def test_preparar_solo_rehace_docentes_cambiados(self):
+        self._agrega_preferencias()
+        otro = Docente.objects.create(na_nombre='otro', cargos=[CargoDedicacion.TitPar.name])
+        PreferenciasDocente.objects.create(docente=otro, turno=self.turno1, peso=1, tipo_docente=TipoDocentes.P.name,
+                                           fecha_encuesta=self.pref1.fecha_encuesta)
+        OtrosDatos.objects.create(docente=otro, fecha_encuesta=self.pref1.fecha_encuesta,
+                                  comentario='', email='', telefono='', anno=self.anno,
+                                  cuatrimestre=Cuatrimestres.P.name,
+                                  tipo_docente=TipoDocentes.P.name)
+        for docente in (self.docente, otro):
+            Carga.objects.create(docente=docente, cargo=CargoDedicacion.TitExc.name,
+                                 anno=self.anno, cuatrimestre=Cuatrimestres.P.name)
+        copiar_anno_y_cuatrimestre(self.anno, Cuatrimestres.P.name)
+        de_otro = Preferencia.objects.get(preferencia__docente=otro)
+
+        # sin cambios no se toca nada
+        with self.assertNumQueries(2):
+            self.assertEqual(copiar_anno_y_cuatrimestre(self.anno, Cuatrimestres.P.name), (0, 0, [], set()))
+
+        # una encuesta nueva de self.docente sólo rehace sus preferencias
+        despues = self.pref1.fecha_encuesta + datetime.timedelta(minutes=1)
+        PreferenciasDocente.objects.create(docente=self.docente, turno=self.turno2, peso=1,
+                                           tipo_docente=TipoDocentes.P.name, fecha_encuesta=despues)
+        OtrosDatos.objects.create(docente=self.docente, fecha_encuesta=despues,
+                                  comentario='', email='', telefono='', anno=self.anno,
+                                  cuatrimestre=Cuatrimestres.P.name,
+                                  tipo_docente=TipoDocentes.P.name)
+        response = self.client.get(f'/dborrador/preparar/{self.anno}/P', follow=True)
+        self.assertContains(response, 'Docentes actualizados: 1. Preferencias copiadas: 1, borradas: 2')
+        self.assertEqual(Preferencia.objects.get(preferencia__docente=self.docente).preferencia.turno, self.turno2)
+        self.assertEqual(Preferencia.objects.get(preferencia__docente=otro), de_otro)
+
+        # si otro pierde sus cargas se borran sus preferencias
+        Carga.objects.filter(docente=otro).delete()
+        copiadas, borradas, _, tocados = copiar_anno_y_cuatrimestre(self.anno, Cuatrimestres.P.name)
+        self.assertEqual((copiadas, borradas, tocados), (0, 1, {otro.id}))
+        self.assertFalse(Preferencia.objects.filter(preferencia__docente=otro).exists())
+
 
 class TestPaginaPrincipal(TestCase):
 
@@ -236,6 +329,56 @@ class TestVerDistribucion(TestCase):
                                   content, flags=re.DOTALL),
                         'No figuran los docentes que prefieren un turno sin docentes')
 
+    def test_ver_distribucion_con_cantidad_fija_de_consultas(self):
+        def consultas():
+            url = reverse('dborrador:distribucion', args=(self.anno, self.cuatrimestre.name, 1, 0))
+            with CaptureQueriesContext(connection) as capturadas:
+                response = self.client.get(url, follow=True)
+            self.assertEqual(response.status_code, 200)
+            return len(capturadas)
+
+        IntentoRegistrado.objects.create(intento=Intento(1, 0).valor, anno=self.anno, cuatrimestre=self.cuatrimestre.name)
+        antes = consultas()
+        for k in range(5):
+            docente = Docente.objects.create(na_nombre=f'docente{k}', email='', telefono='',
+                                             cargos=[CargoDedicacion.TitPar.name])
+            turno = Turno.objects.create(materia=self.materia, anno=self.anno, cuatrimestre=self.cuatrimestre.name,
+                                         numero=3 + k, tipo=TipoTurno.A.name,
+                                         necesidad_prof=1, necesidad_jtp=0, necesidad_ay1=0, necesidad_ay2=0)
+            carga = Carga.objects.create(docente=docente, cargo=CargoDedicacion.TitPar.name,
+                                         anno=self.anno, cuatrimestre=self.cuatrimestre.name)
+            Asignacion.objects.create(intentos=(Intento(1, 0).valor, None), carga=carga, turno=turno,
+                                      cargo_que_ocupa=TipoDocentes.P.name)
+            pd = PreferenciasDocente.objects.create(docente=docente, turno=turno, peso=1,
+                                                    tipo_docente=TipoDocentes.P.name, fecha_encuesta=self.now)
+            Preferencia.objects.create(preferencia=pd, peso_normalizado=1)
+        self.assertEqual(consultas(), antes)
+
+    @override_settings(CACHES={'dborrador': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                             'LOCATION': 'test_ver_distribucion'},
+                               'encuestas': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_ver_distribucion_usa_cache(self):
+        CacheDistribucion.backend().clear()
+        IntentoRegistrado.objects.create(intento=Intento(1, 0).valor, anno=self.anno, cuatrimestre=self.cuatrimestre.name)
+        url = reverse('dborrador:distribucion', args=(self.anno, self.cuatrimestre.name, 1, 0))
+        response = self.client.get(url, follow=True)
+        self.assertContains(response, self.docente2.nombre)
+        self.assertEqual(CacheDistribucion.estadisticas(), {'aciertos': 0, 'fallos': 1})
+
+        response = self.client.get(url, follow=True)
+        self.assertContains(response, self.docente2.nombre)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertEqual(CacheDistribucion.estadisticas(), {'aciertos': 1, 'fallos': 1})
+
+        # cambiar docente invalida el cache del período
+        _cambiar_docente(self.anno, self.cuatrimestre.name, Intento(1, 0), self.carga2.id,
+                         nuevo_turno_id=self.turno2.id, cargo_que_ocupa=TipoDocentes.P)
+        self.client.get(url, follow=True)
+        self.assertEqual(CacheDistribucion.estadisticas(), {'aciertos': 1, 'fallos': 2})
+
+        response = self.client.get(reverse('dborrador:estadisticas_cache'))
+        self.assertEqual(response.json(), {'aciertos': 1, 'fallos': 2})
+
     def test_espiar_distribucion(self):
         now = timezone.now()
         pd = PreferenciasDocente.objects.create(docente=self.docente2, turno=self.turno1, peso=1,
@@ -296,6 +439,188 @@ class TestDistribuir(TestCase):
         for asignacion in Asignacion.objects.all():
             self.assertEqual(asignacion.intentos, NumericRange(Intento.de_algoritmo(1).valor, Intento.de_algoritmo(2).valor))
 
+    def _agrega_instancia_mediana(self):
+        now = timezone.now()
+        turnos = [self.turno1, self.turno2]
+        for numero in range(3, 6):
+            turnos.append(Turno.objects.create(materia=self.materia, anno=self.ac.anno, cuatrimestre=self.ac.cuatrimestre,
+                                               numero=numero, tipo=TipoTurno.A.name,
+                                               necesidad_prof=numero % 2 + 1, necesidad_jtp=0, necesidad_ay1=0,
+                                               necesidad_ay2=0))
+        docentes = [self.docente1, self.docente2]
+        for k in range(4):
+            docente = Docente.objects.create(na_nombre=f'docente{k}', email='', telefono='',
+                                             cargos=[CargoDedicacion.TitPar.name])
+            Carga.objects.create(docente=docente, cargo=CargoDedicacion.TitPar.name,
+                                 anno=self.ac.anno, cuatrimestre=self.ac.cuatrimestre)
+            docentes.append(docente)
+        # pesos múltiplos de 1/4 para que allocating no los redondee
+        for k, docente in enumerate(docentes):
+            for j, (turno, peso) in enumerate(zip(turnos[k % 3:], [0.5, 0.25, 0.25])):
+                p = PreferenciasDocente.objects.create(docente=docente, turno=turno, peso=peso,
+                                                       tipo_docente=TipoDocentes.P.name, fecha_encuesta=now)
+                Preferencia.objects.create(preferencia=p, peso_normalizado=peso)
+
+    def _distribuir_con(self, resolvedor):
+        '''devuelve (cantidad de asignaciones, peso total)'''
+        Asignacion.objects.all().delete()
+        IntentoRegistrado.objects.all().delete()
+        hacer_distribucion(self.ac, TipoDocentes.P, 1, resolvedor=resolvedor)
+        peso = sum(Preferencia.objects.get(preferencia__docente=asignacion.carga.docente,
+                                           preferencia__turno=asignacion.turno).peso_normalizado
+                   for asignacion in Asignacion.objects.all())
+        return Asignacion.objects.count(), peso
+
+    @skipUnless(ResolvedorAllocation.disponible(), 'falta allocation')
+    def test_resolvedores_dan_el_mismo_peso(self):
+        self._agrega_instancia_mediana()
+        cantidad, peso = self._distribuir_con(ResolvedorAllocation.nombre)
+        cantidad_hungaro, peso_hungaro = self._distribuir_con(ResolvedorHungaro.nombre)
+        self.assertEqual(cantidad_hungaro, cantidad)
+        self.assertAlmostEqual(peso_hungaro, peso)
+
+    def test_distribuir_con_hungaro(self):
+        self._agrega_instancia_mediana()
+        cantidad, peso = self._distribuir_con(ResolvedorHungaro.nombre)
+        # 6 docentes y 7 lugares: se asignan todos y cada uno va a una de sus preferencias de peso 0.25
+        self.assertEqual(cantidad, 6)
+        self.assertAlmostEqual(peso, 6 * 0.25)
+
+    def test_elegir_resolvedor_desde_el_formulario(self):
+        self._agrega_instancia_mediana()
+        url = reverse('dborrador:seleccion_tipo_distribuir', args=(self.ac.anno, self.ac.cuatrimestre, 0, 0))
+        response = self.client.post(url, {'tipo': TipoDocentes.P.name, 'resolvedor': ResolvedorHungaro.nombre},
+                                    follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Asignacion.objects.count(), 6)
+
+        response = self.client.post(url, {'tipo': TipoDocentes.P.name, 'resolvedor': 'no_existe'})
+        self.assertEqual(response.status_code, 404)
+
+
+    def _agrega_jtps(self):
+        '''turno1 también necesita un JTP; docente1 tiene además una carga de JTP'''
+        now = timezone.now()
+        self.turno1.necesidad_jtp = 1
+        self.turno1.save()
+        carga_jtp = Carga.objects.create(docente=self.docente1, cargo=CargoDedicacion.JTPPar.name,
+                                         anno=self.ac.anno, cuatrimestre=self.ac.cuatrimestre)
+        for docente, turno, tipo in [(self.docente1, self.turno2, TipoDocentes.P),
+                                     (self.docente2, self.turno1, TipoDocentes.P),
+                                     (self.docente1, self.turno1, TipoDocentes.J)]:
+            p = PreferenciasDocente.objects.create(docente=docente, turno=turno, peso=1,
+                                                   tipo_docente=tipo.name, fecha_encuesta=now)
+            Preferencia.objects.create(preferencia=p, peso_normalizado=1)
+        return carga_jtp
+
+    def test_distribuir_todos_los_tipos_juntos(self):
+        carga_jtp = self._agrega_jtps()
+        url = reverse('dborrador:distribuir', args=(self.ac.anno, self.ac.cuatrimestre, TODOS, 0, 0))
+        response = self.client.post(url, {'resolvedor': ResolvedorHungaro.nombre}, follow=True)
+        self.assertEqual(response.status_code, 200)
+
+        # un solo intento nuevo con las asignaciones de los dos tipos
+        self.assertEqual(IntentoRegistrado.maximo_intento(self.ac.anno, self.ac.cuatrimestre), Intento(1, 0))
+        self.assertEqual(IntentoRegistrado.objects.count(), 1)
+        asignaciones = Asignacion.validas_en(self.ac.anno, self.ac.cuatrimestre, Intento(1, 0))
+        self.assertCountEqual([(a.carga, a.turno, a.cargo_que_ocupa) for a in asignaciones],
+                              [(self.carga1, self.turno2, TipoDocentes.P.name),
+                               (self.carga2, self.turno1, TipoDocentes.P.name),
+                               (carga_jtp, self.turno1, TipoDocentes.J.name)])
+
+        # volver a distribuir todo reemplaza las asignaciones automáticas
+        url = reverse('dborrador:distribuir', args=(self.ac.anno, self.ac.cuatrimestre, TODOS, 1, 0))
+        self.client.post(url, {'resolvedor': ResolvedorHungaro.nombre}, follow=True)
+        self.assertEqual(Asignacion.validas_en(self.ac.anno, self.ac.cuatrimestre, Intento(2, 0)).count(), 3)
+        self.assertEqual(Asignacion.validas_en(self.ac.anno, self.ac.cuatrimestre, Intento(1, 0)).count(), 3)
+
+    def test_distribuir_todos_no_mezcla_tipos(self):
+        # docente1 prefiere turno2 como Prof, pero turno2 no necesita JTPs: su carga de JTP sólo va a turno1
+        carga_jtp = self._agrega_jtps()
+        hacer_distribucion_de_todos(self.ac, 1, ResolvedorHungaro.nombre)
+        for asignacion in Asignacion.objects.all():
+            self.assertEqual(Mapeos.tipo_de_carga(asignacion.carga).name, asignacion.cargo_que_ocupa)
+        self.assertEqual(Asignacion.objects.get(carga=carga_jtp).turno, self.turno1)
+
+    def _agrega_profesores_que_sobran(self):
+        '''los dos profesores quieren turno1; turno2 sólo necesita un JTP'''
+        now = timezone.now()
+        self.turno2.necesidad_prof = 0
+        self.turno2.necesidad_jtp = 1
+        self.turno2.save()
+        for docente, turno, peso in [(self.docente1, self.turno1, 1),
+                                     (self.docente1, self.turno2, 0.5),
+                                     (self.docente2, self.turno1, 1)]:
+            p = PreferenciasDocente.objects.create(docente=docente, turno=turno, peso=1,
+                                                   tipo_docente=TipoDocentes.P.name, fecha_encuesta=now)
+            Preferencia.objects.create(preferencia=p, peso_normalizado=peso)
+
+    def test_distribuir_todos_en_cascada(self):
+        self._agrega_profesores_que_sobran()
+        url = reverse('dborrador:distribuir', args=(self.ac.anno, self.ac.cuatrimestre, TODOS, 0, 0))
+        self.client.post(url, {'resolvedor': ResolvedorHungaro.nombre}, follow=True)
+        self.assertEqual(Asignacion.validas_en(self.ac.anno, self.ac.cuatrimestre, Intento(1, 0)).count(), 1)
+
+        # con cascada, el profesor que sobra ocupa el lugar de JTP de turno2
+        url = reverse('dborrador:distribuir', args=(self.ac.anno, self.ac.cuatrimestre, TODOS, 1, 0))
+        self.client.post(url, {'resolvedor': ResolvedorHungaro.nombre, 'cascada': '1', 'penalidad': '0.3'}, follow=True)
+        asignaciones = Asignacion.validas_en(self.ac.anno, self.ac.cuatrimestre, Intento(2, 0))
+        self.assertCountEqual([(a.carga, a.turno, a.cargo_que_ocupa) for a in asignaciones],
+                              [(self.carga2, self.turno1, TipoDocentes.P.name),
+                               (self.carga1, self.turno2, TipoDocentes.J.name)])
+
+        url = reverse('dborrador:distribuir', args=(self.ac.anno, self.ac.cuatrimestre, TODOS, 2, 0))
+        response = self.client.post(url, {'cascada': '1', 'penalidad': '1'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_distribuir_un_tipo_ignora_la_cascada(self):
+        self._agrega_profesores_que_sobran()
+        url = reverse('dborrador:distribuir', args=(self.ac.anno, self.ac.cuatrimestre, TipoDocentes.P.name, 0, 0))
+        # la penalidad ni se valida
+        response = self.client.post(url, {'resolvedor': ResolvedorHungaro.nombre, 'cascada': '1', 'penalidad': '1'},
+                                    follow=True)
+        self.assertContains(response, 'La cascada sólo se usa con')
+        asignaciones = Asignacion.validas_en(self.ac.anno, self.ac.cuatrimestre, Intento(1, 0))
+        self.assertEqual([a.cargo_que_ocupa for a in asignaciones], [TipoDocentes.P.name])
+
+    def test_cascada_prefiere_a_los_del_tipo(self):
+        # un JTP que quiere turno2 le gana el lugar al profesor que baja
+        self._agrega_profesores_que_sobran()
+        carga_jtp = Carga.objects.create(docente=self.docente1, cargo=CargoDedicacion.JTPPar.name,
+                                         anno=self.ac.anno, cuatrimestre=self.ac.cuatrimestre)
+        p = PreferenciasDocente.objects.create(docente=self.docente1, turno=self.turno2, peso=1,
+                                               tipo_docente=TipoDocentes.J.name, fecha_encuesta=timezone.now())
+        Preferencia.objects.create(preferencia=p, peso_normalizado=0.5)
+        hacer_distribucion_de_todos(self.ac, 1, ResolvedorHungaro.nombre, penalidad=0.5)
+        self.assertEqual(Asignacion.objects.get(turno=self.turno2).carga, carga_jtp)
+        with self.assertRaises(ValueError):
+            hacer_distribucion_de_todos(self.ac, 2, ResolvedorHungaro.nombre, penalidad=1.5)
+
+    def test_cascada_no_baja_con_la_misma_preferencia(self):
+        # docente1 quiere igual turno1 (como Prof) y turno2 (que sólo necesita un JTP): se queda en su tipo
+        now = timezone.now()
+        self.turno2.necesidad_prof = 0
+        self.turno2.necesidad_jtp = 1
+        self.turno2.save()
+        for turno in (self.turno1, self.turno2):
+            p = PreferenciasDocente.objects.create(docente=self.docente1, turno=turno, peso=1,
+                                                   tipo_docente=TipoDocentes.P.name, fecha_encuesta=now)
+            Preferencia.objects.create(preferencia=p, peso_normalizado=0.5)
+        hacer_distribucion_de_todos(self.ac, 1, ResolvedorHungaro.nombre, penalidad=0.5)
+        asignacion = Asignacion.objects.get(carga=self.carga1)
+        self.assertEqual((asignacion.turno, asignacion.cargo_que_ocupa), (self.turno1, TipoDocentes.P.name))
+
+    def test_distribuir_un_tipo_despues_de_la_cascada(self):
+        # carga1 quedó en un lugar de JTP; al redistribuir Prof no se la vuelve a asignar
+        self._agrega_profesores_que_sobran()
+        hacer_distribucion_de_todos(self.ac, 1, ResolvedorHungaro.nombre, penalidad=0.3)
+        url = reverse('dborrador:distribuir', args=(self.ac.anno, self.ac.cuatrimestre, TipoDocentes.P.name, 1, 0))
+        self.client.post(url, {'resolvedor': ResolvedorHungaro.nombre}, follow=True)
+        asignaciones = Asignacion.validas_en(self.ac.anno, self.ac.cuatrimestre, Intento(2, 0))
+        self.assertCountEqual([(a.carga, a.turno, a.cargo_que_ocupa) for a in asignaciones],
+                              [(self.carga2, self.turno1, TipoDocentes.P.name),
+                               (self.carga1, self.turno2, TipoDocentes.J.name)])
+
     def test_distribuye_otro_tipo(self):
         # self.docente1 tiene cargo de Prof y de JTP. Tiene una preferencia por turno3 como Prof.
         # Se distribuyen JTP y no debería contar su preferencia.
@@ -481,3 +806,49 @@ class TestModel(TestCase):
         self.assertEqual(list(Asignacion.validas_en(2100, Cuatrimestres.P.name, Intento(2,5))), [a1])
         self.assertEqual(list(Asignacion.validas_en(2102, Cuatrimestres.S.name, Intento(2,5))), [a2])
         self.assertEqual(list(Asignacion.validas_en(2100, Cuatrimestres.S.name, Intento(2,5))), [])
+
+    def test_extender_intentos(self):
+        manual = Asignacion.objects.create(intentos=(Intento(1, 3).valor, Intento(1, 4).valor),
+                                           carga=self.carga, turno=self.turno)
+        automatica = Asignacion.objects.create(intentos=(Intento(1, 0).valor, Intento(1, 4).valor),
+                                               carga=self.carga, turno=self.turno)
+        otra = Asignacion.objects.create(intentos=(Intento(2, 0).valor, Intento(3, 0).valor),
+                                         carga=self.carga, turno=self.turno)
+        validas = Asignacion.validas_en(2100, Cuatrimestres.P.name, Intento(1, 3))
+
+        with self.assertNumQueries(1):
+            cambiadas = Asignacion.extender_intentos(validas, Intento(2, 0).valor, de_algoritmo=True)
+        self.assertEqual(cambiadas, 1)
+        with self.assertNumQueries(1):
+            cambiadas = Asignacion.extender_intentos(validas, None, de_algoritmo=False)
+        self.assertEqual(cambiadas, 1)
+
+        for asignacion in (manual, automatica, otra):
+            asignacion.refresh_from_db()
+        self.assertEqual(manual.intentos, NumericRange(Intento(1, 3).valor, None))
+        self.assertEqual(automatica.intentos, NumericRange(Intento(1, 0).valor, Intento(2, 0).valor))
+        self.assertEqual(otra.intentos, NumericRange(Intento(2, 0).valor, Intento(3, 0).valor))
+
+    def test_consultas_de_asignaciones_usan_indices(self):
+        # con pocas filas postgres prefiere seq scans (y nested loops por la FK a carga);
+        # los desactivo para ver qué índices puede usar cada tabla
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_nestloop = off')
+        intento = Intento(2, 5)
+        consultas = [Asignacion.objects.validas_en(2100, Cuatrimestres.P.name, intento),
+                     Asignacion.objects.posteriores_a(2100, Cuatrimestres.P.name, intento),
+                     Asignacion.objects.activas_por_tipo(2100, Cuatrimestres.P.name, intento, TipoDocentes.P)]
+        for consulta in consultas:
+            plan = consulta.explain()
+            self.assertIn('asignacion_intentos_gist', plan)
+            self.assertIn('carga_periodo_idx', plan)
+
+    def test_posteriores_a(self):
+        antes = Asignacion.objects.create(intentos=(Intento(2, 4).valor, None), carga=self.carga, turno=self.turno)
+        en_el_intento = Asignacion.objects.create(intentos=(Intento(2, 5).valor, None), carga=self.carga, turno=self.turno)
+        despues = Asignacion.objects.create(intentos=(Intento(2, 6).valor, None), carga=self.carga, turno=self.turno)
+        self.assertEqual(list(Asignacion.objects.posteriores_a(2100, Cuatrimestres.P.name, Intento(2, 5))), [despues])
+        self.assertEqual(set(Asignacion.objects.posteriores_a(2100, Cuatrimestres.P.name, Intento(2, 3))),
+                         {antes, en_el_intento, despues})
+        self.assertEqual(list(Asignacion.objects.posteriores_a(2100, Cuatrimestres.S.name, Intento(2, 3))), [])
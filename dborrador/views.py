@@ -4,10 +4,13 @@ from time import monotonic
 from locale import strxfrm
 import csv
 
+from django.conf import settings
 from django.shortcuts import render
-from django.http import Http404, HttpResponseRedirect, HttpResponse
+from django.template.loader import render_to_string
+from django.http import Http404, HttpResponseRedirect, HttpResponse, JsonResponse
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.safestring import mark_safe
 from django.db import transaction
 from django.db.models import Max
 from django.contrib import messages
@@ -15,57 +18,81 @@ from django.contrib.auth.decorators import permission_required, login_required
 
 
 from .models import Preferencia, Asignacion, Intento, IntentoRegistrado
-from .misc import Distribucion
+from .misc import Distribucion, DistribucionSnapshot, CacheDistribucion
+from .resolvedores import RESOLVEDORES, elegir_resolvedor, resolvedores_disponibles
 from materias.models import (Turno, Docente, Carga, Materia, Cuatrimestres, TipoMateria, TipoTurno,
                              choice_enum, AnnoCuatrimestre, TipoDocentes,)
 from materias.misc import Mapeos, NoTurno
 from materias.views import anno_y_cuatrimestre_de_request
 from encuestas.models import PreferenciasDocente, OtrosDatos
 
-from allocation import allocating
-
 
 logger = logging.getLogger(__name__)
 
+# valor de `tipo` en distribuir para distribuir todos los tipos de docentes juntos
+TODOS = 'todos'
+
 
 def copiar_anno_y_cuatrimestre(anno, cuatrimestre):
-    '''devuelve: (prefs copiadas, prefs borradas) '''
-    copiadas = 0
-    borradas, _ = Preferencia.objects.filter(preferencia__turno__anno=anno,
-                                             preferencia__turno__cuatrimestre=cuatrimestre).delete()
+    '''devuelve: (prefs copiadas, prefs borradas, docentes con turnos repetidos, docentes tocados)
+
+    Copia, para cada docente con encuesta y con cargas en el período y para cada tipo de docente,
+    las preferencias de su última encuesta con preferencias en el período, normalizando los pesos
+    por (docente, tipo).
+
+    Las preferencias ya copiadas hacen de marca: dicen de qué fecha_encuesta se copió cada
+    (docente, tipo). Sólo se borran y se rehacen las de los docentes con una encuesta más nueva
+    o que ganaron o perdieron cargas en el período.
+    '''
+    del_periodo = Preferencia.objects.filter(preferencia__turno__anno=anno,
+                                             preferencia__turno__cuatrimestre=cuatrimestre)
+    copiadas_de = set(del_periodo.values_list('preferencia__docente_id', 'preferencia__tipo_docente',
+                                              'preferencia__fecha_encuesta').distinct())
+
+    con_cargas = Carga.objects.filter(anno=anno, cuatrimestre=cuatrimestre).values('docente')
+    con_encuesta = OtrosDatos.objects.values('docente')
+    del_docente = PreferenciasDocente.objects.filter(turno__anno=anno, turno__cuatrimestre=cuatrimestre,
+                                                     docente__in=con_cargas) \
+                                             .filter(docente__in=con_encuesta)
+    ultimas = set(del_docente.order_by()
+                             .values_list('docente_id', 'tipo_docente')
+                             .annotate(fecha=Max('fecha_encuesta')))
+    tocados = {docente_id for docente_id, _, _ in copiadas_de ^ ultimas}
+    if not tocados:
+        return 0, 0, [], tocados
+
+    por_docente_y_tipo = defaultdict(list)
+    for pref in del_docente.filter(docente__in=tocados).select_related('docente'):
+        if (pref.docente_id, pref.tipo_docente, pref.fecha_encuesta) in ultimas:
+            por_docente_y_tipo[(pref.docente, pref.tipo_docente)].append(pref)
+
+    nuevas = []
+    con_repetidos = []
+    for (docente, tipo_docente), prefs in por_docente_y_tipo.items():
+        # chequeo que no haya repetidos
+        # En la encuesta ya se chequea pero lo repito por si cambio algo
+        # XXX: no quiero tirar una excepción acá pero no copiar no es la solución.
+        #      Quizás haya que agregar una página de chequeos antes de distribuir?
+        cantidad_turnos = len({pref.turno_id for pref in prefs})
+        if cantidad_turnos < len(prefs):
+            logger.error('El docente %s tiene preferencias con turnos repetidos: %s. No copio sus preferencias.',
+                         docente, prefs)
+            con_repetidos.append(docente)
+            continue
+
+        peso_total = sum(pref.peso for pref in prefs)
+        logger.debug('considerando %d prefs para %s. Peso total: %s',
+                     len(prefs), docente, peso_total)
+        nuevas.extend(Preferencia(preferencia=pref,
+                                  peso_normalizado=pref.peso / peso_total if peso_total else 1 / len(prefs))
+                      for pref in prefs)
+
+    with transaction.atomic():
+        borradas, _ = del_periodo.filter(preferencia__docente__in=tocados).delete()
+        Preferencia.objects.bulk_create(nuevas)
+
+    return len(nuevas), borradas, con_repetidos, tocados
 
-    docentes_con_encuesta = {od.docente for od in OtrosDatos.objects.all()}
-    docentes_con_cargas = {c.docente for c in Carga.objects.filter(anno=anno, cuatrimestre=cuatrimestre)}
-    for docente in docentes_con_encuesta & docentes_con_cargas:
-        prefs = PreferenciasDocente.objects.filter(turno__anno=anno,
-                                                   turno__cuatrimestre=cuatrimestre,
-                                                   docente=docente)
-        tipos_del_docente = {pref.tipo_docente for pref in prefs}
-        for tipo_docente in tipos_del_docente:
-            fecha_ultima_encuesta = prefs.filter(tipo_docente=tipo_docente).order_by('fecha_encuesta').last().fecha_encuesta
-            prefs_ultimas = prefs.filter(fecha_encuesta=fecha_ultima_encuesta)
-
-            # chequeo que no haya repetidos
-            # En la encuesta ya se chequea pero lo repito por si cambio algo
-            # XXX: no quiero tirar una excepción acá pero no copiar no es la solución.
-            #      Quizás haya que agregar una página de chequeos antes de distribuir?
-            cantidad_turnos = len({pref.turno for pref in prefs_ultimas})
-            if cantidad_turnos < prefs_ultimas.count():
-                logger.error('El docente %s tiene preferencias con turnos repetidos: %s. No copio sus preferencias.',
-                             docente, prefs_ultimas)
-                continue
-
-            peso_total = sum(pref.peso for pref in prefs_ultimas)
-            logger.debug('considerando %d prefs para %s. Peso total: %s',
-                         prefs_ultimas.count(), docente, peso_total)
-
-            for pref in prefs_ultimas:
-                peso_normalizado = pref.peso / peso_total if peso_total else 1 / prefs_ultimas.count()
-                pref_copia = Preferencia.objects.create(preferencia=pref,
-                                                        peso_normalizado=peso_normalizado)
-                copiadas += 1
-
-    return copiadas, borradas
 
 def _anno_cuat_tipos_context():
     anno_actual = timezone.now().year
@@ -86,8 +113,14 @@ def index(request):
 @permission_required('dborrador.add_asignacion')
 def preparar(request, anno, cuatrimestre):
     logger.info('copiando preferencias para %s, cuatrimestre %s', anno, Cuatrimestres[cuatrimestre].value)
-    copiadas, borradas = copiar_anno_y_cuatrimestre(anno, cuatrimestre)
-    logger.info('copiadas: %d, borradas: %d', copiadas, borradas)
+    copiadas, borradas, con_repetidos, tocados = copiar_anno_y_cuatrimestre(anno, cuatrimestre)
+    logger.info('docentes tocados: %d, copiadas: %d, borradas: %d', len(tocados), copiadas, borradas)
+    messages.info(request, f'Docentes actualizados: {len(tocados)}. '
+                           f'Preferencias copiadas: {copiadas}, borradas: {borradas}')
+    for docente in con_repetidos:
+        messages.warning(request, f'{docente} tiene turnos repetidos en su encuesta. No copié sus preferencias.')
+    if tocados:
+        CacheDistribucion.invalidar(anno, cuatrimestre)
     max_intento = IntentoRegistrado.maximo_intento(anno, cuatrimestre)
     distribucion_url = reverse('dborrador:distribucion', args=(anno, cuatrimestre,
                                                                max_intento.algoritmo, max_intento.manual))
@@ -129,32 +162,38 @@ def espiar_distribucion(request, anno, cuatrimestre, intento_algoritmo, intento_
                'intento_manual': intento.manual,
                'intento': intento.valor,
                'tipos': list(TipoDocentes),
+               'resolvedores': resolvedores_disponibles(),
+               'penalidad_cascada': getattr(settings, 'DBORRADOR_PENALIDAD_CASCADA', 0.5),
                **_todos_los_intentos(anno, cuatrimestre, intento.algoritmo),
                }
 
-    obligatoriedades = {TipoMateria.B.name: 'Obligatorias',
-                        TipoMateria.R.name: 'Optativas regulares',
-                        TipoMateria.N.name: 'Optativas no regulares'}
+    def generar_cuerpo():
+        obligatoriedades = {TipoMateria.B.name: 'Obligatorias',
+                            TipoMateria.R.name: 'Optativas regulares',
+                            TipoMateria.N.name: 'Optativas no regulares'}
 
-    asignaciones_moviles = Distribucion.asignaciones_por_cargo_ocupado(anno_cuat, intento)
-    asignaciones_fijas = Distribucion.ya_distribuidas_por_cargo(anno_cuat)
+        asignaciones_moviles = Distribucion.asignaciones_por_cargo_ocupado(anno_cuat, intento)
+        asignaciones_fijas = Distribucion.ya_distribuidas_por_cargo(anno_cuat)
 
-    materias = []
-    for obligatoriedad, obligatoriedad_largo in obligatoriedades.items():
-        tmaterias = Materia.objects.filter(obligatoriedad=obligatoriedad)
+        materias = []
+        for obligatoriedad, obligatoriedad_largo in obligatoriedades.items():
+            tmaterias = Materia.objects.filter(obligatoriedad=obligatoriedad)
 
-        ob_materias = []
-        for materia in tmaterias:
-            mat_turnos = []
-            for turno in sorted(materia.turno_set.filter(anno=anno, cuatrimestre=cuatrimestre)):
-                turno.asignaciones = list(asignaciones_moviles[turno].items())
-                turno.cargas = list(asignaciones_fijas[turno].items())
-                mat_turnos.append(turno)
+            ob_materias = []
+            for materia in tmaterias:
+                mat_turnos = []
+                for turno in materia.turno_set.filter(anno=anno, cuatrimestre=cuatrimestre) \
+                                              .order_by(*Turno.ORDEN_POR_HORARIO):
+                    turno.asignaciones = list(asignaciones_moviles[turno].items())
+                    turno.cargas = list(asignaciones_fijas[turno].items())
+                    mat_turnos.append(turno)
+
+                ob_materias.append([materia, mat_turnos])
 
-            ob_materias.append([materia, mat_turnos])
+            materias.append((obligatoriedad_largo, ob_materias))
+        return render_to_string('dborrador/espiar_distribucion_cuerpo.html', {'materias': materias})
 
-        materias.append((obligatoriedad_largo, ob_materias))
-    context['materias'] = materias
+    context['cuerpo'] = mark_safe(CacheDistribucion.obtener('espiar', anno, cuatrimestre, intento, generar_cuerpo))
     return render(request, 'dborrador/espiar_distribucion.html', context)
 
 
@@ -207,73 +246,33 @@ def ver_distribucion(request, anno, cuatrimestre, intento_algoritmo, intento_man
                'intento_manual': intento_manual,
                'intento': intento.valor,
                'tipos': list(TipoDocentes),
+               'resolvedores': resolvedores_disponibles(),
+               'penalidad_cascada': getattr(settings, 'DBORRADOR_PENALIDAD_CASCADA', 0.5),
                **_todos_los_intentos(anno, cuatrimestre, intento_algoritmo),
                }
 
-    turnos_ac = Turno.objects.filter(anno=anno, cuatrimestre=cuatrimestre)
-    obligatoriedades = {TipoMateria.B.name: 'Obligatorias',
-                        TipoMateria.R.name: 'Optativas regulares',
-                        TipoMateria.N.name: 'Optativas no regulares'}
-
-    asignaciones_moviles = Distribucion.asignaciones_por_cargo_ocupado(anno_cuat, intento)
-    asignaciones_fijas = Distribucion.ya_distribuidas_por_cargo(anno_cuat)
-    necesidades_por_turno = Mapeos.necesidades_por_turno_y_tipo(anno_cuat)
-
-    preferencias = Preferencia.objects.filter(preferencia__turno__anno=anno,
-                                              preferencia__turno__cuatrimestre=cuatrimestre) \
-                                      .order_by('preferencia__tipo_docente',
-                                                'peso_normalizado',
-                                                'preferencia__docente__na_apellido')
-    preferencias_por_turno = {turno: preferencias.filter(preferencia__turno=turno).all()
-                              for turno in turnos_ac.all()}
-    context['todas_las_preferencias'] = preferencias
-
-    materias = []
-    for obligatoriedad, obligatoriedad_largo in obligatoriedades.items():
-        tmaterias = Materia.objects.filter(obligatoriedad=obligatoriedad)
-
-        ob_materias = []
-        for materia in tmaterias:
-            mat_turnos = []
-            for turno in sorted(turnos_ac.filter(materia=materia)):
-                turno.asignaciones = [(tipo, asignaciones_moviles[turno][tipo]) for tipo in TipoDocentes]
-                turno.cargas = [(tipo, asignaciones_fijas[turno][tipo]) for tipo in TipoDocentes]
-                turno.necesidades_insatisfechas = {tipo: necesidades_por_turno[turno][tipo] \
-                                                         - len(asignaciones_moviles[turno][tipo]) \
-                                                         - len(asignaciones_fijas[turno][tipo])
-                                                   for tipo in TipoDocentes}
-                turno.preferencias = list(preferencias_por_turno[turno])
-                mat_turnos.append(turno)
-
-            ob_materias.append([materia, mat_turnos])
-
-        materias.append((obligatoriedad_largo, ob_materias))
-    context['materias'] = materias
-
-    cargas_sin_distribuir = Distribucion.no_distribuidas_por_cargo(anno_cuat)
-    cargas_de_asignaciones_moviles = {a.carga for a in Asignacion.validas_en(anno, cuatrimestre, intento)}
-    cargas_sin_asignar = {tipo: sorted(set(cargas_sin_distribuir[tipo]) - cargas_de_asignaciones_moviles,
-                                       key=lambda c: c.docente.apellido_nombre)
-                          for tipo in TipoDocentes}
-    # agrego preferencias al dict
-    cargas_sin_asignar_anotadas = {tipo: [(carga, preferencias.filter(preferencia__docente=carga.docente,
-                                                                      preferencia__tipo_docente=tipo.name).all())
-                                          for carga in cargas]
-                                   for tipo, cargas in cargas_sin_asignar.items()}
-
-    context['cambiar_docente_url'] = reverse('dborrador:cambiar_docente',
-                                             args=(anno, cuatrimestre, intento.algoritmo, intento.manual, 0))[:-1]
-
-    necesidades_por_tipo = {tipo: sum(necesidades_por_turno[turno][tipo] for turno in turnos_ac)
-                            for tipo in TipoDocentes}
-    cargas_por_tipo = {tipo: sum(len(asignaciones_moviles[turno][tipo]) + len(asignaciones_fijas[turno][tipo]) for turno in turnos_ac) \
-                             + len(cargas_sin_asignar[tipo])
-                       for tipo in TipoDocentes}
-
-    context['info_por_tipo'] = {tipo: InformacionParaTemplate(cargas_sin_asignar_anotadas[tipo],
-                                                              necesidades_por_tipo[tipo],
-                                                              cargas_por_tipo[tipo])
-                                for tipo in TipoDocentes}
+    def generar_cuerpo():
+        obligatoriedades = {TipoMateria.B.name: 'Obligatorias',
+                            TipoMateria.R.name: 'Optativas regulares',
+                            TipoMateria.N.name: 'Optativas no regulares'}
+
+        snapshot = DistribucionSnapshot(anno_cuat, intento)
+        cargas_sin_asignar = snapshot.sin_asignar()
+        necesidades_por_tipo = snapshot.necesidades_por_tipo()
+        cargas_por_tipo = snapshot.cargas_por_tipo(cargas_sin_asignar)
+
+        cuerpo_context = {
+            'materias': snapshot.materias_por_obligatoriedad(obligatoriedades),
+            'cambiar_docente_url': reverse('dborrador:cambiar_docente',
+                                           args=(anno, cuatrimestre, intento.algoritmo, intento.manual, 0))[:-1],
+            'info_por_tipo': {tipo: InformacionParaTemplate(cargas_sin_asignar[tipo],
+                                                            necesidades_por_tipo[tipo],
+                                                            cargas_por_tipo[tipo])
+                              for tipo in TipoDocentes},
+        }
+        return render_to_string('dborrador/distribucion_cuerpo.html', cuerpo_context)
+
+    context['cuerpo'] = mark_safe(CacheDistribucion.obtener('distribucion', anno, cuatrimestre, intento, generar_cuerpo))
 
     return render(request, 'dborrador/distribucion.html', context)
 
@@ -288,24 +287,8 @@ def empezar_a_distribuir(request):
     return HttpResponseRedirect(distribucion_url)
 
 
-def hacer_distribucion(anno_cuat, tipo, intento_algoritmo):
-    logger.info('Comienzo una distribución automática para el intento %d', intento_algoritmo)
-    intento = Intento.de_algoritmo(intento_algoritmo)
-
-    def _como_conjunto(turno_tipo_objs):
-        return {obj
-                for para_turno in turno_tipo_objs.values()
-                for obj in para_turno[tipo]}
-
-    cargas_distribuidas = Distribucion.ya_distribuidas_por_cargo(anno_cuat)
-    cargas_asignadas = Distribucion.asignaciones_por_cargo_ocupado(anno_cuat, intento)
-
-    cargas_asignadas_conjunto = {asignacion.carga for asignacion in _como_conjunto(cargas_asignadas)}
-    cargas_a_distribuir = set(Distribucion.no_distribuidas_por_cargo(anno_cuat)[tipo])
-    todavia_sin_distribuir = cargas_a_distribuir - cargas_asignadas_conjunto
-
-    sources = {str(c.id): 1 for c in todavia_sin_distribuir}
-
+def _lugares_libres(tipo, anno_cuat, cargas_distribuidas, cargas_asignadas):
+    '''devuelve {str(turno_id): lugares sin cubrir} y {str(turno_id): Turno} para docentes de tipo'''
     necesidades = Mapeos.turno_y_necesidad(tipo, anno_cuat)
     targets = {}
     for turno, necesidad in necesidades.items():
@@ -316,50 +299,123 @@ def hacer_distribucion(anno_cuat, tipo, intento_algoritmo):
                          turno, cargas_distribuidas[turno][tipo] + cargas_asignadas[turno][tipo], necesidad)
         elif cubiertas < necesidad:
             targets[str(turno.id)] = necesidad - cubiertas
+    return targets, {str(turno.id): turno for turno in necesidades}
 
 
-    # docentes a distribuir
-    preferencias = Preferencia.objects.filter(preferencia__tipo_docente=tipo.name).all()
-    pesos = []
-    for carga in todavia_sin_distribuir:
-        doc_pref = preferencias.filter(preferencia__docente=carga.docente)
-        for preferencia in doc_pref:
-            carga_id = str(carga.id)
-            turno_id = str(preferencia.preferencia.turno.id)
-            if turno_id in targets:
-                pesos.append({'from': carga_id,
-                              'to': turno_id,
-                              'weight': preferencia.peso_normalizado
-                              })
-            else:
-                logger.debug('Tengo una preferencia de %s para %s pero ese turno no necesita docentes de tipo %s',
-                             preferencia.preferencia.docente, preferencia.preferencia.turno, tipo.value)
-
-    wmap = allocating.ListWeightedMap(pesos)
-    logger.info('Voy a hacer una distribución con %d cargas docentes y %d lugares en turnos',
-                sum(sources.values()), sum(targets.values()))
+def _hacer_distribucion(anno_cuat, tipos, intento_algoritmo, resolvedor, penalidad=None):
+    '''Distribuye las cargas de todos los tipos en un solo problema y guarda un solo intento.
+
+    Los lugares de cada tipo se identifican como f'{tipo.name}:{turno_id}'. Sin penalidad,
+    cada carga sólo puede ocupar lugares de su tipo. Con penalidad (entre 0 y 1), una carga
+    también puede ocupar lugares de tipos inferiores (ver Mapeos.filtrar_cargas_de_tipo_le):
+    el peso es el de su preferencia como docente de su tipo, dividido por
+    (1 - penalidad) por cada categoría que baja. Como los pesos son costos, bajar
+    siempre es más caro que ocupar un lugar del propio tipo con la misma preferencia.
+    '''
+    if penalidad is not None and not 0 <= penalidad < 1:
+        raise ValueError(f'La penalidad tiene que estar en [0, 1) y es {penalidad}')
+    logger.info('Comienzo una distribución automática para el intento %d', intento_algoritmo)
+    intento = Intento.de_algoritmo(intento_algoritmo)
+
+    cargas_distribuidas = Distribucion.ya_distribuidas_por_cargo(anno_cuat)
+    cargas_asignadas = Distribucion.asignaciones_por_cargo_ocupado(anno_cuat, intento)
+    no_distribuidas = Distribucion.no_distribuidas_por_cargo(anno_cuat)
+    # una carga asignada no se vuelve a distribuir, aunque ocupe un lugar de otro tipo (por la cascada)
+    cargas_asignadas_ids = {asignacion.carga_id
+                            for para_turno in cargas_asignadas.values()
+                            for asignaciones in para_turno.values()
+                            for asignacion in asignaciones}
+
+    resolvedor = elegir_resolvedor(resolvedor)
+    logger.info('Distribuyo con %s', resolvedor.descripcion)
+    comienzo = monotonic()
+
+    sources, targets, bloques = {}, {}, []
+    cargas_por_id, turnos_por_lugar, targets_por_tipo = {}, {}, {}
+    for tipo in tipos:
+        todavia_sin_distribuir = [carga for carga in no_distribuidas[tipo] if carga.id not in cargas_asignadas_ids]
+        targets_tipo, turnos_por_id = _lugares_libres(tipo, anno_cuat, cargas_distribuidas, cargas_asignadas)
+        targets_por_tipo[tipo] = targets_tipo
+        logger.info('Tipo %s: %d cargas docentes y %d lugares en turnos',
+                    tipo.value, len(todavia_sin_distribuir), sum(targets_tipo.values()))
+
+        prefijo = f'{tipo.name}:'
+        sources.update({str(carga.id): 1 for carga in todavia_sin_distribuir})
+        targets.update({prefijo + turno_id: lugares for turno_id, lugares in targets_tipo.items()})
+        bloques.append((prefijo, resolvedor.pesos(anno_cuat, tipo, todavia_sin_distribuir, targets_tipo)))
+        cargas_por_id.update({str(carga.id): carga for carga in todavia_sin_distribuir})
+        turnos_por_lugar.update({prefijo + turno_id: (tipo, turno) for turno_id, turno in turnos_por_id.items()})
+
+    if penalidad is not None:
+        bloques.extend(_bloques_de_cascada(anno_cuat, tipos, list(cargas_por_id.values()), targets_por_tipo,
+                                           resolvedor, penalidad))
 
     # llamamos al distribuidor
-    allocator = allocating.Allocator(sources, wmap, targets, limit_denominator=100)
-    distribucion = allocator.get_best()
+    distribucion = resolvedor.resolver(sources, targets, resolvedor.combinar(bloques))
+    logger.info('La distribución tardó %.3f segundos', monotonic() - comienzo)
     logger.debug('distribución obtenida (con ids): %s', distribucion)
 
     with transaction.atomic():
 
-        logger.info('Voy a poner asignaciones para %s cargas de %s', len(distribucion), tipo.value)
+        logger.info('Voy a poner asignaciones para %s cargas de %s', len(distribucion),
+                    ', '.join(tipo.value for tipo in tipos))
         IntentoRegistrado.objects.create(intento=intento.valor, anno=anno_cuat.anno, cuatrimestre=anno_cuat.cuatrimestre)
 
         intento_hasta = Intento.de_algoritmo(intento_algoritmo + 1)
         intentos_para_distribuidos = (intento.valor, intento_hasta.valor)
-        for carga_id, turno_id in distribucion:
-            if carga_id is None or turno_id is None:
-                continue
-
-            carga = Carga.objects.get(pk=int(carga_id))
-            turno = Turno.objects.get(pk=int(turno_id))
-            asignacion, _ = Asignacion.objects.get_or_create(intentos=intentos_para_distribuidos,
-                                                             carga=carga, turno=turno,
-                                                             cargo_que_ocupa=tipo.name)
+        pares_por_tipo = defaultdict(list)
+        for carga_id, lugar in distribucion:
+            tipo, turno = turnos_por_lugar[lugar]
+            pares_por_tipo[tipo].append((cargas_por_id[carga_id], turno))
+        for tipo, pares in pares_por_tipo.items():
+            nuevas = Distribucion.guardar_asignaciones(pares, intentos_para_distribuidos, tipo)
+            logger.info('Guardé %d asignaciones nuevas de %s', len(nuevas), tipo.value)
+            en_cascada = sum(1 for carga, _ in pares if Mapeos.tipo_de_carga(carga) != tipo)
+            if en_cascada:
+                logger.info('%d de ellas son de docentes de una categoría superior', en_cascada)
+
+
+def _bloques_de_cascada(anno_cuat, tipos, cargas, targets_por_tipo, resolvedor, penalidad):
+    '''pesos de las cargas en lugares de tipos inferiores al suyo, con el prefijo del tipo del lugar'''
+    orden = list(TipoDocentes)
+    bloques = []
+    for tipo_lugar in tipos:
+        de_arriba = defaultdict(list)
+        for carga in Mapeos.filtrar_cargas_de_tipo_le(tipo_lugar, cargas):
+            tipo_carga = Mapeos.tipo_de_carga(carga)
+            if tipo_carga != tipo_lugar:
+                de_arriba[tipo_carga].append(carga)
+
+        for tipo_carga, cargas_de_arriba in de_arriba.items():
+            factor = (1 - penalidad) ** -(orden.index(tipo_lugar) - orden.index(tipo_carga))
+            logger.info('Cascada: %d cargas de %s pueden ocupar lugares de %s (factor %.3f)',
+                        len(cargas_de_arriba), tipo_carga.value, tipo_lugar.value, factor)
+            bloques.append((f'{tipo_lugar.name}:',
+                            resolvedor.pesos(anno_cuat, tipo_lugar, cargas_de_arriba, targets_por_tipo[tipo_lugar],
+                                             tipo_preferencias=tipo_carga, factor=factor)))
+    return bloques
+
+
+def hacer_distribucion(anno_cuat, tipo, intento_algoritmo, resolvedor=None):
+    _hacer_distribucion(anno_cuat, [tipo], intento_algoritmo, resolvedor)
+
+
+def hacer_distribucion_de_todos(anno_cuat, intento_algoritmo, resolvedor=None, penalidad=None):
+    _hacer_distribucion(anno_cuat, list(TipoDocentes), intento_algoritmo, resolvedor, penalidad)
+
+
+def _penalidad_de_request(request):
+    '''None si no se pidió cascada; si no, la penalidad del formulario o settings.DBORRADOR_PENALIDAD_CASCADA'''
+    if not request.POST.get('cascada'):
+        return None
+    penalidad = request.POST.get('penalidad') or getattr(settings, 'DBORRADOR_PENALIDAD_CASCADA', 0.5)
+    try:
+        penalidad = float(penalidad)
+    except ValueError:
+        raise Http404(f'La penalidad {penalidad} no es un número')
+    if not 0 <= penalidad < 1:
+        raise Http404(f'La penalidad tiene que estar en [0, 1) y es {penalidad}')
+    return penalidad
 
 
 @login_required
@@ -367,6 +423,16 @@ def hacer_distribucion(anno_cuat, tipo, intento_algoritmo):
 def distribuir(request, anno, cuatrimestre, tipo, intento_algoritmo, intento_manual):
     logger.info('comienzo una distribución para docentes tipo %s, cuatrimestre %s, año %s a partir de Intento(%d, %d)',
                 tipo, cuatrimestre, anno, intento_algoritmo, intento_manual)
+    resolvedor = request.POST.get('resolvedor') or None
+    if resolvedor is not None and resolvedor not in RESOLVEDORES:
+        raise Http404(f'No conozco el resolvedor {resolvedor}')
+    penalidad = None
+    if tipo == TODOS:
+        penalidad = _penalidad_de_request(request)
+    elif request.POST.get('cascada'):
+        # con un solo tipo no hay categorías inferiores que ocupar
+        logger.warning('Ignoro la cascada pedida para distribuir sólo %s', tipo)
+        messages.warning(request, 'La cascada sólo se usa con "Todos juntos": distribuí sin cascada.')
 
     ##   Distribuimos a partir de I = Intento(a, m), generamos Intento(a+1, 0)
     ##   Lo que hacemos es:
@@ -376,6 +442,9 @@ def distribuir(request, anno, cuatrimestre, tipo, intento_algoritmo, intento_man
     ##      si empiezan en (a', 0), ponerles fin en (a+2, 0)
     ##   d. Para asignaciones de tipo = tipo
     ##      si empiezan en (a', 0) ponerles fin en (a+1, 0) ==> estas van a distribución
+    ##   Con tipo = TODOS, todas las asignaciones que empiezan en (a', 0) van a distribución
+    ##   y se distribuyen todos los tipos juntos en Intento(a+1, 0). Si se pide cascada, las cargas
+    ##   que sobran pueden ocupar lugares de tipos inferiores con una penalidad.
 
     with transaction.atomic():
         intento = Intento(intento_algoritmo, intento_manual)
@@ -383,38 +452,34 @@ def distribuir(request, anno, cuatrimestre, tipo, intento_algoritmo, intento_man
         borrados, _ = IntentoRegistrado.objects.filter(intento__gt=intento.valor, anno=anno, cuatrimestre=cuatrimestre).delete()
         logger.info('Borré %d intentos', borrados)
 
-        para_borrar = Asignacion.objects.filter(intentos__startswith__gt=intento.valor,
-                                                turno__anno=anno, turno__cuatrimestre=cuatrimestre)
+        para_borrar = Asignacion.objects.posteriores_a(anno, cuatrimestre, intento)
         logger.warning('Borro %d asignaciones', para_borrar.count())
         para_borrar.delete()
 
-        asignaciones = Asignacion.validas_en(anno, cuatrimestre, intento).all()
-        para_extender = [a for a in asignaciones if not Intento.es_de_algoritmo(a.intentos.lower)]
-        for a in para_extender:
-            a.intentos = (a.intentos.lower, None)
-            a.save()
-        logger.info('Extendí %d asignaciones manuales', len(para_extender))
+        asignaciones = Asignacion.validas_en(anno, cuatrimestre, intento)
+        extendidas = Asignacion.extender_intentos(asignaciones, None, de_algoritmo=False)
+        logger.info('Extendí %d asignaciones manuales', extendidas)
 
         proximo_intento_algoritmo = intento_algoritmo + 1
-        tipo = TipoDocentes[tipo]
-        for t in TipoDocentes:
-            asignaciones_tipo_t = [a
-                                   for a in asignaciones.filter(cargo_que_ocupa=t.name)
-                                   if Intento.es_de_algoritmo(a.intentos.lower)]
-            if t == tipo:
-                for a in asignaciones_tipo_t:
-                    a.intentos = (a.intentos.lower, Intento(proximo_intento_algoritmo, 0).valor)
-                    a.save()
-            else:
-                for a in asignaciones_tipo_t:
-                    a.intentos = (a.intentos.lower, Intento(proximo_intento_algoritmo + 1, 0).valor)
-                    a.save()
-            logger.info('Extendí %d asignaciones automáticas de tipo %s', len(asignaciones_tipo_t), t.value)
-
         anno_cuat = AnnoCuatrimestre(anno, cuatrimestre)
-        hacer_distribucion(anno_cuat, tipo, proximo_intento_algoritmo)
+        if tipo == TODOS:
+            # todas las asignaciones automáticas van a distribución
+            extendidas = Asignacion.extender_intentos(asignaciones, Intento(proximo_intento_algoritmo, 0).valor,
+                                                      de_algoritmo=True)
+            logger.info('Extendí %d asignaciones automáticas', extendidas)
+            hacer_distribucion_de_todos(anno_cuat, proximo_intento_algoritmo, resolvedor, penalidad)
+        else:
+            tipo = TipoDocentes[tipo]
+            extendidas = Asignacion.extender_intentos(Asignacion.objects.activas_por_tipo(anno, cuatrimestre, intento, tipo),
+                                                      Intento(proximo_intento_algoritmo, 0).valor, de_algoritmo=True)
+            logger.info('Extendí %d asignaciones automáticas de tipo %s', extendidas, tipo.value)
+            extendidas = Asignacion.extender_intentos(asignaciones.exclude(cargo_que_ocupa=tipo.name),
+                                                      Intento(proximo_intento_algoritmo + 1, 0).valor, de_algoritmo=True)
+            logger.info('Extendí %d asignaciones automáticas de otros tipos', extendidas)
+            hacer_distribucion(anno_cuat, tipo, proximo_intento_algoritmo, resolvedor)
         logger.info('hice una distribucion automática en intento %d', proximo_intento_algoritmo)
 
+    CacheDistribucion.invalidar(anno, cuatrimestre)
     distribucion_url = reverse('dborrador:distribucion', args=(anno, cuatrimestre, proximo_intento_algoritmo, 0))
     return HttpResponseRedirect(distribucion_url)
 
@@ -436,16 +501,12 @@ def _cambiar_docente(anno, cuatrimestre, intento, carga_id, nuevo_turno_id, carg
     with transaction.atomic():
         # borro instancias de IntentoRegistrado y Asignacion
         IntentoRegistrado.objects.filter(intento__gt=intento.valor, anno=anno, cuatrimestre=cuatrimestre).delete()
-        borradas, _ = Asignacion.objects.filter(carga__anno=anno, carga__cuatrimestre=cuatrimestre,
-                                                intentos__startswith__gt=intento.valor).delete()
+        borradas, _ = Asignacion.objects.posteriores_a(anno, cuatrimestre, intento).delete()
         logger.info('Asignaciones borradas: %s', borradas)
         # cambio las asignaciones que empezaron antes y terminan después
-        for asignacion in Asignacion.validas_en(anno, cuatrimestre, intento).all():
-            if Intento.es_de_algoritmo(asignacion.intentos.lower):
-                asignacion.intentos = (asignacion.intentos.lower, Intento.de_algoritmo(intento.algoritmo + 1).valor)
-            else:
-                asignacion.intentos = (asignacion.intentos.lower, None)
-            asignacion.save()
+        validas = Asignacion.validas_en(anno, cuatrimestre, intento)
+        Asignacion.extender_intentos(validas, Intento.de_algoritmo(intento.algoritmo + 1).valor, de_algoritmo=True)
+        Asignacion.extender_intentos(validas, None, de_algoritmo=False)
         # genero nuevo IntentoRegistrado
         IntentoRegistrado.objects.create(intento=nuevo_intento.valor, anno=anno, cuatrimestre=cuatrimestre)
 
@@ -461,6 +522,8 @@ def _cambiar_docente(anno, cuatrimestre, intento, carga_id, nuevo_turno_id, carg
                                   intentos=(nuevo_intento.valor, None),
                                   cargo_que_ocupa=cargo_que_ocupa.name)
 
+    CacheDistribucion.invalidar(anno, cuatrimestre)
+
 
 @login_required
 @permission_required('dborrador.add_asignacion')
@@ -515,6 +578,8 @@ def cambiar_docente(request, anno, cuatrimestre, intento_algoritmo, intento_manu
                    'es_maximo_intento': IntentoRegistrado.maximo_intento(anno, cuatrimestre) == intento,
                    'intento_manual': intento_manual,
                    'asignado': asignado,
+                   'resolvedores': resolvedores_disponibles(),
+                   'penalidad_cascada': getattr(settings, 'DBORRADOR_PENALIDAD_CASCADA', 0.5),
                    **_todos_los_intentos(anno, cuatrimestre, intento_algoritmo),
                    }
 
@@ -538,7 +603,8 @@ def _datos_para_exportar(anno, cuatrimestre, intento_algoritmo, intento_manual):
 
             turnos_materia = []
 
-            for turno in sorted(materia.turno_set.filter(anno=anno, cuatrimestre=cuatrimestre)):
+            for turno in materia.turno_set.filter(anno=anno, cuatrimestre=cuatrimestre) \
+                                          .order_by(*Turno.ORDEN_POR_HORARIO):
 
                 docentes = [a.carga.docente.nombre for a in asignaciones.filter(turno=turno).all()]
                 docentes += [c.docente.nombre for c in turno.carga_set.all()]
@@ -621,6 +687,7 @@ def publicar(request, anno, cuatrimestre, intento_algoritmo, intento_manual):
         borradas, _ = Asignacion.objects.filter(carga__anno=anno, carga__cuatrimestre=cuatrimestre).all().delete()
         logger.info('y ahora borré %d de dborrador', borradas)
 
+    CacheDistribucion.invalidar(anno, cuatrimestre)
     redirect = reverse('materias:por_anno_y_cuatrimestre', args=(f'{anno}{Cuatrimestres[cuatrimestre].value}',))
     return HttpResponseRedirect(redirect)
 
@@ -633,5 +700,12 @@ def borrar(request, anno, cuatrimestre):
     logger.info('Borré: %d asignaciones', borradas)
     borrados, _ = IntentoRegistrado.objects.filter(anno=anno, cuatrimestre=cuatrimestre).delete()
     logger.info('Borré: %d intentos', borrados)
+    CacheDistribucion.invalidar(anno, cuatrimestre)
     distribucion_url = reverse('dborrador:distribucion', args=(anno, cuatrimestre, 0, 0))
     return HttpResponseRedirect(distribucion_url)
+
+
+@login_required
+@permission_required('dborrador.add_asignacion')
+def estadisticas_cache(request):
+    return JsonResponse(CacheDistribucion.estadisticas())
@@ -85,6 +85,29 @@ DATABASES = {
         'PORT': 5432,
     }
 }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'dborrador': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dborrador',
+    },
+    'encuestas': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'encuestas',
+    },
+}
+DBORRADOR_CACHE = 'dborrador'
+ENCUESTAS_CACHE = 'encuestas'
+
+# resolvedor por omisión de la distribución automática: 'allocation' o 'hungaro' (ver dborrador/resolvedores.py)
+DBORRADOR_RESOLVEDOR = 'allocation'
+
+# con "Todos juntos" y cascada, una carga puede ocupar un lugar de una categoría inferior;
+# su peso se divide por (1 - penalidad) por cada categoría que baja
+DBORRADOR_PENALIDAD_CASCADA = 0.5
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
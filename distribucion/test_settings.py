@@ -88,6 +88,28 @@ DATABASES = {
     }
 }
 
+# los tests que prueban los caches de dborrador y encuestas los activan con override_settings
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'dborrador': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+    'encuestas': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+DBORRADOR_CACHE = 'dborrador'
+ENCUESTAS_CACHE = 'encuestas'
+
+# resolvedor por omisión de la distribución automática: 'allocation' o 'hungaro' (ver dborrador/resolvedores.py)
+DBORRADOR_RESOLVEDOR = 'allocation'
+
+# con "Todos juntos" y cascada, una carga puede ocupar un lugar de una categoría inferior;
+# su peso se divide por (1 - penalidad) por cada categoría que baja
+DBORRADOR_PENALIDAD_CASCADA = 0.5
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
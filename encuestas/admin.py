@@ -1,7 +1,7 @@
 from django.contrib import admin
 from simple_history.admin import SimpleHistoryAdmin
 
-from .models import PreferenciasDocente, OtrosDatos, EncuestasHabilitadas
+from .models import PreferenciasDocente, OtrosDatos, EncuestasHabilitadas, MailPendiente
 
 admin.site.register([PreferenciasDocente], SimpleHistoryAdmin)
-admin.site.register([OtrosDatos, EncuestasHabilitadas])
+admin.site.register([OtrosDatos, EncuestasHabilitadas, MailPendiente])
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class EncuestasConfig(AppConfig):
     name = 'encuestas'
+
+    def ready(self):
+        from . import signals
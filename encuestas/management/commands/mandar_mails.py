@@ -0,0 +1,32 @@
+import time
+import logging
+
+from django.core.management.base import BaseCommand
+
+from encuestas.misc import ColaDeMails
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Manda los mails encolados por las encuestas (MailPendiente)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=50, help='mails por lote')
+        parser.add_argument('--seguir', action='store_true', help='no terminar: volver a mirar la cola cada --pausa segundos')
+        parser.add_argument('--pausa', type=float, default=10, help='segundos entre dos pasadas con --seguir')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                enviados, fallidos = ColaDeMails.mandar_pendientes(options['lote'])
+            except Exception:
+                if not options['seguir']:
+                    raise
+                logger.exception('Falló una pasada por la cola de mails')
+            else:
+                if enviados or fallidos or not options['seguir']:
+                    self.stdout.write(f'Mandé {enviados} mails, fallaron {fallidos}')
+            if not options['seguir']:
+                break
+            time.sleep(options['pausa'])
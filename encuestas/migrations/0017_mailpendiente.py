@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:29
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('encuestas', '0016_otrosdatos_tipo_docente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailPendiente',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asunto', models.CharField(max_length=200)),
+                ('mensaje', models.TextField()),
+                ('remitente', models.EmailField(max_length=254)),
+                ('destinatario', models.EmailField(max_length=254)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('proximo_intento', models.DateTimeField(default=django.utils.timezone.now)),
+                ('intentos', models.PositiveIntegerField(default=0)),
+                ('enviado', models.DateTimeField(blank=True, null=True)),
+                ('ultimo_error', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'mail pendiente',
+                'verbose_name_plural': 'mails pendientes',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='mailpendiente',
+            index=models.Index(fields=['enviado', 'proximo_intento'], name='mailpendiente_cola_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def llena_ultimas_encuestas(apps, schema_editor):
+    OtrosDatos = apps.get_model('encuestas', 'OtrosDatos')
+    UltimaEncuesta = apps.get_model('encuestas', 'UltimaEncuesta')
+    ultimas = {}
+    # en orden de fecha: la última pisa a las anteriores
+    for otros_datos in OtrosDatos.objects.order_by('fecha_encuesta', 'id'):
+        for cuatrimestre in otros_datos.cuatrimestre:
+            clave = (otros_datos.docente_id, otros_datos.anno, cuatrimestre, otros_datos.tipo_docente)
+            ultimas[clave] = otros_datos
+    UltimaEncuesta.objects.bulk_create([UltimaEncuesta(docente_id=docente_id, anno=anno, cuatrimestre=cuatrimestre,
+                                                       tipo_docente=tipo_docente,
+                                                       fecha_encuesta=otros_datos.fecha_encuesta,
+                                                       otros_datos=otros_datos)
+                                        for (docente_id, anno, cuatrimestre, tipo_docente), otros_datos in ultimas.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materias', '0024_auto_20261018_0510'),
+        ('encuestas', '0017_mailpendiente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UltimaEncuesta',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('anno', models.IntegerField()),
+                ('cuatrimestre', models.CharField(choices=[('V', 'V'), ('P', '1'), ('S', '2')], max_length=1)),
+                ('tipo_docente', models.CharField(choices=[('P', 'Profesor'), ('J', 'JTP'), ('A1', 'Ay1'), ('A2', 'Ay2')], max_length=2)),
+                ('fecha_encuesta', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'última encuesta',
+                'verbose_name_plural': 'últimas encuestas',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='otrosdatos',
+            index=models.Index(fields=['docente', 'anno'], name='otrosdatos_docente_anno_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='preferenciasdocente',
+            index=models.Index(fields=['docente', 'fecha_encuesta'], name='prefdocente_docente_fecha_idx'),
+        ),
+        migrations.AddField(
+            model_name='ultimaencuesta',
+            name='docente',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='materias.Docente'),
+        ),
+        migrations.AddField(
+            model_name='ultimaencuesta',
+            name='otros_datos',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='encuestas.OtrosDatos'),
+        ),
+        migrations.AddIndex(
+            model_name='ultimaencuesta',
+            index=models.Index(fields=['anno', 'cuatrimestre'], name='ultimaencuesta_periodo_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='ultimaencuesta',
+            unique_together={('docente', 'anno', 'cuatrimestre', 'tipo_docente')},
+        ),
+        migrations.RunPython(llena_ultimas_encuestas, migrations.RunPython.noop),
+    ]
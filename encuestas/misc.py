@@ -0,0 +1,147 @@
+import uuid
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MailPendiente
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEncuesta:
+    '''Cache de las listas de docentes y turnos de la página de encuesta.
+
+    Las claves son (anno, versión, cuatrimestres, tipo_docente). Cada año tiene una versión que
+    cambia cuando cambia un Turno, Horario, Carga o Docente (ver encuestas/signals.py); las
+    actualizaciones masivas (update, bulk_create) no mandan señales y tienen que llamar a invalidar.
+    El backend es el alias settings.ENCUESTAS_CACHE de CACHES (por omisión, 'default').
+    '''
+
+    @classmethod
+    def backend(cls):
+        return caches[getattr(settings, 'ENCUESTAS_CACHE', DEFAULT_CACHE_ALIAS)]
+
+    @classmethod
+    def _clave_version(cls, anno):
+        return f'encuestas:version:{anno}'
+
+    @classmethod
+    def clave(cls, anno, cuatrimestres, tipo_docente):
+        '''int -> str -> str -> str'''
+        version = cls.backend().get_or_set(cls._clave_version(anno), lambda: uuid.uuid4().hex, timeout=None)
+        return f'encuestas:contexto:{anno}:{version}:{cuatrimestres}:{tipo_docente}'
+
+    @classmethod
+    def obtener(cls, anno, cuatrimestres, tipo_docente, generar):
+        '''int -> str -> str -> (() -> a) -> a
+
+        Devuelve lo guardado para (anno, cuatrimestres, tipo_docente) o lo genera con generar().
+        '''
+        cache = cls.backend()
+        clave = cls.clave(anno, cuatrimestres, tipo_docente)
+        contexto = cache.get(clave)
+        if contexto is None:
+            contexto = generar()
+            cache.set(clave, contexto)
+        return contexto
+
+    @classmethod
+    def invalidar(cls, anno):
+        '''int -> None'''
+        logger.debug('invalido el cache de encuestas de %s', anno)
+        cls.backend().set(cls._clave_version(anno), uuid.uuid4().hex, timeout=None)
+
+    @classmethod
+    def invalidar_al_confirmar(cls, anno):
+        '''int -> None. Como CacheDistribucion.invalidar_al_confirmar'''
+        transaction.on_commit(lambda: cls.invalidar(anno))
+
+
+class ColaDeMails:
+    '''Cola de mails en la base (MailPendiente).
+
+    Los requests sólo encolan. El comando mandar_mails vacía la cola de a lotes usando una sola
+    conexión SMTP; si un mail falla se reintenta más tarde, esperando ESPERA * 2 ** (intentos - 1)
+    (como mucho ESPERA_MAXIMA), hasta MAXIMO_INTENTOS veces.
+    '''
+
+    MAXIMO_INTENTOS = 6
+    ESPERA = timedelta(minutes=1)
+    ESPERA_MAXIMA = timedelta(hours=1)
+
+    @staticmethod
+    def encolar(asunto, mensaje, destinatario, remitente=None):
+        '''str -> str -> str -> str | None -> MailPendiente'''
+        return MailPendiente.objects.create(asunto=asunto, mensaje=mensaje, destinatario=destinatario,
+                                            remitente=remitente or settings.EMAIL_HOST_USER)
+
+    @classmethod
+    def espera(cls, intentos):
+        '''int -> timedelta hasta el próximo intento después de `intentos` fallidos'''
+        # el exponente se acota para no desbordar timedelta
+        return min(cls.ESPERA * 2 ** min(intentos - 1, 20), cls.ESPERA_MAXIMA)
+
+    @classmethod
+    def mandar_pendientes(cls, lote=50, conexion=None):
+        '''int -> EmailBackend | None -> (int, int)
+
+        Manda los mails pendientes de a `lote` y devuelve (enviados, fallidos).
+        Cada lote se bloquea con SELECT ... FOR UPDATE SKIP LOCKED, así que puede haber
+        más de un worker. La conexión se abre recién cuando hay algo para mandar.
+        '''
+        conexion = conexion or get_connection(fail_silently=False)
+        enviados, fallidos = 0, 0
+        try:
+            while True:
+                with transaction.atomic():
+                    mails = list(MailPendiente.objects.para_mandar(timezone.now(), cls.MAXIMO_INTENTOS)
+                                                      .select_for_update(skip_locked=True)[:lote])
+                    if not mails:
+                        break
+                    for mail in mails:
+                        if cls._mandar(conexion, mail):
+                            enviados += 1
+                        else:
+                            fallidos += 1
+                    MailPendiente.objects.bulk_update(mails, ['enviado', 'intentos', 'proximo_intento', 'ultimo_error'])
+        finally:
+            cls._cerrar(conexion)
+        return enviados, fallidos
+
+    @classmethod
+    def _mandar(cls, conexion, mail):
+        '''EmailBackend -> MailPendiente -> bool. Actualiza mail pero no lo guarda.'''
+        mensaje = EmailMessage(mail.asunto, mail.mensaje, mail.remitente, [mail.destinatario], connection=conexion)
+        try:
+            # open() no hace nada si la conexión ya está abierta
+            conexion.open()
+            conexion.send_messages([mensaje])
+        except Exception as e:  # smtplib y socket tiran excepciones de distintos tipos
+            mail.intentos += 1
+            mail.ultimo_error = repr(e)
+            mail.proximo_intento = timezone.now() + cls.espera(mail.intentos)
+            if mail.intentos >= cls.MAXIMO_INTENTOS:
+                logger.error('No pude mandar el mail %s a %s después de %d intentos: %s',
+                             mail.id, mail.destinatario, mail.intentos, mail.ultimo_error)
+            else:
+                logger.warning('No pude mandar el mail %s a %s (intento %d): %s',
+                               mail.id, mail.destinatario, mail.intentos, mail.ultimo_error)
+            # la próxima vez se abre una conexión nueva
+            cls._cerrar(conexion)
+            return False
+        mail.intentos += 1
+        mail.enviado = timezone.now()
+        mail.ultimo_error = ''
+        return True
+
+    @staticmethod
+    def _cerrar(conexion):
+        try:
+            conexion.close()
+        except Exception:
+            logger.exception('No pude cerrar la conexión SMTP')
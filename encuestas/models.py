@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from simple_history.models import HistoricalRecords
 from django.core.validators import MaxValueValidator
 from django.utils import timezone
@@ -23,6 +23,10 @@ class PreferenciasDocente(models.Model):
     fecha_encuesta = models.DateTimeField()
     history = HistoricalRecords()
 
+    class Meta:
+        # turno__anno no puede ir en un índice: las preferencias de una encuesta se buscan por (docente, fecha)
+        indexes = [models.Index(fields=['docente', 'fecha_encuesta'], name='prefdocente_docente_fecha_idx')]
+
     def __str__(self):
         return f'{self.docente} -- {self.peso} -> {self.turno}'
 
@@ -40,6 +44,7 @@ class OtrosDatos(models.Model):
 
     class Meta:
         ordering = ['fecha_encuesta']
+        indexes = [models.Index(fields=['docente', 'anno'], name='otrosdatos_docente_anno_idx')]
 
 
 class CargasPedidas(models.Model):
@@ -51,6 +56,77 @@ class CargasPedidas(models.Model):
     fecha_encuesta = models.DateTimeField()
 
 
+class UltimaEncuesta(models.Model):
+    '''La última encuesta de cada docente para cada (anno, cuatrimestre, tipo_docente).
+
+    La mantienen las señales de OtrosDatos (ver signals.py). Sus preferencias son las PreferenciasDocente
+    del docente con tipo_docente y fecha_encuesta en turnos del período.
+    '''
+    docente = models.ForeignKey(Docente, on_delete=models.CASCADE)
+    anno = models.IntegerField()
+    cuatrimestre = models.CharField(max_length=1, choices=choice_enum(Cuatrimestres))
+    tipo_docente = models.CharField(max_length=2, choices=choice_enum(TipoDocentes))
+    fecha_encuesta = models.DateTimeField()
+    otros_datos = models.ForeignKey(OtrosDatos, on_delete=models.CASCADE)
+
+    class Meta:
+        verbose_name = 'última encuesta'
+        verbose_name_plural = 'últimas encuestas'
+        unique_together = [['docente', 'anno', 'cuatrimestre', 'tipo_docente']]
+        indexes = [models.Index(fields=['anno', 'cuatrimestre'], name='ultimaencuesta_periodo_idx')]
+
+    def __str__(self):
+        return f'{self.docente} ({self.tipo_docente}, {self.anno}{self.cuatrimestre}): {self.fecha_encuesta}'
+
+    @classmethod
+    def _rearmar(cls, otros_datos):
+        '''[OtrosDatos] ordenados por fecha -> [UltimaEncuesta]'''
+        ultima_de = {}
+        for datos in otros_datos:
+            for cuatrimestre in datos.cuatrimestre:
+                ultima_de[(datos.docente_id, datos.anno, cuatrimestre, datos.tipo_docente)] = datos
+        return cls.objects.bulk_create([cls(docente_id=docente_id, anno=anno, cuatrimestre=cuatrimestre,
+                                            tipo_docente=tipo_docente, fecha_encuesta=datos.fecha_encuesta,
+                                            otros_datos=datos)
+                                        for (docente_id, anno, cuatrimestre, tipo_docente), datos in ultima_de.items()])
+
+    @staticmethod
+    def bloquear_docente(docente_id):
+        '''int -> None
+
+        Bloquea al docente hasta el final de la transacción: dos encuestas suyas a la vez rearman sus
+        últimas encuestas de a una, sin chocar con unique_together. Quien crea OtrosDatos tiene que
+        bloquear antes del insert, que toma un lock compartido sobre el docente; si no, dos
+        transacciones se trabarían entre sí.
+        '''
+        list(Docente.objects.select_for_update().filter(id=docente_id).values_list('id', flat=True))
+
+    @classmethod
+    def actualizar(cls, docente_id, anno, tipo_docente):
+        '''int -> int -> str -> [UltimaEncuesta]
+
+        Rearma las últimas encuestas de (docente, anno, tipo_docente) a partir de sus OtrosDatos.
+        La llaman las señales de OtrosDatos, así que vale para encuestas cargadas por cualquier lado.
+        '''
+        with transaction.atomic():
+            cls.bloquear_docente(docente_id)
+            cls.objects.filter(docente_id=docente_id, anno=anno, tipo_docente=tipo_docente).delete()
+            return cls._rearmar(OtrosDatos.objects.filter(docente_id=docente_id, anno=anno, tipo_docente=tipo_docente)
+                                                  .order_by('fecha_encuesta', 'id'))
+
+    @classmethod
+    def recalcular(cls, docente):
+        '''Docente -> None
+
+        Rearma las últimas encuestas de docente a partir de todos sus OtrosDatos,
+        por ejemplo después de juntarle las encuestas de otro docente (con update, que no manda señales).
+        '''
+        with transaction.atomic():
+            cls.bloquear_docente(docente.id)
+            cls.objects.filter(docente=docente).delete()
+            cls._rearmar(docente.otrosdatos_set.order_by('fecha_encuesta', 'id'))
+
+
 class EncuestasHabilitadas(models.Model):
     anno = models.IntegerField()
     cuatrimestres = models.CharField(max_length=3, choices=choice_enum(GrupoCuatrimestral))
@@ -80,3 +156,35 @@ class EncuestasHabilitadas(models.Model):
             return habilitacion.es_valida_ahora(momento)
         except EncuestasHabilitadas.DoesNotExist:
             return False
+
+
+class MailPendienteQuerySet(models.QuerySet):
+
+    def para_mandar(self, ahora, maximo_intentos):
+        '''mails no enviados cuyo próximo intento ya llegó y que no agotaron los intentos'''
+        return self.filter(enviado__isnull=True, intentos__lt=maximo_intentos, proximo_intento__lte=ahora) \
+                   .order_by('proximo_intento', 'id')
+
+
+class MailPendiente(models.Model):
+    '''Mail encolado. Lo manda el comando mandar_mails, fuera de los requests.'''
+
+    asunto = models.CharField(max_length=200)
+    mensaje = models.TextField()
+    remitente = models.EmailField()
+    destinatario = models.EmailField()
+    creado = models.DateTimeField(auto_now_add=True)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    intentos = models.PositiveIntegerField(default=0)
+    enviado = models.DateTimeField(null=True, blank=True)
+    ultimo_error = models.TextField(blank=True)
+
+    objects = MailPendienteQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'mail pendiente'
+        verbose_name_plural = 'mails pendientes'
+        indexes = [models.Index(fields=['enviado', 'proximo_intento'], name='mailpendiente_cola_idx')]
+
+    def __str__(self):
+        return f'{self.destinatario}: {self.asunto}'
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from materias.models import Turno, Horario, Carga, Docente
+from .models import OtrosDatos, UltimaEncuesta
+from .misc import CacheEncuesta
+
+
+@receiver(post_save, sender=Turno)
+@receiver(post_delete, sender=Turno)
+@receiver(post_save, sender=Carga)
+@receiver(post_delete, sender=Carga)
+def invalidar_cache_de_turno_o_carga(sender, instance, **kwargs):
+    '''los turnos, sus necesidades no cubiertas y los docentes de la encuesta salen de acá'''
+    CacheEncuesta.invalidar_al_confirmar(instance.anno)
+
+
+@receiver(post_save, sender=Horario)
+@receiver(post_delete, sender=Horario)
+def invalidar_cache_de_horario(sender, instance, **kwargs):
+    '''el texto de cada turno en la encuesta muestra sus horarios'''
+    CacheEncuesta.invalidar_al_confirmar(instance.turno.anno)
+
+
+@receiver(post_save, sender=Docente)
+def invalidar_cache_de_docente(sender, instance, created, **kwargs):
+    '''la encuesta muestra el nombre de los docentes de los años en que tienen cargas'''
+    if created:
+        return
+    for anno in set(Carga.objects.filter(docente=instance).values_list('anno', flat=True)):
+        CacheEncuesta.invalidar_al_confirmar(anno)
+
+
+@receiver(post_save, sender=OtrosDatos)
+@receiver(post_delete, sender=OtrosDatos)
+def actualizar_ultima_encuesta(sender, instance, **kwargs):
+    '''una encuesta nueva, cambiada o borrada puede cambiar cuál es la última del docente'''
+    UltimaEncuesta.actualizar(instance.docente_id, instance.anno, instance.tipo_docente)
@@ -1,23 +1,33 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
 from django.utils import timezone
 from django.urls import reverse
 from django.forms import ValidationError
 from django.contrib.auth.models import Permission
-from unittest.mock import patch
+from django.core.management import call_command
 
+import io
+import json
 import re
 import datetime
+import socketserver
+import threading
 import time
+from unittest.mock import patch
 
 from materias.models import (Docente, Carga, Materia, Turno, TipoTurno, TipoMateria,
                              CargoDedicacion, Cuatrimestres, Horario, Dias)
 from materias.misc import TipoDocentes
 from usuarios.models import Usuario
-from .models import PreferenciasDocente, OtrosDatos, CargasPedidas, EncuestasHabilitadas, GrupoCuatrimestral
-from .views import checkear_y_salvar, mandar_mail
+from .models import (PreferenciasDocente, OtrosDatos, CargasPedidas, EncuestasHabilitadas, GrupoCuatrimestral,
+                     MailPendiente, UltimaEncuesta)
+from .views import checkear_y_salvar, mandar_mail, demanda_por_turno_y_tipo
+from .misc import CacheEncuesta, ColaDeMails
 
 
-class TestEncuesta(TestCase):
+class DatosDeEncuesta:
+    '''docente, materia, turnos, encuestas habilitadas y usuarios para los tests de encuesta'''
 
     def setUp(self):
         self.anno = 2100
@@ -42,6 +52,9 @@ class TestEncuesta(TestCase):
         autorizado = Usuario.objects.create_user(username='autorizado', password='1234')
         autorizado.user_permissions.add(Permission.objects.get(content_type__app_label='dborrador', codename='add_asignacion'))
 
+
+class TestEncuesta(DatosDeEncuesta, TestCase):
+
     def test_pocos_turnos(self):
         datos = self.otros_datos
         datos['docente'] = self.docente.id
@@ -75,6 +88,87 @@ class TestEncuesta(TestCase):
         with self.assertRaises(Turno.DoesNotExist):
             checkear_y_salvar(datos, self.anno, Cuatrimestres.P.name, TipoDocentes.J.name)
 
+    def test_turno_no_existe_no_guarda_nada(self):
+        datos = {'docente': self.docente.id, **self.otros_datos}
+        c = Cuatrimestres.P.name
+        for opcion in range(1, 6):
+            datos[f'opcion{c}{opcion}'] = str(self.turno.id if opcion == 1 else self.turno.id + 10 + opcion)
+            datos[f'peso{c}{opcion}'] = str(opcion)
+        with self.assertRaises(Turno.DoesNotExist):
+            checkear_y_salvar(datos, self.anno, c, TipoDocentes.J.name)
+        self.assertFalse(OtrosDatos.objects.exists())
+        self.assertFalse(CargasPedidas.objects.exists())
+        self.assertFalse(PreferenciasDocente.objects.exists())
+
+    def test_turno_no_existe_muestra_error(self):
+        datos = {'docente': self.docente.id, **self.otros_datos}
+        c = Cuatrimestres.P.name
+        for opcion in range(1, 6):
+            datos[f'opcion{c}{opcion}'] = str(self.turno.id if opcion == 1 else self.turno.id + 10 + opcion)
+            datos[f'peso{c}{opcion}'] = str(opcion)
+        response = self.client.post(reverse('encuestas:encuesta', args=(str(self.anno), c, TipoDocentes.J.name)), datos)
+        self.assertContains(response, 'Alguno de los turnos elegidos ya no existe')
+        self.assertFalse(OtrosDatos.objects.exists())
+
+    def test_guardar_encuesta_con_historia(self):
+        datos = {'docente': self.docente.id, **self.otros_datos}
+        c = Cuatrimestres.P.name
+        turnos = [Turno.objects.create(materia=self.materia, anno=self.anno, cuatrimestre=c,
+                                       numero=opcion, tipo=TipoTurno.T.name,
+                                       necesidad_prof=1, necesidad_jtp=0, necesidad_ay1=0, necesidad_ay2=0)
+                  for opcion in range(1, 6)]
+        for opcion, turno in enumerate(turnos, 1):
+            datos[f'opcion{c}{opcion}'] = turno.id
+            datos[f'peso{c}{opcion}'] = str(opcion)
+        with CaptureQueriesContext(connection) as consultas:
+            opciones, _, pedidas = checkear_y_salvar(datos, self.anno, c, TipoDocentes.J.name)
+        # docente, turnos, bloquear al docente, otros datos, última encuesta (bloquear, borrar, leer otros datos
+        # e insertar), cargas pedidas, preferencias e historia
+        self.assertEqual(len([q for q in consultas.captured_queries if 'SAVEPOINT' not in q['sql']]), 11)
+
+        self.assertEqual([pref.turno for pref in opciones[Cuatrimestres.P]], turnos)
+        self.assertEqual([pref.peso for pref in opciones[Cuatrimestres.P]], [1, 2, 3, 4, 5])
+        self.assertEqual(pedidas, {Cuatrimestres.P: 1})
+        self.assertEqual(PreferenciasDocente.history.filter(history_type='+').count(), 5)
+        self.assertCountEqual(PreferenciasDocente.history.values_list('id', flat=True),
+                              [pref.id for pref in opciones[Cuatrimestres.P]])
+
+    def test_ultima_encuesta_se_actualiza(self):
+        c = Cuatrimestres.P.name
+        datos = {'docente': self.docente.id, **self.otros_datos}
+        for opcion in range(1, 6):
+            turno = Turno.objects.create(materia=self.materia, anno=self.anno, cuatrimestre=c,
+                                         numero=opcion, tipo=TipoTurno.T.name,
+                                         necesidad_prof=1, necesidad_jtp=0, necesidad_ay1=0, necesidad_ay2=0)
+            datos[f'opcion{c}{opcion}'] = turno.id
+            datos[f'peso{c}{opcion}'] = str(opcion)
+        checkear_y_salvar(datos, self.anno, c, TipoDocentes.J.name)
+        checkear_y_salvar(datos, self.anno, c, TipoDocentes.J.name)
+        checkear_y_salvar(datos, self.anno, c, TipoDocentes.A1.name)
+
+        ultimas = UltimaEncuesta.objects.filter(docente=self.docente, anno=self.anno, cuatrimestre=c)
+        self.assertCountEqual(ultimas.values_list('tipo_docente', flat=True),
+                              [TipoDocentes.J.name, TipoDocentes.A1.name])
+        ultima_j = ultimas.get(tipo_docente=TipoDocentes.J.name)
+        self.assertEqual(ultima_j.fecha_encuesta,
+                         OtrosDatos.objects.filter(tipo_docente=TipoDocentes.J.name).latest('fecha_encuesta').fecha_encuesta)
+        self.assertEqual(ultima_j.otros_datos.fecha_encuesta, ultima_j.fecha_encuesta)
+
+    def test_ultima_encuesta_sigue_a_otros_datos(self):
+        # encuestas cargadas o borradas por fuera del formulario (admin, scripts)
+        ahora = timezone.now()
+        vieja, nueva = [OtrosDatos.objects.create(docente=self.docente, anno=self.anno, cuatrimestre=GrupoCuatrimestral.VP.name,
+                                                  tipo_docente=TipoDocentes.J.name, fecha_encuesta=fecha, comentario='')
+                        for fecha in (ahora - datetime.timedelta(minutes=1), ahora)]
+        ultimas = UltimaEncuesta.objects.filter(docente=self.docente, anno=self.anno)
+        self.assertCountEqual(ultimas.values_list('cuatrimestre', 'otros_datos'),
+                              [(Cuatrimestres.V.name, nueva.id), (Cuatrimestres.P.name, nueva.id)])
+        nueva.delete()
+        self.assertCountEqual(ultimas.values_list('cuatrimestre', 'otros_datos'),
+                              [(Cuatrimestres.V.name, vieja.id), (Cuatrimestres.P.name, vieja.id)])
+        vieja.delete()
+        self.assertFalse(ultimas.exists())
+
     def test_docente_y_opciones_vacias(self):
         datos = {'docente': self.docente.id, **self.otros_datos}
         c = Cuatrimestres.P.name
@@ -483,15 +577,223 @@ class TestEncuesta(TestCase):
             datos[f'peso{c}{opcion}'] = str(opcion)
         datos[f'cargas{c}'] = 1
         opciones, otros_datos, cargas_pedidas = checkear_y_salvar(datos, self.anno, c, TipoDocentes.J.name)
-        import encuestas.views
-        with patch.object(encuestas.views, 'send_mail') as mm:
+        # el mail sólo se encola: no hay consultas por turno ni conexión SMTP
+        with self.assertNumQueries(1):
             mandar_mail(opciones, otros_datos, cargas_pedidas, self.anno, c, TipoDocentes.J.name)
-            self.assertEqual(mm.call_count, 1)
+        mail = MailPendiente.objects.get()
+        self.assertEqual(mail.destinatario, otros_datos.email)
+        self.assertIsNone(mail.enviado)
 
-            email_content = mm.call_args[0][1]
-            for opcion in opciones[Cuatrimestres.P]:
-                horario = opcion.turno.horarios_info()
-                self.assertIn(horario.diayhora, email_content)
+        email_content = mail.mensaje
+        for opcion in opciones[Cuatrimestres.P]:
+            horario = opcion.turno.horarios_info()
+            self.assertIn(horario.diayhora, email_content)
+
+    def test_sin_mail_no_se_guarda_la_encuesta(self):
+        datos = {'docente': self.docente.id, **self.otros_datos}
+        c = Cuatrimestres.P.name
+        for opcion in range(1, 6):
+            turno = Turno.objects.create(materia=self.materia, anno=self.anno, cuatrimestre=c,
+                                         numero=10 + opcion, tipo=TipoTurno.T.name,
+                                         necesidad_prof=1, necesidad_jtp=0, necesidad_ay1=0, necesidad_ay2=0)
+            datos[f'opcion{c}{opcion}'] = turno.id
+            datos[f'peso{c}{opcion}'] = str(opcion)
+        with patch.object(ColaDeMails, 'encolar', side_effect=RuntimeError('no se pudo encolar')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('encuestas:encuesta', args=(str(self.anno), c, TipoDocentes.J.name)), datos)
+        self.assertFalse(OtrosDatos.objects.exists())
+        self.assertFalse(PreferenciasDocente.objects.exists())
+        self.assertFalse(MailPendiente.objects.exists())
+
+
+class TestCacheDeEncuesta(DatosDeEncuesta, TransactionTestCase):
+    '''las señales invalidan al confirmar la transacción, y TestCase nunca la confirma'''
+
+    @override_settings(CACHES={'encuestas': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                             'LOCATION': 'test_encuestas'},
+                               'dborrador': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+                       ENCUESTAS_CACHE='encuestas')
+    def test_encuesta_usa_cache(self):
+        CacheEncuesta.backend().clear()
+        url = reverse('encuestas:encuesta', args=(str(self.anno), Cuatrimestres.P.name, TipoDocentes.P.name))
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url)
+        # sólo se consulta si la encuesta está habilitada
+        self.assertEqual(len(consultas), 1)
+        self.assertContains(response, f'{self.turno} (sin horario)')
+
+        # cambiar un horario, una carga o un docente invalida el cache
+        Horario.objects.create(turno=self.turno, dia=Dias.Lu.name,
+                               comienzo=datetime.time(9), final=datetime.time(13))
+        response = self.client.get(url)
+        self.assertNotContains(response, f'{self.turno} (sin horario)')
+
+        self.assertContains(response, 'disabled', count=0)
+        Carga.objects.create(turno=self.turno, anno=self.anno, cuatrimestre=Cuatrimestres.P.name,
+                             docente=self.docente, cargo=CargoDedicacion.TitExc.name)
+        response = self.client.get(url)
+        self.assertContains(response, 'disabled', count=3)
+        self.assertContains(response, self.docente.apellido_nombre)
+
+        self.docente.na_nombre = 'pedro'
+        self.docente.save()
+        response = self.client.get(url)
+        self.assertContains(response, self.docente.apellido_nombre)
+
+
+class TestEncuestasALaVez(TransactionTestCase):
+
+    def test_dos_encuestas_del_mismo_docente_a_la_vez(self):
+        anno, c = 2100, Cuatrimestres.P.name
+        docente = Docente.objects.create(na_nombre='juan', email='mail@nada.org', telefono='1234',
+                                         cargos=[CargoDedicacion.JTPSmx.name])
+        materia = Materia.objects.create(nombre='epistemologia', obligatoriedad=TipoMateria.B.name)
+        datos = {'docente': docente.id, 'telefono': '+54911 1234-5678', 'email': 'nadie@gmail.com',
+                 'comentario': '', f'cargas{c}': 1, 'cargas_declaradas': 1}
+        for opcion in range(1, 6):
+            turno = Turno.objects.create(materia=materia, anno=anno, cuatrimestre=c, numero=opcion, tipo=TipoTurno.T.name,
+                                         necesidad_prof=1, necesidad_jtp=0, necesidad_ay1=0, necesidad_ay2=0)
+            datos[f'opcion{c}{opcion}'] = turno.id
+            datos[f'peso{c}{opcion}'] = str(opcion)
+
+        guardada = threading.Event()
+        errores = []
+
+        def primera():
+            try:
+                with transaction.atomic():
+                    checkear_y_salvar(datos, anno, c, TipoDocentes.J.name)
+                    guardada.set()
+                    time.sleep(0.5)  # la segunda se guarda mientras esta sigue sin commit
+            except Exception as e:
+                errores.append(e)
+            finally:
+                guardada.set()
+                connection.close()
+
+        hilo = threading.Thread(target=primera)
+        hilo.start()
+        guardada.wait()
+        checkear_y_salvar(datos, anno, c, TipoDocentes.J.name)
+        hilo.join()
+
+        self.assertEqual(errores, [])
+        self.assertEqual(OtrosDatos.objects.filter(docente=docente).count(), 2)
+        self.assertEqual(UltimaEncuesta.objects.get(docente=docente).otros_datos,
+                         OtrosDatos.objects.filter(docente=docente).last())
+
+
+class ServidorSMTP(socketserver.ThreadingTCPServer):
+    '''Servidor SMTP mínimo en localhost para probar el envío de mails.
+
+    Guarda los mensajes recibidos y cuenta las conexiones. Responde 451 a los
+    primeros `fallar` comandos MAIL.
+    '''
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('localhost', 0), SesionSMTP)
+        self.mensajes = []
+        self.conexiones = 0
+        self.fallar = 0
+
+    @property
+    def puerto(self):
+        return self.server_address[1]
+
+
+class SesionSMTP(socketserver.StreamRequestHandler):
+
+    def responder(self, linea):
+        self.wfile.write(f'{linea}\r\n'.encode())
+
+    def handle(self):
+        self.server.conexiones += 1
+        self.responder('220 localhost')
+        for linea in self.rfile:
+            comando = linea.decode().strip().upper()
+            if comando.startswith(('EHLO', 'HELO')):
+                self.responder('250 localhost')
+            elif comando.startswith('MAIL') and self.server.fallar > 0:
+                self.server.fallar -= 1
+                self.responder('451 probá más tarde')
+            elif comando.startswith('DATA'):
+                self.responder('354 dale')
+                datos = []
+                for linea in self.rfile:
+                    if linea == b'.\r\n':
+                        break
+                    datos.append(linea)
+                self.server.mensajes.append(b''.join(datos).decode())
+                self.responder('250 OK')
+            elif comando.startswith('QUIT'):
+                self.responder('221 chau')
+                return
+            else:
+                self.responder('250 OK')
+
+
+class TestColaDeMails(TestCase):
+
+    def setUp(self):
+        self.servidor = ServidorSMTP()
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+        self.addCleanup(self.servidor.server_close)
+        self.addCleanup(self.servidor.shutdown)
+        smtp = self.settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                             EMAIL_HOST='localhost', EMAIL_PORT=self.servidor.puerto, EMAIL_USE_TLS=False,
+                             EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD='')
+        smtp.enable()
+        self.addCleanup(smtp.disable)
+
+    def _encolar(self, cantidad):
+        return [ColaDeMails.encolar(f'encuesta {i}', f'mensaje {i}', f'docente{i}@nada.org', 'distribucion@nada.org')
+                for i in range(cantidad)]
+
+    def test_manda_de_a_lotes_con_una_conexion(self):
+        self._encolar(5)
+        self.assertEqual(ColaDeMails.mandar_pendientes(lote=2), (5, 0))
+        self.assertEqual(len(self.servidor.mensajes), 5)
+        self.assertEqual(self.servidor.conexiones, 1)
+        self.assertFalse(MailPendiente.objects.filter(enviado__isnull=True).exists())
+        # no queda nada para mandar y no se abre otra conexión
+        self.assertEqual(ColaDeMails.mandar_pendientes(lote=2), (0, 0))
+        self.assertEqual(self.servidor.conexiones, 1)
+
+    def test_reintenta_con_espera(self):
+        primero, segundo = self._encolar(2)
+        self.servidor.fallar = 1
+        self.assertEqual(ColaDeMails.mandar_pendientes(), (1, 1))
+        primero.refresh_from_db()
+        self.assertIsNone(primero.enviado)
+        self.assertEqual(primero.intentos, 1)
+        self.assertIn('451', primero.ultimo_error)
+        self.assertGreater(primero.proximo_intento, timezone.now())
+        self.assertEqual(ColaDeMails.espera(3), 4 * ColaDeMails.ESPERA)
+        self.assertEqual(ColaDeMails.espera(100), ColaDeMails.ESPERA_MAXIMA)
+
+        # todavía no es hora de reintentar
+        self.assertEqual(ColaDeMails.mandar_pendientes(), (0, 0))
+        MailPendiente.objects.filter(pk=primero.pk).update(proximo_intento=timezone.now())
+        self.assertEqual(ColaDeMails.mandar_pendientes(), (1, 0))
+        primero.refresh_from_db()
+        self.assertEqual(primero.intentos, 2)
+        self.assertIsNotNone(primero.enviado)
+
+    def test_abandona_despues_de_muchos_intentos(self):
+        mail, = self._encolar(1)
+        MailPendiente.objects.filter(pk=mail.pk).update(intentos=ColaDeMails.MAXIMO_INTENTOS)
+        self.assertEqual(ColaDeMails.mandar_pendientes(), (0, 0))
+        self.assertEqual(self.servidor.conexiones, 0)
+
+    def test_comando(self):
+        self._encolar(3)
+        salida = io.StringIO()
+        call_command('mandar_mails', '--lote', '2', stdout=salida)
+        self.assertIn('Mandé 3 mails, fallaron 0', salida.getvalue())
+        self.assertIn('Subject: encuesta 0', self.servidor.mensajes[0])
 
 
 class TestPaginas(TestCase):
@@ -543,6 +845,61 @@ class TestPaginas(TestCase):
         self.assertContains(response, self.n.nombre)
         self.assertContains(response, str(self.turno), count=2)
 
+    def test_demanda_de_turnos(self):
+        otro_turno = Turno.objects.create(materia=self.materia, anno=self.anno, cuatrimestre=self.cuatrimestre.name,
+                                          numero=2, tipo=TipoTurno.T.name, **{**self.dict_nec, 'necesidad_prof': 2})
+        m = Docente.objects.create(na_nombre='mario', na_apellido='M', cargos=[CargoDedicacion.TitExc.name])
+        now = timezone.now()
+        despues = now + datetime.timedelta(seconds=10)
+        encuestas = [(self.n, now, [(self.turno, 1)]),
+                     (self.n, despues, [(self.turno, 1), (otro_turno, 3)]),
+                     (m, now, [(self.turno, 0), (otro_turno, 0)])]
+        for docente, fecha, pedidos in encuestas:
+            for turno, peso in pedidos:
+                PreferenciasDocente.objects.create(docente=docente, turno=turno, tipo_docente=TipoDocentes.P.name,
+                                                   peso=peso, fecha_encuesta=fecha)
+            OtrosDatos.objects.create(docente=docente, anno=self.anno, cuatrimestre=self.cuatrimestre.name,
+                                      tipo_docente=TipoDocentes.P.name, fecha_encuesta=fecha, comentario='')
+
+        with self.assertNumQueries(1):
+            demanda = demanda_por_turno_y_tipo(self.anno, self.cuatrimestre.name)
+        # la primera encuesta de n no cuenta; m pidió todo con peso 0, que se reparte por igual
+        self.assertEqual(set(demanda), {(self.turno.id, TipoDocentes.P), (otro_turno.id, TipoDocentes.P)})
+        self.assertEqual(demanda[(self.turno.id, TipoDocentes.P)][:2], (2, 2))
+        self.assertAlmostEqual(demanda[(self.turno.id, TipoDocentes.P)].peso, 0.75)
+        self.assertEqual(demanda[(otro_turno.id, TipoDocentes.P)][:2], (2, 1))
+        self.assertAlmostEqual(demanda[(otro_turno.id, TipoDocentes.P)].peso, 1.25)
+
+        self.client.login(username='autorizado', password='1234')
+        response = self.client.get(reverse('encuestas:demanda_de_turnos', args=(self.anno, self.cuatrimestre.name)))
+        self.assertRegex(response.content.decode(), r'<mark id="maso">\s*0 / 2 / 2 / 0.75\s*</mark>')
+        self.assertRegex(response.content.decode(), r'<mark id="bien">\s*2 / 2 / 1 / 1.25\s*</mark>')
+
+    def test_exportar_encuestas(self):
+        self._agrega_preferencias()
+        self.client.login(username='autorizado', password='1234')
+        argumentos = (self.anno, self.cuatrimestre.name, TipoDocentes.P.name)
+
+        response = self.client.get(reverse('encuestas:exportar_encuestas', args=('preferencias', *argumentos, 'csv')))
+        self.assertTrue(response.streaming)
+        lineas = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lineas[0].split(',')[:3], ['fecha_encuesta', 'docente_id', 'docente__na_apellido'])
+        self.assertEqual(len(lineas), 3)
+        self.assertEqual([linea.split(',')[-1] for linea in lineas[1:]], ['1.0', '2.0'])
+
+        response = self.client.get(reverse('encuestas:exportar_encuestas', args=('preferencias', *argumentos, 'jsonl')))
+        filas = [json.loads(linea) for linea in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([fila['peso'] for fila in filas], [1, 2])
+        self.assertEqual({fila['turno__materia__nombre'] for fila in filas}, {self.materia.nombre})
+
+        for datos in ['otros_datos', 'cargas_pedidas']:
+            response = self.client.get(reverse('encuestas:exportar_encuestas', args=(datos, *argumentos, 'csv')))
+            self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 1)
+
+        for datos, formato in [('nada', 'csv'), ('preferencias', 'xls')]:
+            response = self.client.get(reverse('encuestas:exportar_encuestas', args=(datos, *argumentos, formato)))
+            self.assertEqual(response.status_code, 404)
+
     def test_dos_encuestas_no_provocan_excepciones(self):
         self.client.login(username='autorizado', password='1234')
         self._agrega_preferencias()
@@ -17,6 +17,10 @@ urlpatterns = [
          views.encuesta, name='encuesta'),
     path('ver_resultados_de_encuestas/<int:anno>/<str:cuatrimestre>',
          views.ver_resultados_de_encuestas, name='ver_resultados_de_encuestas'),
+    path('demanda_de_turnos/<int:anno>/<str:cuatrimestre>',
+         views.demanda_de_turnos, name='demanda_de_turnos'),
+    path('exportar_encuestas/<str:datos>/<int:anno>/<str:cuatrimestre>/<str:tipo_docente>/<str:formato>',
+         views.exportar_encuestas, name='exportar_encuestas'),
     path('encuestas_de_un_docente/<int:docente_id>/<int:anno>/<str:cuatrimestre>',
          views.encuestas_de_un_docente, name='encuestas_de_un_docente'),
 ]
@@ -1,4 +1,4 @@
-from django.http import Http404, HttpResponseRedirect, HttpResponse
+from django.http import Http404, HttpResponseRedirect, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import reverse
 from django.utils import timezone
@@ -6,19 +6,24 @@ from django.forms import ValidationError
 from django.contrib import messages
 from django.contrib.auth.decorators import permission_required, login_required
 from django.core.validators import EmailValidator
-from django.core.mail import send_mail
-from django.db.models import Count, Q
-from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Count, Q, Sum, Min, F, Case, When, Value, FloatField, OuterRef, Exists, Subquery
+from simple_history.utils import bulk_create_with_history
 
 from materias.models import Turno, Docente, Cargos, CargoDedicacion, TipoTurno, Cuatrimestres, TipoDocentes, AnnoCuatrimestre
 from materias.misc import Mapeos
 from encuestas.models import (PreferenciasDocente, OtrosDatos, CargasPedidas,
-                              EncuestasHabilitadas, GrupoCuatrimestral, telefono_validator)
+                              EncuestasHabilitadas, GrupoCuatrimestral, UltimaEncuesta, telefono_validator)
 from encuestas.forms import HabilitacionDeEncuestaForm
+from encuestas.misc import CacheEncuesta, ColaDeMails
 
 from locale import strxfrm
-from collections import Counter, namedtuple
+from collections import Counter, namedtuple, defaultdict
+from itertools import chain
 from enum import Enum
+import csv
+import json
 import logging
 import logging.config
 logger = logging.getLogger(__name__)
@@ -125,41 +130,50 @@ def checkear_y_salvar(datos, anno, cuatrimestres, tipo_docente):
     email_validator(email)
     telefono_validator(telefono)
 
-    # OtrosDatos
-    otros_datos = OtrosDatos.objects.create(docente=docente, anno=anno, cuatrimestre=cuatrimestres,
-                                            tipo_docente=tipo_docente,
-                                            fecha_encuesta=fecha_encuesta, comentario=datos['comentario'],
-                                            email=email, telefono=telefono,
-                                            cargas_declaradas=int(datos['cargas_declaradas'])
-                                            )
-
-    #  PreferenciasDocente
-    opciones = {}
-    pedidas = {}
+    # turnos elegidos: se validan todos juntos antes de guardar nada
+    elegidos = {}
     for cuatrimestre in cuatrimestres:
-        # CargasPedidas
-        cargas = int(datos[f'cargas{cuatrimestre}'])
-        cargas_pedidas = CargasPedidas.objects.create(docente=docente, anno=anno, cuatrimestre=cuatrimestre,
-                                                      tipo_docente=tipo_docente,
-                                                      fecha_encuesta=fecha_encuesta, cargas=cargas)
-        pedidas[Cuatrimestres[cuatrimestre]] = cargas
-
-        opciones_cuat = []
+        elegidos[cuatrimestre] = []
         for opcion in range(1, _turnos_maximos_por_cuatrimestre(cuatrimestre) + 1):
             opcion_id = int(datos[f'opcion{cuatrimestre}{opcion}'])
             if opcion_id >= 0:
-                turno = Turno.objects.get(pk=opcion_id)
-                peso = float(datos[f'peso{cuatrimestre}{opcion}'])
-                logger.debug('miro preferencia de docente: %s, turno: %s, peso: %s, fecha: %s',
-                             docente, turno, peso, fecha_encuesta)
-
-                pref = PreferenciasDocente.objects.create(docente=docente, turno=turno,
-                                                          tipo_docente=tipo_docente,
-                                                          peso=peso, fecha_encuesta=fecha_encuesta)
-                logger.info('Agrego preferencia de docente: %s, turno: %s, peso: %s, fecha: %s',
-                            docente, turno, peso, fecha_encuesta)
-                opciones_cuat.append(pref)
-        opciones[Cuatrimestres[cuatrimestre]] = opciones_cuat
+                elegidos[cuatrimestre].append((opcion_id, float(datos[f'peso{cuatrimestre}{opcion}'])))
+    turno_ids = {turno_id for para_cuat in elegidos.values() for turno_id, _ in para_cuat}
+    turnos = Turno.objects.select_related('materia').in_bulk(turno_ids)
+    if turno_ids - set(turnos):
+        raise Turno.DoesNotExist(f'No existen los turnos {sorted(turno_ids - set(turnos))}')
+
+    with transaction.atomic():
+        # dos envíos a la vez del mismo docente se guardan uno después del otro (ver UltimaEncuesta)
+        UltimaEncuesta.bloquear_docente(docente.id)
+
+        # OtrosDatos
+        otros_datos = OtrosDatos.objects.create(docente=docente, anno=anno, cuatrimestre=cuatrimestres,
+                                                tipo_docente=tipo_docente,
+                                                fecha_encuesta=fecha_encuesta, comentario=datos['comentario'],
+                                                email=email, telefono=telefono,
+                                                cargas_declaradas=int(datos['cargas_declaradas'])
+                                                )
+
+        # CargasPedidas
+        pedidas = {Cuatrimestres[cuatrimestre]: int(datos[f'cargas{cuatrimestre}']) for cuatrimestre in cuatrimestres}
+        CargasPedidas.objects.bulk_create([CargasPedidas(docente=docente, anno=anno, cuatrimestre=cuatrimestre.name,
+                                                         tipo_docente=tipo_docente,
+                                                         fecha_encuesta=fecha_encuesta, cargas=cargas)
+                                           for cuatrimestre, cargas in pedidas.items()])
+
+        #  PreferenciasDocente, con sus registros históricos (en postgres bulk_create les pone el id)
+        opciones = {Cuatrimestres[cuatrimestre]: [PreferenciasDocente(docente=docente, turno=turnos[turno_id],
+                                                                      tipo_docente=tipo_docente,
+                                                                      peso=peso, fecha_encuesta=fecha_encuesta)
+                                                  for turno_id, peso in elegidos[cuatrimestre]]
+                    for cuatrimestre in cuatrimestres}
+        bulk_create_with_history([pref for lista in opciones.values() for pref in lista], PreferenciasDocente)
+
+    for lista in opciones.values():
+        for pref in lista:
+            logger.info('Agrego preferencia de docente: %s, turno: %s, peso: %s, fecha: %s',
+                        docente, pref.turno, pref.peso, fecha_encuesta)
     return opciones, otros_datos, pedidas
 
 
@@ -181,12 +195,13 @@ def _generar_docentes(anno, cuatrimestres, tipo_docente):
 def _generar_contexto(anno, cuatrimestre, tipo_docente):
     tipo = TipoDocentes[tipo_docente]
     ac = AnnoCuatrimestre(anno, cuatrimestre)
-    turnos_ac = Mapeos.turnos_de_tipo_y_ac(tipo, ac)
-    necesidades = Mapeos.turno_y_necesidad(tipo, ac)
+    turnos_ac = Mapeos.turnos_de_tipo_y_ac(tipo, ac).select_related('materia')
+    cubiertas = Mapeos.cubiertas_por_turno(tipo, ac)
 
     turnos = [TurnoParaEncuesta(-1, '', True, False)]
     turnos += [TurnoParaEncuesta(turno.id, f'{turno} ({turno.horarios_info().diayhora or "sin horario"})',
-                                 turno.dificil_de_cubrir, Mapeos.necesidades_no_cubiertas(turno, tipo) <= 0)
+                                 turno.dificil_de_cubrir,
+                                 Mapeos.necesidades(turno, tipo) - cubiertas.get(turno.id, 0) <= 0)
                for turno in sorted(turnos_ac, key=lambda t: (strxfrm(t.materia.nombre), t.numero))]
 
     cantidad_de_opciones = 2 if cuatrimestre == Cuatrimestres.V.name else 5
@@ -197,6 +212,13 @@ def _generar_contexto(anno, cuatrimestre, tipo_docente):
     return OpcionesPorCuatrimestre(opciones, turnos)
 
 
+def _generar_listas(anno, cuatrimestres, tipo_docente):
+    '''int -> str -> str -> ([DocenteParaEncuesta], {Cuatrimestres: OpcionesPorCuatrimestre})'''
+    return (_generar_docentes(anno, cuatrimestres, tipo_docente),
+            {Cuatrimestres[cuatri]: _generar_contexto(anno, cuatri, tipo_docente)
+             for cuatri in cuatrimestres})
+
+
 def _modificar_contexto_con_datos_request(context, datos):
     nuevas_opciones_turnos = {}
     for cuatrimestre, opciones_turnos_cuat in context['opciones_por_cuatrimestre'].items():
@@ -230,7 +252,7 @@ def mandar_mail(opciones, otros_datos, cargas_pedidas, anno, cuatrimestres, tipo
         mensaje += f'\n\nCuatrimestre: {cuatrimestre.value}'
         mensaje += f'\n  Turnos que quiere cubrir: {cargas_pedidas[cuatrimestre]}'
         for preferencia in lista:
-            mensaje += f'\n\n    Turno: {preferencia.turno} ({preferencia.turno.horarios_info().diayhora or "sin horario"})'
+            mensaje += f'\n\n    Turno: {preferencia.turno} ({preferencia.turno.diayhora or "sin horario"})'
             mensaje +=   f'\n    Peso:  {preferencia.peso}'
 
     mensaje += f'\n\nComentarios:\n{otros_datos.comentario}'
@@ -238,22 +260,21 @@ def mandar_mail(opciones, otros_datos, cargas_pedidas, anno, cuatrimestres, tipo
     mensaje += f'\n  email:    {otros_datos.email}'
     mensaje += f'\n  teléfono: {otros_datos.telefono}'
 
-    try:
-        send_mail(subject, mensaje, settings.EMAIL_HOST_USER, [otros_datos.email])
-    except Exception as e:  # TODO: poner una excepción adecuada
-        logger.exception('no puedo mandar el mail')
+    # lo manda el comando mandar_mails
+    ColaDeMails.encolar(subject, mensaje, otros_datos.email)
 
 
 def encuesta(request, anno, cuatrimestres, tipo_docente):
     if not EncuestasHabilitadas.esta_habilitada(anno, cuatrimestres, tipo_docente, timezone.now()):
         return HttpResponse(status=403, content="La encuesta que querés llenar no está habilitada.")
 
-    opciones_por_cuatrimestre = {Cuatrimestres[cuatri]: _generar_contexto(anno, cuatri, tipo_docente)
-                                 for cuatri in cuatrimestres}
+    docentes, opciones_por_cuatrimestre = CacheEncuesta.obtener(
+        anno, cuatrimestres, tipo_docente,
+        lambda: _generar_listas(anno, cuatrimestres, tipo_docente))
 
     context = {
-        'docentes': _generar_docentes(anno, cuatrimestres, tipo_docente),
-        'opciones_por_cuatrimestre': opciones_por_cuatrimestre,
+        'docentes': docentes,
+        'opciones_por_cuatrimestre': dict(opciones_por_cuatrimestre),
         'anno': anno,
         'cuatrimestres': cuatrimestres,
         'cuatrimestres_texto': GrupoCuatrimestral[cuatrimestres].value,
@@ -273,10 +294,12 @@ def encuesta(request, anno, cuatrimestres, tipo_docente):
     except Docente.DoesNotExist:
         return _encuesta_con_mensaje_de_error(request, context, "No me dijiste quién sos")
     try:
-        opciones, otros_datos, cargas_pedidas = checkear_y_salvar(request.POST,
-                                                                  anno, cuatrimestres,
-                                                                  tipo_docente)
-        mandar_mail(opciones, otros_datos, cargas_pedidas, anno, cuatrimestres, tipo_docente)
+        # la encuesta y su mail se guardan juntos, o ninguno de los dos
+        with transaction.atomic():
+            opciones, otros_datos, cargas_pedidas = checkear_y_salvar(request.POST,
+                                                                      anno, cuatrimestres,
+                                                                      tipo_docente)
+            mandar_mail(opciones, otros_datos, cargas_pedidas, anno, cuatrimestres, tipo_docente)
         return render(request,
                       'encuestas/final.html',
                       context={'opciones': opciones, 'docente': docente,
@@ -285,6 +308,9 @@ def encuesta(request, anno, cuatrimestres, tipo_docente):
                                'comentario': otros_datos.comentario})
     except ValidationError as e:
         return _encuesta_con_mensaje_de_error(request, context, e.message)
+    except Turno.DoesNotExist:
+        # el formulario sólo ofrece turnos existentes: alguno se borró mientras se llenaba la encuesta
+        return _encuesta_con_mensaje_de_error(request, context, 'Alguno de los turnos elegidos ya no existe')
 
 
 @login_required
@@ -299,24 +325,138 @@ def ver_resultados_de_encuestas(request, anno, cuatrimestre):
     return render(request, 'encuestas/resultados_de_encuestas.html',
                   {'anno': anno, 'cuatrimestre': Cuatrimestres[cuatrimestre],
                    'docentes': docentes_con_pedidos,
+                   'tipos': list(TipoDocentes),
+                   'exportables': ['preferencias', 'otros_datos', 'cargas_pedidas'],
+                   })
+
+
+Demanda = namedtuple('Demanda', ['pedidos', 'primeras', 'peso'])
+
+
+def demanda_por_turno_y_tipo(anno, cuatrimestre):
+    '''int -> str -> {(turno_id, TipoDocentes): Demanda}
+
+    Suma, sobre las últimas encuestas (UltimaEncuesta) del período, cuántos docentes pidieron cada turno,
+    en cuántas encuestas fue una primera opción (el menor peso de la encuesta) y el total de pesos
+    normalizados como en dborrador. Se calcula en una sola consulta agrupada por (turno, tipo).
+    '''
+    de_la_encuesta = dict(docente=OuterRef('docente'), tipo_docente=OuterRef('tipo_docente'),
+                          fecha_encuesta=OuterRef('fecha_encuesta'))
+    ultima = UltimaEncuesta.objects.filter(anno=anno, cuatrimestre=cuatrimestre, **de_la_encuesta)
+    encuesta = PreferenciasDocente.objects.filter(turno__anno=anno, turno__cuatrimestre=cuatrimestre,
+                                                  **de_la_encuesta) \
+                                          .order_by().values('docente')
+
+    filas = PreferenciasDocente.objects.filter(turno__anno=anno, turno__cuatrimestre=cuatrimestre) \
+                                       .annotate(es_ultima=Exists(ultima)).filter(es_ultima=True) \
+                                       .annotate(total=Subquery(encuesta.annotate(total=Sum('peso')).values('total'),
+                                                                output_field=FloatField()),
+                                                 minimo=Subquery(encuesta.annotate(minimo=Min('peso')).values('minimo'),
+                                                                 output_field=FloatField()),
+                                                 cantidad=Subquery(encuesta.annotate(cantidad=Count('id'))
+                                                                           .values('cantidad'),
+                                                                   output_field=FloatField())) \
+                                       .order_by().values('turno_id', 'tipo_docente') \
+                                       .annotate(pedidos=Count('docente', distinct=True),
+                                                 primeras=Count('id', filter=Q(peso=F('minimo'))),
+                                                 peso=Sum(Case(When(total__gt=0, then=F('peso') / F('total')),
+                                                               default=Value(1.0, output_field=FloatField()) / F('cantidad'),
+                                                               output_field=FloatField())))
+    return {(fila['turno_id'], TipoDocentes[fila['tipo_docente']]): Demanda(fila['pedidos'], fila['primeras'],
+                                                                              fila['peso'])
+            for fila in filas}
+
+
+@login_required
+@permission_required('dborrador.add_asignacion')
+def demanda_de_turnos(request, anno, cuatrimestre):
+    demanda = demanda_por_turno_y_tipo(anno, cuatrimestre)
+    sin_pedidos = Demanda(0, 0, 0.)
+    turnos = Turno.objects.filter(anno=anno, cuatrimestre=cuatrimestre).select_related('materia') \
+                          .order_by('materia__nombre', 'numero', 'tipo')
+    filas = [(turno, [(Mapeos.necesidades(turno, tipo), demanda.get((turno.id, tipo), sin_pedidos))
+                      for tipo in TipoDocentes])
+             for turno in turnos]
+    return render(request, 'encuestas/demanda_de_turnos.html',
+                  {'anno': anno, 'cuatrimestre': Cuatrimestres[cuatrimestre],
+                   'tipos': list(TipoDocentes),
+                   'filas': filas,
                    })
 
 
+def _filas_para_exportar(datos, anno, cuatrimestre, tipo_docente):
+    '''str -> int -> str -> str -> ([str], QuerySet de tuplas)'''
+    docente = ['docente_id', 'docente__na_apellido', 'docente__na_nombre', 'tipo_docente']
+    if datos == 'preferencias':
+        filas = PreferenciasDocente.objects.filter(turno__anno=anno, turno__cuatrimestre=cuatrimestre,
+                                                   tipo_docente=tipo_docente)
+        columnas = ['fecha_encuesta', *docente, 'turno_id', 'turno__materia__nombre', 'turno__numero',
+                    'turno__tipo', 'peso']
+    elif datos == 'otros_datos':
+        filas = OtrosDatos.objects.filter(anno=anno, cuatrimestre__contains=cuatrimestre, tipo_docente=tipo_docente)
+        columnas = ['fecha_encuesta', *docente, 'anno', 'cuatrimestre', 'cargas_declaradas',
+                    'email', 'telefono', 'comentario']
+    elif datos == 'cargas_pedidas':
+        filas = CargasPedidas.objects.filter(anno=anno, cuatrimestre=cuatrimestre, tipo_docente=tipo_docente)
+        columnas = ['fecha_encuesta', *docente, 'anno', 'cuatrimestre', 'cargas']
+    else:
+        raise Http404(f'No sé exportar {datos}')
+    return columnas, filas.order_by('fecha_encuesta', 'id').values_list(*columnas)
+
+
+class _Eco:
+    '''Un "archivo" que devuelve lo que se le escribe, para que csv.writer genere las líneas.'''
+
+    def write(self, valor):
+        return valor
+
+
+@login_required
+@permission_required('dborrador.add_asignacion')
+def exportar_encuestas(request, datos, anno, cuatrimestre, tipo_docente, formato):
+    '''Exporta los datos crudos de las encuestas de un período como csv o jsonl.
+
+    Las filas salen de un cursor del lado del servidor (iterator) como tuplas y se mandan
+    a medida que se leen, sin armar objetos ni la respuesta entera en memoria.
+    '''
+    if cuatrimestre not in Cuatrimestres.__members__ or tipo_docente not in TipoDocentes.__members__:
+        raise Http404(f'No hay encuestas para {cuatrimestre}, {tipo_docente}')
+    columnas, filas = _filas_para_exportar(datos, anno, cuatrimestre, tipo_docente)
+    filas = filas.iterator(chunk_size=2000)
+
+    if formato == 'csv':
+        writer = csv.writer(_Eco())
+        lineas = (writer.writerow(fila) for fila in chain([columnas], filas))
+        content_type = 'text/csv'
+    elif formato == 'jsonl':
+        lineas = (json.dumps(dict(zip(columnas, fila)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+                  for fila in filas)
+        content_type = 'application/x-ndjson'
+    else:
+        raise Http404(f'No sé exportar en formato {formato}')
+
+    response = StreamingHttpResponse(lineas, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{datos}_{anno}{cuatrimestre}_{tipo_docente}.{formato}"'
+    return response
+
+
 @login_required
 @permission_required('dborrador.add_asignacion')
 def encuestas_de_un_docente(request, docente_id, anno, cuatrimestre):
     docente = Docente.objects.get(pk=docente_id)
 
-    fechas = {cp.fecha_encuesta
-              for cp in CargasPedidas.objects.filter(docente=docente, anno=anno, cuatrimestre=cuatrimestre)}
-
-    preferencias = {fecha: (PreferenciasDocente.objects.filter(docente=docente,
-                                                               turno__anno=anno, turno__cuatrimestre=cuatrimestre,
-                                                               fecha_encuesta=fecha),
-                            CargasPedidas.objects.get(docente=docente, anno=anno, cuatrimestre=cuatrimestre,
-                                                      fecha_encuesta=fecha).cargas
-                            )
-                    for fecha in sorted(fechas, reverse=True)}
+    cargas_de = {cp.fecha_encuesta: cp.cargas
+                 for cp in CargasPedidas.objects.filter(docente=docente, anno=anno, cuatrimestre=cuatrimestre)}
+    preferencias_de = defaultdict(list)
+    for preferencia in PreferenciasDocente.objects.filter(docente=docente, fecha_encuesta__in=list(cargas_de),
+                                                          turno__anno=anno, turno__cuatrimestre=cuatrimestre) \
+                                                  .select_related('turno__materia'):
+        preferencias_de[preferencia.fecha_encuesta].append(preferencia)
+
+    preferencias = {fecha: (preferencias_de[fecha], cargas_de[fecha])
+                    for fecha in sorted(cargas_de, reverse=True)}
+    vigentes = set(UltimaEncuesta.objects.filter(docente=docente, anno=anno, cuatrimestre=cuatrimestre)
+                                         .values_list('fecha_encuesta', flat=True))
     otros_datos = OtrosDatos.objects.filter(docente=docente, anno=anno, cuatrimestre__contains=cuatrimestre) \
                                     .order_by('-fecha_encuesta')
 
@@ -326,4 +466,5 @@ def encuestas_de_un_docente(request, docente_id, anno, cuatrimestre):
                    'docente': docente,
                    'preferencias': preferencias,
                    'otros_datos': otros_datos,
+                   'vigentes': vigentes,
                    })
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class MateriasConfig(AppConfig):
     name = 'materias'
+
+    def ready(self):
+        from . import signals
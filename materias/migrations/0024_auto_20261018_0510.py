@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materias', '0023_auto_20210516_1133'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='carga',
+            index=models.Index(fields=['anno', 'cuatrimestre'], name='carga_periodo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='turno',
+            index=models.Index(fields=['anno', 'cuatrimestre'], name='turno_periodo_idx'),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:49
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+# copia de materias.models.resumen_de_horarios al momento de esta migración, para que no cambie con el modelo
+DIAS = {'Lu': 1, 'Ma': 2, 'Mi': 3, 'Ju': 4, 'Vi': 5}
+PABELLONES = {'1': '1', '2': '2', 'I': 'Ind', '0': '0+∞'}
+
+
+def _juntar(lst):
+    distintos = len(set(lst))
+    if distintos == 0:
+        return ''
+    if distintos == 1:
+        return lst[0]
+    else:
+        return f'{ ", ".join(lst[:-1]) } y {lst[-1]}'
+
+
+def _de_a(comienzo, final):
+
+    def time_str(hms):
+        if hms.minute:
+            return f'{hms.hour}:{hms.minute:02d}'
+        return f'{hms.hour}'
+
+    return f'{time_str(comienzo)} a {time_str(final)}'
+
+
+def _aula_y_pabellon(aula, pabellon):
+    if pabellon and aula:
+        return f'{aula} (P.{PABELLONES[pabellon]})'
+    return ''
+
+
+def resumen_de_horarios(horarios):
+    horarios = sorted(horarios, key=lambda h: (DIAS[h.dia], h.comienzo))
+    orden = ''.join(f'{DIAS[h.dia]}{h.comienzo:%H%M}' for h in horarios)
+    if horarios:
+        dias = _juntar([h.dia for h in horarios])
+        horas = _juntar([_de_a(h.comienzo, h.final) for h in horarios])
+        dias_y_horas = f'{dias}: {horas}'
+    else:
+        dias_y_horas = ''
+    aulas = _juntar([_aula_y_pabellon(h.aula, h.pabellon) for h in horarios])
+    return orden, dias_y_horas, aulas
+
+
+def resume_horarios(apps, schema_editor):
+    Turno = apps.get_model('materias', 'Turno')
+    Horario = apps.get_model('materias', 'Horario')
+    horarios = defaultdict(list)
+    for horario in Horario.objects.all():
+        horarios[horario.turno_id].append(horario)
+    turnos = list(Turno.objects.all())
+    for turno in turnos:
+        turno.orden_horarios, turno.diayhora, turno.aulas = resumen_de_horarios(horarios[turno.id])
+    Turno.objects.bulk_update(turnos, ['orden_horarios', 'diayhora', 'aulas'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materias', '0024_auto_20261018_0510'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='turno',
+            name='aulas',
+            field=models.CharField(blank=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='turno',
+            name='diayhora',
+            field=models.CharField(blank=True, default='', editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='turno',
+            name='orden_horarios',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.RunPython(resume_horarios, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
 from enum import Enum
 from collections import namedtuple, defaultdict
 
+from django.db.models import Count
+
 from materias.models import Docente, Turno, Carga, TipoTurno, Cargos, CargoDedicacion, TipoDocentes, AnnoCuatrimestre
 
 
@@ -80,7 +82,8 @@ class Mapeos:
     def docentes_de_tipo(tipo, anno, cuatrimestres='VPS'):
         '''TipoDocentes -> anno -> [docente]'''
         cardeds = Mapeos.cargos_de_tipos(tipo)
-        return {carga.docente for carga in Carga.objects.filter(cargo__in=cardeds, anno=anno, cuatrimestre__in=cuatrimestres)}
+        return {carga.docente for carga in Carga.objects.filter(cargo__in=cardeds, anno=anno, cuatrimestre__in=cuatrimestres)
+                                                 .select_related('docente')}
 
     @staticmethod
     def docentes_y_cargas(tipo, ac):
@@ -169,6 +172,18 @@ class Mapeos:
         cubiertas = len([c for c in turno.carga_set.all() if Mapeos.tipo_de_carga(c) == tipo_docente])
         return Mapeos.necesidades(turno, tipo_docente) - cubiertas
 
+    @staticmethod
+    def cubiertas_por_turno(tipo_docente, ac):
+        '''TipoDocentes -> AnnoCuatrimestre -> {turno_id: int}
+
+        Cantidad de cargas de tipo_docente en cada turno del período, en una consulta agrupada.
+        Los turnos sin cargas de ese tipo no aparecen.
+        '''
+        cargas = Carga.objects.filter(turno__anno=ac.anno, turno__cuatrimestre=ac.cuatrimestre,
+                                      cargo__in=Mapeos.cargos_de_tipos(tipo_docente))
+        return dict(cargas.order_by().values('turno_id').annotate(cantidad=Count('id'))
+                                     .values_list('turno_id', 'cantidad'))
+
     @staticmethod
     def filtrar_cargas_de_tipo_le(tipo_docente, cargas):
         '''TipoDocentes -> [Carga] -> [Carga]'''
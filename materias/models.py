@@ -1,4 +1,4 @@
-from collections import namedtuple
+from collections import namedtuple, defaultdict
 from functools import total_ordering
 
 from django.db import models
@@ -111,6 +111,54 @@ def get_key_enum(enum_cls):
 
 
 TurnoInfo = namedtuple('TurnoInfo', ['tipoynumero', 'diayhora', 'aula'])
+ResumenDeHorarios = namedtuple('ResumenDeHorarios', ['orden', 'diayhora', 'aulas'])
+
+# cada horario ocupa LARGO_CLAVE_HORARIO caracteres en Turno.orden_horarios: el día y la hora de comienzo
+LARGO_CLAVE_HORARIO = 5
+
+
+def _juntar(lst):
+    distintos = len(set(lst))
+    if distintos == 0:
+        return ''
+    if distintos == 1:
+        return lst[0]
+    else:
+        return f'{ ", ".join(lst[:-1]) } y {lst[-1]}'
+
+
+def _de_a(comienzo, final):
+
+    def time_str(hms):
+        if hms.minute:
+            return f'{hms.hour}:{hms.minute:02d}'
+        return f'{hms.hour}'
+
+    return f'{time_str(comienzo)} a {time_str(final)}'
+
+
+def _aula_y_pabellon(aula, pabellon):
+    if pabellon and aula:
+        pab = [p for p in Pabellon if p.value[0] == pabellon][0]
+        return f'{aula} (P.{pab.value[1]})'
+    return ''
+
+
+def resumen_de_horarios(horarios):
+    '''[Horario] -> ResumenDeHorarios
+
+    El orden es un str que compara como la lista ordenada de (día, comienzo) de los horarios.
+    '''
+    horarios = sorted(horarios, key=lambda h: (Dias[h.dia], h.comienzo))
+    orden = ''.join(f'{Dias[h.dia].value[1]}{h.comienzo:%H%M}' for h in horarios)
+    if horarios:
+        dias = _juntar([h.dia for h in horarios])
+        horas = _juntar([_de_a(h.comienzo, h.final) for h in horarios])
+        dias_y_horas = f'{dias}: {horas}'
+    else:
+        dias_y_horas = ''
+    aulas = _juntar([_aula_y_pabellon(h.aula, h.pabellon) for h in horarios])
+    return ResumenDeHorarios(orden, dias_y_horas, aulas)
 
 
 class Materia(models.Model):
@@ -144,7 +192,18 @@ class Turno(models.Model):
     necesidad_ay2 = models.PositiveIntegerField(validators=[MaxValueValidator(15)])
     alumnos = models.PositiveIntegerField(validators=[MaxValueValidator(1000)], default=0)
     dificil_de_cubrir = models.BooleanField(default=False)
-    history = HistoricalRecords()
+    # resumen de los horarios del turno. Lo mantiene resumir_horarios cuando cambia algún horario
+    orden_horarios = models.CharField(max_length=100, blank=True, default='', editable=False)
+    diayhora = models.CharField(max_length=200, blank=True, default='', editable=False)
+    aulas = models.CharField(max_length=200, blank=True, default='', editable=False)
+    # el resumen se actualiza con bulk_update, que no deja historia: no va en la historia
+    history = HistoricalRecords(excluded_fields=['orden_horarios', 'diayhora', 'aulas'])
+
+    # el mismo orden que sorted(turnos), pero en la base
+    ORDEN_POR_HORARIO = ['materia__nombre', 'orden_horarios', 'numero']
+
+    class Meta:
+        indexes = [models.Index(fields=['anno', 'cuatrimestre'], name='turno_periodo_idx')]
 
     def __str__(self):
         numero = f' {self.numero}' if self.numero else ''
@@ -156,44 +215,39 @@ class Turno(models.Model):
         return f'{self.materia.nombre}, {TipoTurno[self.tipo].value}{numero}'
 
     def horarios_info(self):
-
-        def join(lst):
-            distintos = len(set(lst))
-            if distintos == 0:
-                return ''
-            if distintos == 1:
-                return lst[0]
-            else:
-                return f'{ ", ".join(lst[:-1]) } y {lst[-1]}'
-
         tipo = f'{TipoTurno[self.tipo].value}'
         tipoynumero = f'{tipo} {self.numero}' if self.numero else tipo
-        horarios = sorted(self.horario_set.all())
-        if horarios:
-            dias = join([h.dia for h in horarios])
-            horas = join([h.de_a() for h in horarios])
-            dias_y_horas = f'{dias}: {horas}'
-        else:
-            dias_y_horas = ''
-        aulas = join([h.aula_y_pabellon() for h in horarios])
-        return TurnoInfo(tipoynumero, dias_y_horas, aulas)
+        return TurnoInfo(tipoynumero, self.diayhora, self.aulas)
 
     def clave_para_ordenar(self):
-        return (sorted((Dias[horario.dia], horario.comienzo) for horario in self.horario_set.all()), self.numero)
+        return (self.orden_horarios, self.numero)
 
     def __lt__(self, other):
         if other.__class__ is self.__class__:
-            if other.materia == self.materia:
-                horarios_self = sorted(self.horario_set.all())
-                if not horarios_self:
+            if other.materia_id == self.materia_id:
+                if not self.orden_horarios:
                     return True
-                horarios_other = sorted(other.horario_set.all())
-                if not horarios_other:
+                if not other.orden_horarios:
                     return False
-                return horarios_self[0] < horarios_other[0]
+                return self.orden_horarios[:LARGO_CLAVE_HORARIO] < other.orden_horarios[:LARGO_CLAVE_HORARIO]
             return self.materia.nombre < other.materia.nombre
         return NotImplemented
 
+    @classmethod
+    def resumir_horarios(cls, turnos):
+        '''[Turno] -> None
+
+        Recalcula orden_horarios, diayhora y aulas de los turnos, en los objetos y en la base,
+        con una consulta para los horarios y un bulk_update (que no deja historia ni manda señales).
+        '''
+        turnos = list(turnos)
+        horarios = defaultdict(list)
+        for horario in Horario.objects.filter(turno__in=turnos):
+            horarios[horario.turno_id].append(horario)
+        for turno in turnos:
+            turno.orden_horarios, turno.diayhora, turno.aulas = resumen_de_horarios(horarios[turno.id])
+        cls.objects.bulk_update(turnos, ['orden_horarios', 'diayhora', 'aulas'])
+
     def docentes(self):
         return ' - '.join([f'{carga.docente.nombre}' for carga in self.carga_set.all()])
 
@@ -234,19 +288,10 @@ class Horario(models.Model):
         return NotImplemented
 
     def de_a(self):
-
-        def time_str(hms):
-            if hms.minute:
-                return f'{hms.hour}:{hms.minute:02d}'
-            return f'{hms.hour}'
-
-        return f'{time_str(self.comienzo)} a {time_str(self.final)}'
+        return _de_a(self.comienzo, self.final)
 
     def aula_y_pabellon(self):
-        if self.pabellon and self.aula:
-            pab = [p for p in Pabellon if p.value[0] == self.pabellon][0]
-            return f'{self.aula} (P.{pab.value[1]})'
-        return ''
+        return _aula_y_pabellon(self.aula, self.pabellon)
 
 
 telefono_validator = RegexValidator(regex=r'^\+?[0-9 -]{9,15}$',
@@ -297,6 +342,7 @@ class Carga(models.Model):
         verbose_name = 'carga docente'
         verbose_name_plural = 'cargas docentes'
         ordering = ['cargo', 'docente__na_apellido', 'docente__na_nombre']
+        indexes = [models.Index(fields=['anno', 'cuatrimestre'], name='carga_periodo_idx')]
 
     def __str__(self):
         return f'{self.docente} -> {self.turno}'
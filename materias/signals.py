@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Turno, Horario
+
+
+@receiver(post_save, sender=Horario)
+@receiver(post_delete, sender=Horario)
+def resumir_horarios_del_turno(sender, instance, **kwargs):
+    '''el turno guarda un resumen de sus horarios para ordenar y mostrar sin consultarlos'''
+    turno = instance.turno if Horario.turno.is_cached(instance) else Turno(pk=instance.turno_id)
+    Turno.resumir_horarios([turno])
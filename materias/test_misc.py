@@ -147,3 +147,21 @@ class TestMapeos(TestCase):
         carga2 = Carga.objects.create(docente=self.n, turno=turno, cargo=CargoDedicacion.TitExc.name, anno=anno, cuatrimestre=cuatrimestre)
         self.assertEqual(Mapeos.necesidades_no_cubiertas(turno, TipoDocentes.J), 7)
 
+    def test_cubiertas_por_turno(self):
+        ac = AnnoCuatrimestre(2108, Cuatrimestres.S.name)
+        turnos = [Turno.objects.create(materia=self.materia, anno=ac.anno, cuatrimestre=ac.cuatrimestre,
+                                       numero=numero, tipo=TipoTurno.T.name,
+                                       necesidad_prof=1, necesidad_jtp=8, necesidad_ay1=3, necesidad_ay2=2)
+                  for numero in range(3)]
+        for turno, cargo in [(turnos[0], CargoDedicacion.JTPExc), (turnos[0], CargoDedicacion.JTPPar),
+                             (turnos[1], CargoDedicacion.JTPExc), (turnos[1], CargoDedicacion.TitExc),
+                             (None, CargoDedicacion.JTPExc)]:
+            Carga.objects.create(docente=self.n, turno=turno, cargo=cargo.name, anno=ac.anno, cuatrimestre=ac.cuatrimestre)
+        with self.assertNumQueries(1):
+            cubiertas = Mapeos.cubiertas_por_turno(TipoDocentes.J, ac)
+        self.assertEqual(cubiertas, {turnos[0].id: 2, turnos[1].id: 1})
+        for turno in turnos:
+            self.assertEqual(Mapeos.necesidades(turno, TipoDocentes.J) - cubiertas.get(turno.id, 0),
+                             Mapeos.necesidades_no_cubiertas(turno, TipoDocentes.J))
+        self.assertEqual(Mapeos.cubiertas_por_turno(TipoDocentes.P, ac), {turnos[1].id: 1})
+
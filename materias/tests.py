@@ -10,7 +10,7 @@ from materias.models import (Cargos, Carga, Dedicaciones, CargoDedicacion, Docen
                              Materia, AliasDeMateria, Turno, TipoMateria, TipoTurno, Dias,
                              Cuatrimestres, Horario, Pabellon)
 from materias.misc import Mapeos
-from encuestas.models import PreferenciasDocente, OtrosDatos, CargasPedidas, GrupoCuatrimestral
+from encuestas.models import PreferenciasDocente, OtrosDatos, CargasPedidas, GrupoCuatrimestral, UltimaEncuesta
 from dborrador.models import Asignacion
 from usuarios.models import Usuario
 from django.contrib.auth.models import Permission
@@ -198,6 +198,33 @@ class TestModels(TestCase):
         h2 = Horario.objects.create(turno=self.turno, dia=Dias.Ju.name, comienzo=ocho, final=nueve, **aula_pab)
         self.assertLess(turno2.clave_para_ordenar(), self.turno.clave_para_ordenar())
 
+    def test_resumen_de_horarios_sigue_a_los_horarios(self):
+        turno2 = Turno.objects.create(materia=self.materia, anno=self.turno.anno, cuatrimestre=self.turno.cuatrimestre,
+                                      numero=2, tipo=TipoTurno.T.name,
+                                      necesidad_prof=0, necesidad_jtp=0, necesidad_ay1=0, necesidad_ay2=0)
+        siete, ocho, nueve = datetime.time(7), datetime.time(8), datetime.time(9)
+        h1 = Horario.objects.create(turno=self.turno, dia=Dias.Ju.name, comienzo=ocho, final=nueve,
+                                    aula='3', pabellon=Pabellon.Uno.value[0])
+        Horario.objects.create(turno=self.turno, dia=Dias.Lu.name, comienzo=siete, final=nueve,
+                               aula='3', pabellon=Pabellon.Uno.value[0])
+        Horario.objects.create(turno=turno2, dia=Dias.Ma.name, comienzo=ocho, final=nueve)
+
+        self.turno.refresh_from_db()
+        self.assertEqual(self.turno.horarios_info().diayhora, 'Lu y Ju: 7 a 9 y 8 a 9')
+        self.assertEqual(self.turno.horarios_info().aula, f'3 (P.{Pabellon.Uno.value[1]})')
+        turnos = Turno.objects.filter(materia=self.materia)
+        self.assertEqual(list(turnos.order_by(*Turno.ORDEN_POR_HORARIO)), [self.turno, turno2])
+        with self.assertNumQueries(1):
+            self.assertEqual(sorted(turnos), [self.turno, turno2])
+
+        # si cambia un horario cambia el orden
+        h1.dia = Dias.Vi.name
+        h1.save()
+        Horario.objects.filter(turno=self.turno, dia=Dias.Lu.name).delete()
+        self.assertEqual(list(turnos.order_by(*Turno.ORDEN_POR_HORARIO)), [turno2, self.turno])
+        self.turno.refresh_from_db()
+        self.assertEqual(self.turno.horarios_info().diayhora, 'Vi: 8 a 9')
+
 
 class TestPaginas(TestCase):
 
@@ -270,6 +297,25 @@ class TestPaginas(TestCase):
         self.assertLess(ubicacion_t11, ubicacion_t14)
         self.assertLess(ubicacion_t14, ubicacion_t13)
 
+    def test_pagina_principal_con_cantidad_fija_de_consultas(self):
+        self._agrega_docentes()
+        Carga.objects.create(docente=self.n, turno=self.turno11, cargo=CargoDedicacion.TitExc.name,
+                             anno=self.anno, cuatrimestre=self.cuatrimestre.name)
+        # turnos con materia y cargas con docente
+        with self.assertNumQueries(2):
+            self.client.get(f'/materias/{self.anno}{self.cuatrimestre.value}')
+
+        for numero in range(5, 10):
+            turno = Turno.objects.create(materia=self.materia2, anno=self.anno, cuatrimestre=self.cuatrimestre.name,
+                                         numero=numero, tipo=TipoTurno.P.name, **self.dict_nec)
+            Horario.objects.create(turno=turno, dia=Dias.Ma.name, comienzo=datetime.time(numero), final=datetime.time(12))
+            Carga.objects.create(docente=self.m, turno=turno, cargo=CargoDedicacion.Ay1Smx.name,
+                                 anno=self.anno, cuatrimestre=self.cuatrimestre.name)
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/materias/{self.anno}{self.cuatrimestre.value}')
+        self.assertContains(response, self.n.nombre, count=1)
+        self.assertContains(response, self.m.nombre, count=5)
+
     def test_tabla_dice_aula(self):
         response = self.client.get(f'/materias/{self.anno}{self.cuatrimestre.value}')
         self.assertContains(response, '<td class="aula">Aula: 3 (P.1)</td>')
@@ -447,6 +493,30 @@ class TestPaginas(TestCase):
         self.assertEqual(nhorario112.aula, 'xyz')
         self.assertEqual(nhorario112.pabellon, '0')
 
+    def test_administrar_solo_guarda_lo_que_cambia(self):
+        self.client.login(username='autorizado', password='1234')
+        post = {'cambiar': True}
+        for turno in Turno.objects.all():
+            post[f'alumnos_{turno.id}'] = turno.alumnos
+        for horario in Horario.objects.all():
+            post[f'aula_{horario.id}'] = horario.aula or ''
+            post[f'pabellon_{horario.id}'] = horario.pabellon or ''
+        url = f'/materias/administrar_alumnos/{self.anno}/{self.cuatrimestre.name}'
+
+        historias_de_turnos = Turno.history.count()
+        historias_de_horarios = Horario.history.count()
+        self.client.post(url, post)
+        self.assertEqual(Turno.history.count(), historias_de_turnos)
+        self.assertEqual(Horario.history.count(), historias_de_horarios)
+
+        post[f'alumnos_{self.turno12.id}'] = '13'
+        post[f'aula_{self.horario112.id}'] = 'xyz'
+        self.client.post(url, post)
+        self.assertEqual(Turno.history.count(), historias_de_turnos + 1)
+        self.assertEqual(Horario.history.count(), historias_de_horarios + 1)
+        self.assertEqual(Turno.history.latest('history_date').alumnos, 13)
+        self.assertIn('xyz', Turno.objects.get(pk=self.turno11.id).aulas)
+
     def test_administrar_convierte_vacio_a_0_en_int(self):
         self.client.login(username='autorizado', password='1234')
 
@@ -670,6 +740,33 @@ class TestPaginas(TestCase):
         for horario in Horario.objects.filter(turno=nuevo_turno11):
             self.assertIsNotNone(horario.aula)
 
+    def test_copiar_turnos_en_bloque(self):
+        self.turno11.alumnos = 40
+        self.turno11.save()
+        self.client.login(username='autorizado', password='1234')
+        url = reverse('materias:generar_cuatrimestre', args=(self.anno, self.cuatrimestre.name))
+        post = {'nuevo_anno': self.anno+1, 'nuevo_cuatrimestre': self.cuatrimestre.name,
+                f'copiar_{TipoMateria.B.name}': True, 'copiar_alumnos': True, 'resetear_necesidades': True}
+        historias = Turno.history.count()
+        response = self.client.post(url, post, follow=True)
+        self.assertContains(response, 'Ya existían: 0')
+
+        nuevos = Turno.objects.filter(anno=self.anno+1, cuatrimestre=self.cuatrimestre.name)
+        viejos = Turno.objects.filter(anno=self.anno, cuatrimestre=self.cuatrimestre.name,
+                                      materia__obligatoriedad=TipoMateria.B.name)
+        self.assertEqual(Turno.history.count(), historias + nuevos.count())
+        nuevo_turno11 = nuevos.get(materia=self.materia1, numero=1)
+        self.assertEqual(nuevo_turno11.alumnos, 40)
+        self.assertEqual(nuevo_turno11.necesidad_prof, 0)
+        self.assertEqual(nuevo_turno11.diayhora, self.turno11.diayhora)
+        self.assertEqual(nuevo_turno11.orden_horarios, self.turno11.orden_horarios)
+
+        # lo que ya está no se vuelve a copiar
+        cantidad = nuevos.count()
+        response = self.client.post(url, post, follow=True)
+        self.assertContains(response, f'Ya existían: {viejos.count()}')
+        self.assertEqual(nuevos.count(), cantidad)
+
     def test_administrar_docentes(self):
         self.client.login(username='autorizado', password='1234')
         response = self.client.get(reverse('materias:administrar_docentes'))
@@ -717,6 +814,7 @@ class TestPaginas(TestCase):
         for objeto in [carga, pref, otrosdatos, pedidas]:
             objeto.refresh_from_db()
             self.assertEqual(objeto.docente, self.n)
+        self.assertEqual(UltimaEncuesta.objects.get(docente=self.n).otros_datos, otrosdatos)
 
     def test_cambiar_cargo(self):
         self.client.login(username='autorizado', password='1234')
@@ -896,6 +994,41 @@ class TestPaginas(TestCase):
         self.assertContains(response, comentario1)
         self.assertContains(response, comentario2)
 
+    def test_cargas_docentes_anuales_despues_de_borrar_una_encuesta(self):
+        # las cargas declaradas vuelven a las de la encuesta anterior
+        self.client.login(username='autorizado', password='1234')
+        self._agrega_docentes()
+        fecha_segunda = timezone.now()
+        encuestas = [OtrosDatos.objects.create(docente=self.n, anno=self.anno, cuatrimestre=GrupoCuatrimestral.VP.name,
+                                               tipo_docente=TipoDocentes.P.name, comentario='',
+                                               cargas_declaradas=cargas_declaradas, fecha_encuesta=fecha)
+                     for cargas_declaradas, fecha in [(571, fecha_segunda - datetime.timedelta(minutes=10)),
+                                                      (348, fecha_segunda)]]
+        url = reverse('materias:cargas_docentes_anuales', args=(self.anno, self.cuatrimestre.name))
+        self.assertContains(self.client.get(url), 348)
+        encuestas[1].delete()
+        response = self.client.get(url)
+        self.assertContains(response, 571)
+        self.assertNotContains(response, 348)
+
+    def test_cargas_docentes_anuales_con_cantidad_fija_de_consultas(self):
+        self.client.login(username='autorizado', password='1234')
+        self._agrega_docentes()
+        url = reverse('materias:cargas_docentes_anuales', args=(self.anno, self.cuatrimestre.name))
+        self.client.get(url)
+
+        now = timezone.now()
+        for i in range(5):
+            docente = Docente.objects.create(na_nombre=f'docente{i}', na_apellido='Z', cargos=[CargoDedicacion.JTPPar.name])
+            for cuat in Cuatrimestres:
+                Carga.objects.create(docente=docente, anno=self.anno, cuatrimestre=cuat.name, cargo=docente.cargos[0])
+                CargasPedidas.objects.create(docente=docente, anno=self.anno, cuatrimestre=cuat.name,
+                                             cargas=1, tipo_docente=TipoDocentes.J.name, fecha_encuesta=now)
+        # no depende de la cantidad de docentes ni de cargas
+        with self.assertNumQueries(8):
+            response = self.client.get(url)
+        self.assertRegex(response.content.decode(), r'<mark id="bien">\s*1\s*</mark>')
+
     def test_cambio_cargas_docentes_anuales(self):
         self.client.login(username='autorizado', password='1234')
         self._agrega_docentes()
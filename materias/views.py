@@ -5,7 +5,9 @@ from django.db import transaction
 from django.utils import timezone
 from django.utils.dateparse import parse_time
 from django.contrib.auth.decorators import permission_required, login_required
-from django.db.models import Max, Min, Count, F
+from django.db.models import Max, Min, Count, F, Q, Prefetch
+from django.contrib import messages
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history
 
 from locale import strxfrm
 from collections import Counter, namedtuple, defaultdict
@@ -15,10 +17,13 @@ import json
 import datetime
 
 from .models import (Materia, AliasDeMateria, Turno, Horario, Cuatrimestres, TipoMateria, TipoTurno,
-                     TipoDocentes, Docente, CargoDedicacion, Carga, Pabellon, Dias, choice_enum,)
+                     TipoDocentes, Docente, CargoDedicacion, Carga, Pabellon, Dias, choice_enum,
+                     resumen_de_horarios,)
 from .misc import Mapeos, NoTurno
 from .forms import DocenteForm, MateriaForm
-from encuestas.models import PreferenciasDocente, OtrosDatos, CargasPedidas
+from encuestas.models import PreferenciasDocente, OtrosDatos, CargasPedidas, UltimaEncuesta
+from encuestas.misc import CacheEncuesta
+from dborrador.misc import CacheDistribucion
 
 
 logger = logging.getLogger(__name__)
@@ -97,19 +102,20 @@ def por_anno_y_cuatrimestre(request, anno_cuat):
     except ValueError as e:
         raise Http404(e.args[0])
     else:
-        turnos_ac = Turno.objects.filter(anno=anno, cuatrimestre=cuat).order_by('materia')
-        turnos = []
-        for tipo, tipo_largo in TIPO_DICT.items():
-            turnos_de_tipo = [(t.materia.nombre, t.clave_para_ordenar(), t)
-                              for t in turnos_ac.filter(materia__obligatoriedad=tipo.name).all()]
-            materias_de_tipo = defaultdict(list)
-            # aqui se usa que los dict quedan ordenados por momento de inserción y por eso las materias quedan ordenadas
-            for materia_nombre, clave, turno in turnos_de_tipo:
-                materias_de_tipo[materia_nombre].append((clave, turno))
-            for materia_nombre, clave_turnos in materias_de_tipo.items():
-                materias_de_tipo[materia_nombre] = [t for _, t in sorted(clave_turnos)]
-
-            turnos.append((tipo_largo, list(materias_de_tipo.items())))
+        # los turnos vienen ordenados de la base y con lo que usa el template precargado
+        turnos_ac = Turno.objects.filter(anno=anno, cuatrimestre=cuat) \
+                                 .order_by('materia', 'orden_horarios', 'numero') \
+                                 .select_related('materia') \
+                                 .prefetch_related(Prefetch('carga_set', queryset=Carga.objects.select_related('docente')))
+        materias_por_tipo = {tipo.name: defaultdict(list) for tipo in TIPO_DICT}
+        # aqui se usa que los dict quedan ordenados por momento de inserción y por eso las materias quedan ordenadas
+        for turno in turnos_ac:
+            materias_de_tipo = materias_por_tipo.get(turno.materia.obligatoriedad)
+            if materias_de_tipo is not None:
+                materias_de_tipo[turno.materia.nombre].append(turno)
+
+        turnos = [(tipo_largo, list(materias_por_tipo[tipo.name].items()))
+                  for tipo, tipo_largo in TIPO_DICT.items()]
 
         return render(request, 'materias/index.html',
                       {'turnos_por_obligatoriedad': turnos})
@@ -122,7 +128,7 @@ def filtra_materias(**kwargs):
     for tipo, tipo_largo in TIPO_DICT.items():
         tmaterias = Materia.objects.filter(obligatoriedad=tipo.name)
         materias_turnos = [
-            (materia, sorted(turnos_filtrados.filter(materia=materia)))
+            (materia, turnos_filtrados.filter(materia=materia).order_by(*Turno.ORDEN_POR_HORARIO))
             for materia in tmaterias
         ]
         materias.append((tipo_largo, materias_turnos))
@@ -194,8 +200,29 @@ def administrar(request):
     return pagina_de_administrar_con_ac(request, anno, cuatrimestre)
 
 
+def _valor_del_post(request, page_field_objeto, _type):
+    if _type is bool:
+        # checkbox aparece solo si está marcado
+        return page_field_objeto in request.POST
+    v_post = request.POST[page_field_objeto]
+    try:
+        return _type(v_post)
+    except ValueError:
+        if _type is int and v_post == '':
+            return 0
+        logger.exception('no pude convertir "%s" a tipo %s para el input %s',
+                         v_post, _type.__name__, page_field_objeto)
+        raise
+
+
+def _cambia(actual, nuevo):
+    # en los campos de texto que aceptan null, el input vacío equivale a None
+    return actual != nuevo and not (actual is None and nuevo == '')
+
+
 def administrar_general(request, anno, cuatrimestre, key_to_field, url, seccion='materias', **kwargs):
     if 'cambiar' in request.POST:
+        hubo_cambios = False
         with transaction.atomic():
 
             for modelo, modelo_key_to_field in key_to_field.items():
@@ -204,28 +231,32 @@ def administrar_general(request, anno, cuatrimestre, key_to_field, url, seccion=
                     objetos = Turno.objects.filter(anno=anno, cuatrimestre=cuatrimestre)
                 elif modelo == Horario:
                     objetos = Horario.objects.filter(turno__anno=anno, turno__cuatrimestre=cuatrimestre)
-                logger.info('modifico %d objetos tipo %s', objetos.count(), modelo.__name__)
 
+                # sólo se escriben (y dejan historia) las filas que cambiaron
+                cambiados = []
                 for objeto in objetos:
+                    cambiado = False
                     for page_field, (field, _type) in modelo_key_to_field.items():
-                        page_field_objeto = f'{page_field}_{objeto.id}'
-                        if _type is bool:
-                            # checkbox aparece solo si está marcado
-                            v = page_field_objeto in request.POST
-                        else:
-                            v_post = request.POST[page_field_objeto]
-                            try:
-                                v = _type(v_post)
-                            except ValueError:
-                                if _type is int and v_post == '':
-                                    v = 0
-                                else:
-                                    logger.exception('no pude convertir "%s" a tipo %s para el input %s',
-                                                     v_post, _type.__name__, page_field_objeto)
-                                    raise
-                        setattr(objeto, field, v)
-                        logger.debug('cambiando %s a obj. %s por %s', page_field, objeto, v)
-                    objeto.save()
+                        v = _valor_del_post(request, f'{page_field}_{objeto.id}', _type)
+                        if _cambia(getattr(objeto, field), v):
+                            setattr(objeto, field, v)
+                            cambiado = True
+                            logger.debug('cambiando %s a obj. %s por %s', page_field, objeto, v)
+                    if cambiado:
+                        cambiados.append(objeto)
+
+                logger.info('modifico %d objetos tipo %s', len(cambiados), modelo.__name__)
+                if cambiados:
+                    campos = [field for field, _ in modelo_key_to_field.values()]
+                    bulk_update_with_history(cambiados, modelo, campos, default_user=request.user)
+                    hubo_cambios = True
+                    if modelo == Horario:
+                        Turno.resumir_horarios(Turno.objects.filter(id__in={h.turno_id for h in cambiados}))
+
+        # bulk_update no manda señales: invalidamos a mano lo que invalidarían los save()
+        if hubo_cambios:
+            CacheDistribucion.invalidar(anno, cuatrimestre)
+            CacheEncuesta.invalidar(anno)
 
         return HttpResponseRedirect(f"{reverse('materias:administrar')}#{seccion}")
 
@@ -323,30 +354,42 @@ def cargas_docentes_anuales(request, anno, cuatrimestre):
     if request.method == 'POST':
         if 'salvar' in request.POST:
             reg = re.compile('^cargas_(\d+)_([a-zA-Z12]{6})_([VPS])$')
+            cantidades = {}
+            for carga_docid_cuat in request.POST:
+                m = reg.search(carga_docid_cuat)
+                if m:
+                    cantidades[(int(m.group(1)), m.group(2), m.group(3))] = int(request.POST[carga_docid_cuat])
+
+            # las cargas de cada (docente, cargo, cuatrimestre), primero las que tienen menos asignaciones
+            actuales = defaultdict(list)
+            for carga_id, docente_id, cargo, cuatri in Carga.objects.filter(anno=anno) \
+                                                                    .annotate(asignaciones=Count('asignacion')) \
+                                                                    .order_by('asignaciones', 'id') \
+                                                                    .values_list('id', 'docente_id', 'cargo', 'cuatrimestre'):
+                actuales[(docente_id, cargo, cuatri)].append(carga_id)
+
+            a_borrar = []
+            nuevas = []
+            for (docente_id, cargo, cuatri), cantidad in cantidades.items():
+                a_generar = cantidad - len(actuales[(docente_id, cargo, cuatri)])
+                if a_generar < 0:
+                    logger.warning('voy a borrar %d cargas del docente %d (%s) para el cuatrimestre %s',
+                                   -a_generar, docente_id, cargo, cuatri)
+                    a_borrar.extend(actuales[(docente_id, cargo, cuatri)][:-a_generar])
+                elif a_generar > 0:
+                    logger.warning('voy a generar %d cargas del docente %d (%s) para el cuatrimestre %s',
+                                   a_generar, docente_id, cargo, cuatri)
+                    nuevas.extend(Carga(anno=anno, cuatrimestre=cuatri, docente_id=docente_id, cargo=cargo)
+                                  for _ in range(a_generar))
+
             with transaction.atomic():
-                for carga_docid_cuat in request.POST:
-                    m = reg.search(carga_docid_cuat)
-                    if m:
-                        docente_id = int(m.group(1))
-                        docente = Docente.objects.get(pk=docente_id)
-                        cargo = m.group(2)
-                        cuatri = m.group(3)
-
-                        cantidad = int(request.POST[carga_docid_cuat])
-                        actuales = Carga.objects.filter(anno=anno, cuatrimestre=cuatri, docente=docente, cargo=cargo)
-                        a_generar = cantidad - actuales.count()
-
-                        if a_generar < 0:
-                            logger.warning('voy a borrar %d cargas de %s (%s) para el cuatrimestre %s',
-                                           -a_generar, docente, cargo, cuatri)
-                            for c in range(-a_generar):
-                                actuales.annotate(asignaciones=Count('asignacion')).order_by('asignaciones').first().delete()
-
-                        elif a_generar > 0:
-                            logger.warning('voy a generar %d cargas de %s (%s) para el cuatrimestre %s',
-                                           a_generar, docente, cargo, cuatri)
-                            for c in range(a_generar):
-                                Carga.objects.create(anno=anno, cuatrimestre=cuatri, docente=docente, cargo=cargo)
+                Carga.objects.filter(id__in=a_borrar).delete()
+                bulk_create_with_history(nuevas, Carga)
+            # bulk_create no manda señales
+            for cuatri in {carga.cuatrimestre for carga in nuevas}:
+                CacheDistribucion.invalidar(anno, cuatri)
+            if nuevas:
+                CacheEncuesta.invalidar(anno)
 
             return HttpResponseRedirect(f"{reverse('materias:administrar')}#docentes")
 
@@ -360,42 +403,63 @@ def cargas_docentes_anuales(request, anno, cuatrimestre):
             return HttpResponseRedirect(reverse('materias:cargas_docentes_anuales', args=(anno, cuatrimestre)))
 
     else:
-        cargas_anno = Carga.objects.filter(anno=anno)
-        docentes_y_cargos = {(docente, cargo)
-                             for docente in Docente.objects.filter(cargos__len__gt=0).all()
-                             for cargo in docente.cargos}
-        docentes_y_cargos |= {(carga.docente, carga.cargo) for carga in cargas_anno}
+        # cuántas cargas hay de cada (docente, cargo) en cada cuatrimestre
+        contados = {cuatri: Counter() for cuatri in Cuatrimestres}
+        for docente_id, cargo, cuatri, cantidad in Carga.objects.filter(anno=anno) \
+                                                             .order_by() \
+                                                             .values_list('docente_id', 'cargo', 'cuatrimestre') \
+                                                             .annotate(cantidad=Count('id')):
+            contados[Cuatrimestres[cuatri]][(docente_id, cargo)] = cantidad
+
+        docentes = Docente.objects.filter(Q(cargos__len__gt=0) | Q(id__in={docente_id
+                                                                            for contado in contados.values()
+                                                                            for docente_id, _ in contado}))
+        docente_de = {docente.id: docente for docente in docentes}
+        docentes_y_cargos = {(docente, cargo) for docente in docente_de.values() for cargo in docente.cargos}
+        docentes_y_cargos |= {(docente_de[docente_id], cargo)
+                              for contado in contados.values()
+                              for docente_id, cargo in contado}
         por_tipo_cargo = {tipo: {(docente, cargo)
                                  for (docente, cargo) in docentes_y_cargos if Mapeos.tipos_de_cargo(cargo) == tipo}
                           for tipo in TipoDocentes}
 
-        contados = {cuatri: Counter((carga.docente, carga.cargo)
-                                    for carga in cargas_anno.filter(cuatrimestre=cuatri.name))
-                    for cuatri in Cuatrimestres}
-
         docentes_cargos_ordenados = {tipo: sorted(por_tipo_cargo[tipo], key=lambda dc: strxfrm(dc[0].apellido_nombre))
                                      for tipo in TipoDocentes}
 
+        # lo que pidió cada docente para cada cuatrimestre en su última encuesta
+        pedidas_de = {(docente_id, tipo_docente, cuatri): cargas
+                      for docente_id, tipo_docente, cuatri, cargas in CargasPedidas.objects.filter(anno=anno)
+                      .order_by('docente_id', 'tipo_docente', 'cuatrimestre', '-fecha_encuesta')
+                      .distinct('docente_id', 'tipo_docente', 'cuatrimestre')
+                      .values_list('docente_id', 'tipo_docente', 'cuatrimestre', 'cargas')}
+
+        # los últimos datos de cada (docente, tipo) en el año y los comentarios para el cuatrimestre
+        ultimos_datos_de = {(ultima.docente_id, ultima.tipo_docente): ultima.otros_datos
+                            for ultima in UltimaEncuesta.objects.filter(anno=anno)
+                                                                .order_by('docente_id', 'tipo_docente', '-fecha_encuesta')
+                                                                .distinct('docente_id', 'tipo_docente')
+                                                                .select_related('otros_datos')}
+        comentarios_de = defaultdict(list)
+        for docente_id, tipo_docente, comentario in OtrosDatos.objects.filter(anno=anno, cuatrimestre__contains=cuatrimestre) \
+                                                                      .order_by('-fecha_encuesta') \
+                                                                      .values_list('docente_id', 'tipo_docente', 'comentario'):
+            comentarios_de[(docente_id, tipo_docente)].append(comentario)
+
         def comentarios_y_cargas_declaradas(doc_cargo, tipo):
-            otros_datos = OtrosDatos.objects.filter(anno=anno, docente=doc_cargo[0], tipo_docente=tipo.name) \
-                .order_by('-fecha_encuesta')
-            if otros_datos:
-                ultimos_datos = otros_datos.first()
-                asignadas_al_periodo = sum(contados[Cuatrimestres[cuat]][doc_cargo]
+            ultimos_datos = ultimos_datos_de.get((doc_cargo[0].id, tipo.name))
+            if ultimos_datos:
+                asignadas_al_periodo = sum(contados[Cuatrimestres[cuat]][(doc_cargo[0].id, doc_cargo[1])]
                                            for cuat in ultimos_datos.cuatrimestre)
-                return [[od.comentario for od in otros_datos.filter(anno=anno, cuatrimestre__contains=cuatrimestre)],
+                return [comentarios_de[(doc_cargo[0].id, tipo.name)],
                         ultimos_datos.cargas_declaradas,
                         asignadas_al_periodo, ultimos_datos.cuatrimestre]
             else:
                 return ['', None, None, None]
 
-        def pedidas(docente, cuat, tipo):
-            return CargasPedidas.objects.filter(docente=docente, tipo_docente=tipo.name,
-                                                anno=anno, cuatrimestre=cuat.name) \
-                .order_by('fecha_encuesta')
-
         def asignadas_pedidas_declaradas_comentario(doc_cargo, tipo):
-            asignadas_pedidas = [AsignadasPedidas(contados[cuat][doc_cargo], pedidas(doc_cargo[0], cuat, tipo))
+            docente, cargo = doc_cargo
+            asignadas_pedidas = [AsignadasPedidas(contados[cuat][(docente.id, cargo)],
+                                                  pedidas_de.get((docente.id, tipo.name, cuat.name)))
                                  for cuat in (Cuatrimestres.V, Cuatrimestres.P, Cuatrimestres.S)]
             return asignadas_pedidas + comentarios_y_cargas_declaradas(doc_cargo, tipo)
 
@@ -407,7 +471,7 @@ def cargas_docentes_anuales(request, anno, cuatrimestre):
             'anno': anno,
             'cuatrimestre': cuatrimestre,
             'cargas': cargas,
-            'generar_cargas': cargas_anno.count() == 0,
+            'generar_cargas': not any(contados.values()),
             'tipos': list(TipoDocentes),
             'cuatrimestres': [Cuatrimestres.V, Cuatrimestres.P, Cuatrimestres.S],
         }
@@ -521,7 +585,8 @@ def administrar_materia(request, materia_id, anno, cuatrimestre):
         materia = Materia.objects.get(pk=materia_id)
         context = {
             'materia': materia,
-            'turnos': sorted(Turno.objects.filter(materia=materia, anno=anno, cuatrimestre=cuatrimestre)),
+            'turnos': Turno.objects.filter(materia=materia, anno=anno, cuatrimestre=cuatrimestre)
+                                  .order_by(*Turno.ORDEN_POR_HORARIO),
             'anno': anno,
             'cuatrimestre': Cuatrimestres[cuatrimestre],
             'tipoturno': {t.name: t.value for t in TipoTurno},
@@ -739,6 +804,49 @@ def exportar_informacion(request, anno, cuatrimestre):
         return render(request, 'materias/exportar_informacion.html', context)
 
 
+ClonDeTurnos = namedtuple('ClonDeTurnos', ['turnos', 'horarios', 'ya_existian'])
+
+
+def clonar_turnos(turnos, anno, cuatrimestre, copiar_alumnos=False, resetear_necesidades=False):
+    '''[Turno] -> int -> str -> bool -> bool -> ClonDeTurnos
+
+    Copia los turnos (con sus horarios prefetcheados) al período (anno, cuatrimestre), salvo los que
+    ya están ahí. Usa un bulk_create para los turnos y otro para los horarios, con sus historias, así
+    que no se mandan señales: el resumen de horarios se calcula acá.
+    '''
+    existentes = set(Turno.objects.filter(anno=anno, cuatrimestre=cuatrimestre)
+                     .values_list('materia_id', 'numero', 'subnumero', 'tipo'))
+    nuevos = []
+    horarios_de = []
+    ya_existian = 0
+    for turno in turnos:
+        if (turno.materia_id, turno.numero, turno.subnumero, turno.tipo) in existentes:
+            ya_existian += 1
+            continue
+        nturno = Turno(materia_id=turno.materia_id, anno=anno, cuatrimestre=cuatrimestre,
+                       numero=turno.numero, subnumero=turno.subnumero, tipo=turno.tipo,
+                       necesidad_prof=turno.necesidad_prof, necesidad_jtp=turno.necesidad_jtp,
+                       necesidad_ay1=turno.necesidad_ay1, necesidad_ay2=turno.necesidad_ay2,
+                       dificil_de_cubrir=turno.dificil_de_cubrir)
+        if copiar_alumnos:
+            nturno.alumnos = turno.alumnos
+        if resetear_necesidades:
+            nturno.necesidad_prof = nturno.necesidad_jtp = nturno.necesidad_ay1 = nturno.necesidad_ay2 = 0
+        nhorarios = [Horario(dia=horario.dia, comienzo=horario.comienzo, final=horario.final,
+                             aula='', pabellon=Pabellon.Uno.value[0])
+                     for horario in turno.horario_set.all()]
+        nturno.orden_horarios, nturno.diayhora, nturno.aulas = resumen_de_horarios(nhorarios)
+        nuevos.append(nturno)
+        horarios_de.append(nhorarios)
+
+    nuevos = bulk_create_with_history(nuevos, Turno)
+    for nturno, nhorarios in zip(nuevos, horarios_de):
+        for nhorario in nhorarios:
+            nhorario.turno_id = nturno.id
+    nhorarios = bulk_create_with_history([h for nhorarios in horarios_de for h in nhorarios], Horario)
+    return ClonDeTurnos(len(nuevos), len(nhorarios), ya_existian)
+
+
 @ login_required
 @ permission_required('materias.add_turno')
 def generar_cuatrimestre(request, anno, cuatrimestre):
@@ -746,26 +854,20 @@ def generar_cuatrimestre(request, anno, cuatrimestre):
         nuevo_anno = int(request.POST['nuevo_anno'])
         nuevo_cuatrimestre = Cuatrimestres[request.POST['nuevo_cuatrimestre']]
         logger.info('Voy a copiar (%s, %s) a (%s, %s)', anno, cuatrimestre, nuevo_anno, nuevo_cuatrimestre)
+        tipos = [tipo.name for tipo in TipoMateria if f'copiar_{tipo.name}' in request.POST]
+        turnos = (Turno.objects.filter(anno=anno, cuatrimestre=cuatrimestre, materia__obligatoriedad__in=tipos)
+                  .prefetch_related('horario_set'))
         with transaction.atomic():
-            for turno in Turno.objects.filter(anno=anno, cuatrimestre=cuatrimestre):
-                tipo_materia = turno.materia.obligatoriedad
-                if f'copiar_{tipo_materia}' in request.POST:
-                    nturno, creado = Turno.objects.get_or_create(materia=turno.materia,
-                                                                 anno=nuevo_anno, cuatrimestre=nuevo_cuatrimestre.name,
-                                                                 numero=turno.numero, subnumero=turno.subnumero, tipo=turno.tipo,
-                                                                 defaults={'necesidad_prof': turno.necesidad_prof,
-                                                                           'necesidad_jtp': turno.necesidad_jtp,
-                                                                           'necesidad_ay1': turno.necesidad_ay1,
-                                                                           'necesidad_ay2': turno.necesidad_ay2,
-                                                                           'dificil_de_cubrir': turno.dificil_de_cubrir})
-                    if creado:
-                        logger.info('Generé un nuevo turno: %s', nturno)
-                        for horario in turno.horario_set.all():
-                            nhorario = Horario.objects.create(turno=nturno,
-                                                              dia=horario.dia, comienzo=horario.comienzo, final=horario.final,
-                                                              aula='', pabellon=Pabellon.Uno.value[0]
-                                                              )
-                        logger.debug('  y le puse %d horarios', turno.horario_set.count())
+            clon = clonar_turnos(turnos, nuevo_anno, nuevo_cuatrimestre.name,
+                                 copiar_alumnos='copiar_alumnos' in request.POST,
+                                 resetear_necesidades='resetear_necesidades' in request.POST)
+        logger.info('Generé %d turnos con %d horarios; %d ya existían', *clon)
+        if clon.turnos:
+            # bulk_create no manda señales
+            CacheDistribucion.invalidar(nuevo_anno, nuevo_cuatrimestre.name)
+            CacheEncuesta.invalidar(nuevo_anno)
+        messages.info(request, f'Turnos copiados a {nuevo_anno} {nuevo_cuatrimestre.value}: {clon.turnos} '
+                               f'(con {clon.horarios} horarios). Ya existían: {clon.ya_existian}')
         return HttpResponseRedirect(reverse('materias:administrar'))
 
     else:
@@ -848,6 +950,7 @@ def administrar_docentes(request):
                     docente_final.email = docente_final.email or docente.email
                     docente_final.telefono = docente_final.telefono or docente.telefono
                     docente.delete()
+                UltimaEncuesta.recalcular(docente_final)
                 docente_final.save()
 
         elif 'cambiar_cargo' in request.POST:
@@ -885,16 +988,17 @@ def administrar_docentes(request):
 @ login_required
 @ permission_required('materias.add_turno')
 def copiar_datos(request, anno, cuatrimestre):
-    otros_datos = OtrosDatos.objects.filter(anno=anno, cuatrimestre__contains=cuatrimestre)
-    logger.debug('Voy a coopiar datos de %d registros', otros_datos.count())
-    docentes = {od.docente for od in otros_datos.all()}
+    # la última encuesta de cada docente en el período, de cualquier tipo
+    ultimas = UltimaEncuesta.objects.filter(anno=anno, cuatrimestre=cuatrimestre) \
+                                    .order_by('docente_id', '-fecha_encuesta').distinct('docente_id') \
+                                    .select_related('docente', 'otros_datos')
     with transaction.atomic():
-        for docente in docentes:
-            doc_datos = otros_datos.filter(docente=docente).order_by('fecha_encuesta').last()
-            docente.email = doc_datos.email
-            docente.telefono = doc_datos.telefono
+        for ultima in ultimas:
+            docente = ultima.docente
+            docente.email = ultima.otros_datos.email
+            docente.telefono = ultima.otros_datos.telefono
             docente.save()
-    logger.info('cambié teléfono y mail de %d docentes', len(docentes))
+    logger.info('cambié teléfono y mail de %d docentes', len(ultimas))
     return HttpResponseRedirect(f"{reverse('materias:administrar')}#docentes")
 
 
@@ -921,7 +1025,8 @@ def administrar_un_docente(request, docente_id):
             logger.warning('Borré un docente: %s. Todo lo borrado es %s', docente, borrado)
             return HttpResponseRedirect(reverse('materias:administrar_docentes'))
         elif 'agregar_carga' in request.POST:
-            turnos = sorted(Turno.objects.filter(anno=anno, cuatrimestre=cuatrimestre))
+            turnos = Turno.objects.filter(anno=anno, cuatrimestre=cuatrimestre).select_related('materia') \
+                               .order_by(*Turno.ORDEN_POR_HORARIO)
             context = {
                 'docente': docente,
                 'anno': anno,
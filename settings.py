@@ -88,6 +88,33 @@ DATABASES = {
         'PORT': 5432,
     }
 }
+
+# el cuerpo de las páginas de distribución y las listas de las encuestas se guardan en disco
+# para que las compartan todos los workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'dborrador': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('DBORRADOR_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'dborrador')),
+        'TIMEOUT': 7 * 24 * 3600,
+    },
+    'encuestas': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('ENCUESTAS_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'encuestas')),
+        'TIMEOUT': 24 * 3600,
+    },
+}
+DBORRADOR_CACHE = 'dborrador'
+ENCUESTAS_CACHE = 'encuestas'
+
+# resolvedor por omisión de la distribución automática: 'allocation' o 'hungaro' (ver dborrador/resolvedores.py)
+DBORRADOR_RESOLVEDOR = 'allocation'
+
+# con "Todos juntos" y cascada, una carga puede ocupar un lugar de una categoría inferior;
+# su peso se divide por (1 - penalidad) por cada categoría que baja
+DBORRADOR_PENALIDAD_CASCADA = 0.5
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
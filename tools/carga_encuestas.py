@@ -0,0 +1,328 @@
+'''Prueba de carga de la encuesta (encuestas:encuesta).
+
+Siembra un período inventado (materias, turnos y docentes, más encuestas viejas con
+inventar_encuestas.py), habilita la encuesta y la pide con GETs y POSTs concurrentes.
+Informa latencias (p50/p95/p99), consultas por request y tasa de errores.
+
+Sólo corre en períodos sin datos reales: las encuestas van en nombre de los docentes
+inventados y --borrar borra el período entero.
+
+Sin --url los requests van en el mismo proceso con el Client de Django (un hilo y una
+conexión a la base por cada request concurrente). Con --url van por HTTP a un servidor
+local (runserver o gunicorn) y las consultas por request se miden aparte, en el proceso,
+sobre una muestra.
+
+Ejemplo, contra la base local:
+    python tools/carga_encuestas.py --anno 2999 --cuatrimestre P --docentes J --sembrar 40 300 \\
+        --requests 500 --concurrencia 20 --borrar
+'''
+import random
+import logging
+import argparse
+import queue
+import statistics
+import threading
+import re
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+from collections import Counter
+from datetime import timedelta
+from time import monotonic
+from pathlib import Path
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "distribucion.settings")
+import django
+django.setup()
+
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from materias.models import (Materia, Turno, Docente, Carga, Cuatrimestres, TipoTurno, TipoMateria,
+                             CargoDedicacion, TipoDocentes)
+from materias.misc import Mapeos
+from encuestas.models import (PreferenciasDocente, OtrosDatos, CargasPedidas, EncuestasHabilitadas,
+                              MailPendiente)
+from inventar_encuestas import inventar_encuestas
+
+
+logger = logging.getLogger('carga_encuestas')
+# los views, las señales y inventar_encuestas loguean cada request o cada docente
+for ruidoso in ('encuestas', 'dborrador', 'materias', 'inventar_encuestas'):
+    logging.getLogger(ruidoso).setLevel(logging.WARNING)
+
+# los datos inventados se reconocen por esto
+APELLIDO = 'Carga'
+DOMINIO = 'carga.invalid'
+
+CARGO_DE_TIPO = {TipoDocentes.P: CargoDedicacion.AdjPar,
+                 TipoDocentes.J: CargoDedicacion.JTPPar,
+                 TipoDocentes.A1: CargoDedicacion.Ay1Par,
+                 TipoDocentes.A2: CargoDedicacion.Ay2Par}
+
+
+def sembrar(anno, cuatrimestre, tipo, materias, docentes):
+    '''crea materias con un turno de cada tipo, docentes con cargas y encuestas viejas'''
+    with transaction.atomic():
+        for i in range(materias):
+            materia = Materia.objects.create(nombre=f'{APELLIDO} {i:04d}', obligatoriedad=TipoMateria.B.name)
+            Turno.objects.bulk_create([Turno(materia=materia, anno=anno, cuatrimestre=cuatrimestre,
+                                             numero=1, tipo=tipo_turno.name,
+                                             necesidad_prof=1, necesidad_jtp=1, necesidad_ay1=1, necesidad_ay2=1,
+                                             dificil_de_cubrir=random.random() < 0.2)
+                                       for tipo_turno in (TipoTurno.T, TipoTurno.P, TipoTurno.A)])
+        cargo = CARGO_DE_TIPO[tipo].name
+        inventados = [Docente.objects.create(na_nombre=f'docente {i:04d}', na_apellido=APELLIDO,
+                                             email=f'docente{i}@{DOMINIO}', telefono='1234', cargos=[cargo])
+                      for i in range(docentes)]
+        inventar_encuestas(anno, cuatrimestre, tipo.name, inventados)
+
+        ahora = timezone.now()
+        EncuestasHabilitadas.objects.update_or_create(anno=anno, cuatrimestres=cuatrimestre, tipo_docente=tipo.name,
+                                                      defaults={'desde': ahora - timedelta(days=1),
+                                                                'hasta': ahora + timedelta(days=1)})
+
+
+def hay_datos_ajenos(anno, cuatrimestre):
+    '''si el período tiene turnos de materias no inventadas, o cargas o encuestas de docentes no inventados'''
+    return (Turno.objects.filter(anno=anno, cuatrimestre=cuatrimestre)
+                         .exclude(materia__nombre__startswith=f'{APELLIDO} ').exists()
+            or Carga.objects.filter(anno=anno, cuatrimestre=cuatrimestre)
+                            .exclude(docente__na_apellido=APELLIDO).exists()
+            or OtrosDatos.objects.filter(anno=anno, cuatrimestre=cuatrimestre)
+                                 .exclude(docente__na_apellido=APELLIDO).exists())
+
+
+def borrar(anno, cuatrimestre):
+    '''borra todo el período, y las materias y los docentes inventados
+
+    Sólo para períodos inventados: main no corre si hay_datos_ajenos.
+    '''
+    with transaction.atomic():
+        PreferenciasDocente.objects.filter(turno__anno=anno, turno__cuatrimestre=cuatrimestre).delete()
+        OtrosDatos.objects.filter(anno=anno, cuatrimestre=cuatrimestre).delete()
+        CargasPedidas.objects.filter(anno=anno, cuatrimestre=cuatrimestre).delete()
+        MailPendiente.objects.filter(destinatario__endswith=f'@{DOMINIO}').delete()
+        Carga.objects.filter(anno=anno, cuatrimestre=cuatrimestre).delete()
+        Turno.objects.filter(anno=anno, cuatrimestre=cuatrimestre).delete()
+        EncuestasHabilitadas.objects.filter(anno=anno, cuatrimestres=cuatrimestre).delete()
+        Materia.objects.filter(nombre__startswith=f'{APELLIDO} ').delete()
+        Docente.objects.filter(na_apellido=APELLIDO).delete()
+
+
+def datos_de_post(azar, docente_ids, turno_ids, cuatrimestre):
+    '''una respuesta válida a la encuesta de un cuatrimestre'''
+    opciones = 2 if cuatrimestre == Cuatrimestres.V.name else 5
+    docente = azar.choice(docente_ids)
+    datos = {'docente': docente,
+             'email': f'docente{docente}@{DOMINIO}',
+             'telefono': '+54911 1234-5678',
+             'comentario': 'prueba de carga',
+             'cargas_declaradas': 1,
+             f'cargas{cuatrimestre}': 1}
+    for opcion, turno_id in enumerate(azar.sample(turno_ids, opciones), 1):
+        datos[f'opcion{cuatrimestre}{opcion}'] = turno_id
+        datos[f'peso{cuatrimestre}{opcion}'] = azar.randint(1, 20)
+    return datos
+
+
+class EnProceso:
+    '''requests con el Client de Django; cuenta las consultas de cada uno
+
+    pedir devuelve (metodo, segundos, estado, consultas); estado es None si hubo una excepción.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.clientes = threading.local()
+
+    def _cliente(self):
+        if not hasattr(self.clientes, 'cliente'):
+            self.clientes.cliente = Client(SERVER_NAME='localhost')
+        return self.clientes.cliente
+
+    def pedir(self, metodo, datos=None):
+        cliente = self._cliente()
+        with CaptureQueriesContext(connection) as consultas:
+            comienzo = monotonic()
+            try:
+                if metodo == 'GET':
+                    estado = cliente.get(self.path).status_code
+                else:
+                    estado = cliente.post(self.path, datos).status_code
+            except Exception:
+                logger.exception('falló un %s', metodo)
+                estado = None
+            segundos = monotonic() - comienzo
+        return metodo, segundos, estado, len(consultas)
+
+    def terminar_hilo(self):
+        connection.close()
+
+
+class PorHTTP:
+    '''requests a un servidor; cada hilo guarda su cookie de csrf. No cuenta consultas.'''
+
+    TOKEN = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+    def __init__(self, url, path):
+        self.url = url.rstrip('/') + path
+        self.hilos = threading.local()
+
+    def _abrir(self, pedido):
+        hilo = self.hilos
+        if not hasattr(hilo, 'opener'):
+            hilo.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+            hilo.token = None
+        try:
+            with hilo.opener.open(pedido, timeout=60) as respuesta:
+                cuerpo = respuesta.read().decode()
+                estado = respuesta.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        token = self.TOKEN.search(cuerpo)
+        if token:
+            hilo.token = token.group(1)
+        return estado
+
+    def pedir(self, metodo, datos=None):
+        comienzo = monotonic()
+        try:
+            if metodo == 'POST' and getattr(self.hilos, 'token', None) is None:
+                # el POST necesita el token de csrf de un GET previo
+                self._abrir(self.url)
+            if metodo == 'GET':
+                estado = self._abrir(self.url)
+            else:
+                cuerpo = urllib.parse.urlencode({**datos, 'csrfmiddlewaretoken': self.hilos.token}).encode()
+                pedido = urllib.request.Request(self.url, data=cuerpo, headers={'Referer': self.url})
+                estado = self._abrir(pedido)
+        except (urllib.error.URLError, OSError) as e:
+            logger.error('falló un %s: %s', metodo, e)
+            estado = None
+        return metodo, monotonic() - comienzo, estado, None
+
+    def terminar_hilo(self):
+        pass
+
+
+def percentiles(valores):
+    '''[float] -> (p50, p95, p99)'''
+    if not valores:
+        return (float('nan'),) * 3
+    ordenados = sorted(valores)
+    return tuple(ordenados[round(p * (len(ordenados) - 1))] for p in (0.5, 0.95, 0.99))
+
+
+def informar(resultados, segundos):
+    print(f'{len(resultados)} requests en {segundos:.1f} s ({len(resultados) / segundos:.1f} req/s)')
+    print(f'{"":6} {"n":>6} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"consultas":>10} {"errores":>8}')
+    for metodo in ('GET', 'POST'):
+        del_metodo = [r for r in resultados if r[0] == metodo]
+        if not del_metodo:
+            continue
+        p50, p95, p99 = percentiles([r[1] * 1000 for r in del_metodo])
+        consultas = [r[3] for r in del_metodo if r[3] is not None]
+        consultas = f'{statistics.mean(consultas):.1f}' if consultas else '-'
+        errores = sum(1 for r in del_metodo if r[2] != 200)
+        print(f'{metodo:6} {len(del_metodo):6d} {p50:9.1f} {p95:9.1f} {p99:9.1f} {consultas:>10} '
+              f'{errores / len(del_metodo):8.1%}')
+    estados = Counter(r[2] for r in resultados if r[2] != 200)
+    if estados:
+        print('respuestas con error:', ', '.join(f'{estado}: {n}' for estado, n in estados.items()))
+
+
+def correr(cliente, pedidos, concurrencia):
+    '''[(metodo, datos)] -> ([(metodo, segundos, estado, consultas)], segundos)'''
+    cola = queue.Queue()
+    for pedido in pedidos:
+        cola.put(pedido)
+    resultados = []
+
+    def trabajar():
+        try:
+            while True:
+                try:
+                    pedido = cola.get_nowait()
+                except queue.Empty:
+                    return
+                resultados.append(cliente.pedir(*pedido))
+        finally:
+            cliente.terminar_hilo()
+
+    comienzo = monotonic()
+    hilos = [threading.Thread(target=trabajar) for _ in range(concurrencia)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return resultados, monotonic() - comienzo
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Prueba de carga de la encuesta')
+    parser.add_argument('-a', '--anno', type=int, required=True, help='Año de la encuesta')
+    parser.add_argument('-c', '--cuatrimestre', required=True, choices=[c.name for c in Cuatrimestres])
+    parser.add_argument('-d', '--docentes', required=True, choices=[t.name for t in TipoDocentes])
+    parser.add_argument('--sembrar', type=int, nargs=2, metavar=('MATERIAS', 'DOCENTES'),
+                        help='inventar materias (con tres turnos cada una) y docentes antes de empezar')
+    parser.add_argument('--borrar', action='store_true', help='borrar el período al terminar')
+    parser.add_argument('--url', help='servidor al que pedir, ej. http://localhost:8000. Sin esto, en el proceso')
+    parser.add_argument('-n', '--requests', type=int, default=200)
+    parser.add_argument('--concurrencia', type=int, default=10)
+    parser.add_argument('--posts', type=float, default=0.3, help='proporción de POSTs')
+    parser.add_argument('--muestra', type=int, default=20, help='requests para contar consultas con --url')
+    parser.add_argument('--semilla', type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    logging.basicConfig(level=logging.WARNING)
+    tipo = TipoDocentes[args.docentes]
+    azar = random.Random(args.semilla)
+    random.seed(args.semilla)
+
+    # --borrar borra el período entero: sólo en períodos inventados
+    if hay_datos_ajenos(args.anno, args.cuatrimestre):
+        sys.exit(f'{args.anno}{args.cuatrimestre} tiene turnos, cargas o encuestas que no son inventados. '
+                 'Usar un período sin datos reales.')
+    if args.sembrar:
+        sembrar(args.anno, args.cuatrimestre, tipo, *args.sembrar)
+    try:
+        # las encuestas se mandan sólo en nombre de los docentes inventados
+        docente_ids = [docente.id for docente in Mapeos.docentes_de_tipo(tipo, args.anno, args.cuatrimestre)
+                       if docente.na_apellido == APELLIDO]
+        turno_ids = list(Mapeos.encuesta_tipo_turno(tipo).filter(anno=args.anno, cuatrimestre=args.cuatrimestre)
+                                                         .values_list('id', flat=True))
+        opciones = 2 if args.cuatrimestre == Cuatrimestres.V.name else 5
+        if not docente_ids or len(turno_ids) < opciones:
+            sys.exit(f'Faltan docentes o turnos en {args.anno}{args.cuatrimestre}. Usar --sembrar.')
+
+        pedidos = [('POST', datos_de_post(azar, docente_ids, turno_ids, args.cuatrimestre))
+                   if azar.random() < args.posts else ('GET', None)
+                   for _ in range(args.requests)]
+        path = reverse('encuestas:encuesta', args=(args.anno, args.cuatrimestre, tipo.name))
+
+        cliente = PorHTTP(args.url, path) if args.url else EnProceso(path)
+        resultados, segundos = correr(cliente, pedidos, args.concurrencia)
+        informar(resultados, segundos)
+
+        if args.url:
+            print(f'\nconsultas por request, en el proceso, sobre {args.muestra} requests:')
+            muestra, segundos = correr(EnProceso(path), pedidos[:args.muestra], 1)
+            informar(muestra, segundos)
+    finally:
+        if args.borrar:
+            borrar(args.anno, args.cuatrimestre)
+
+
+if __name__ == '__main__':
+    main()
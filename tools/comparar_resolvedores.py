@@ -0,0 +1,62 @@
+import random
+import logging
+import argparse
+from time import monotonic
+from pathlib import Path
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "distribucion.settings")
+import django
+django.setup()
+
+from dborrador.resolvedores import RESOLVEDORES
+
+
+# los resolvedores loguean cada corrida
+logging.getLogger('dborrador').setLevel(logging.WARNING)
+
+
+def instancia(cargas, turnos, opciones, semilla):
+    '''una instancia sintética con la forma de la encuesta: cada carga elige `opciones` turnos'''
+    azar = random.Random(semilla)
+    sources = {f'c{i}': 1 for i in range(cargas)}
+    # alcanzan los lugares para todas las cargas
+    targets = {f't{j}': 1 for j in range(turnos)}
+    for _ in range(max(cargas - turnos, 0)):
+        targets[f't{azar.randrange(turnos)}'] += 1
+    aristas = []
+    for source in sources:
+        elegidos = azar.sample(list(targets), opciones)
+        pesos = [azar.randint(1, 20) for _ in elegidos]
+        total = sum(pesos)
+        aristas.extend({'from': source, 'to': target, 'weight': peso / total}
+                       for target, peso in zip(elegidos, pesos))
+    return sources, targets, aristas
+
+
+def comparar(cargas, turnos, opciones, semilla):
+    sources, targets, aristas = instancia(cargas, turnos, opciones, semilla)
+    pesos_por_par = {(arista['from'], arista['to']): arista['weight'] for arista in aristas}
+    print(f'{cargas} cargas, {sum(targets.values())} lugares en {turnos} turnos, {len(aristas)} preferencias')
+    for nombre, resolvedor in RESOLVEDORES.items():
+        if not resolvedor.disponible():
+            print(f'  {nombre:12} no disponible')
+            continue
+        comienzo = monotonic()
+        pares = resolvedor().resolver(sources, targets, aristas)
+        segundos = monotonic() - comienzo
+        peso = sum(pesos_por_par[par] for par in pares)
+        print(f'  {nombre:12} {segundos:8.3f} s   asignadas: {len(pares):5}   peso total: {peso:.4f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compara los resolvedores de dborrador en instancias sintéticas')
+    parser.add_argument('--cargas', type=int, nargs='+', default=[50, 200, 500])
+    parser.add_argument('--turnos', type=float, default=0.6, help='cantidad de turnos por carga')
+    parser.add_argument('--opciones', type=int, default=5, help='preferencias por carga')
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+    for cargas in args.cargas:
+        comparar(cargas, max(args.opciones, int(cargas * args.turnos)), args.opciones, args.semilla)
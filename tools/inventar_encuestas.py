@@ -22,13 +22,19 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def inventar_encuestas(anno, cuatrimestre, tipo_de_docentes):
+def inventar_encuestas(anno, cuatrimestre, tipo_de_docentes, docentes=None):
+    '''inventa cargas y preferencias para docentes (por omisión, todos los que tienen cargos del tipo)'''
     now = timezone.now()
     tipo = TipoDocentes[tipo_de_docentes]
     cargos = set(Mapeos.cargos_de_tipos(tipo))
-    docentes = Mapeos.docentes_de_tipo(tipo)
-    turnos = Mapeos.encuesta_tipo_turno(tipo).filter(anno=anno, cuatrimestre=cuatrimestre)
+    if docentes is None:
+        docentes = Docente.objects.filter(cargos__overlap=list(cargos))
+    turnos = list(Mapeos.encuesta_tipo_turno(tipo).filter(anno=anno, cuatrimestre=cuatrimestre))
+    if not turnos:
+        logger.warning('no hay turnos para docentes de tipo %s en %s%s', tipo.value, anno, cuatrimestre)
+        return
 
+    preferencias = []
     for docente in docentes:
         doc_cargos = cargos & set(docente.cargos)
         logger.info('inventando encuestas para %s', docente)
@@ -38,11 +44,11 @@ def inventar_encuestas(anno, cuatrimestre, tipo_de_docentes):
                                         anno=anno, cuatrimestre=cuatrimestre)
 
         for turno in set(random.choices(turnos, k=5)):
-            for cargo in doc_cargos:
-                PreferenciasDocente.objects.create(docente=docente, turno=turno,
-                                                   cargo=cargo[:3],
-                                                   peso=random.randint(0, 20),
-                                                   fecha_encuesta=now)
+            preferencias.append(PreferenciasDocente(docente=docente, turno=turno,
+                                                    tipo_docente=tipo.name,
+                                                    peso=random.randint(0, 20),
+                                                    fecha_encuesta=now))
+    PreferenciasDocente.objects.bulk_create(preferencias)
 
 
 def parse():